@@ -0,0 +1,49 @@
+"""Compare opening an smrx file once per interface with the shared handle of CEDNWBConverter."""
+from time import perf_counter
+
+from spikeextractors import CEDRecordingExtractor
+
+from mease_lab_to_nwb import CEDNWBConverter
+from mease_lab_to_nwb.convert_ced import cedsmrxfile
+
+# Point this to an existing smrx file
+ced_file_path = "D:/CED_example_data/Other example/m365_pt1_590-1190secs-001.smrx"
+num_repeats = 5
+
+
+def open_separately(file_path):
+    channel_info = CEDRecordingExtractor.get_all_channels_info(file_path)
+    rhd_channels = [ch for ch, info in channel_info.items() if "Rhd" in info["title"]]
+    stim_channels = [
+        ch
+        for ch, info in channel_info.items()
+        if info["title"] in ["CED_Mech", "MechTTL", "Laser"]
+    ]
+    return (
+        CEDRecordingExtractor(file_path, smrx_channel_ids=rhd_channels),
+        CEDRecordingExtractor(file_path, smrx_channel_ids=stim_channels),
+    )
+
+
+def open_shared(file_path):
+    cedsmrxfile._open_files.clear()
+    converter = CEDNWBConverter(
+        dict(
+            CEDRecording=dict(file_path=file_path),
+            CEDStimulus=dict(file_path=file_path),
+        )
+    )
+    converter.get_metadata()
+    return converter
+
+
+if __name__ == "__main__":
+    print(f"{'method':>10} {'open (s)':>9}")
+    for method, open_function in [
+        ("separate", open_separately),
+        ("shared", open_shared),
+    ]:
+        t0 = perf_counter()
+        for _ in range(num_repeats):
+            open_function(ced_file_path)
+        print(f"{method:>10} {(perf_counter() - t0) / num_repeats:9.3f}")
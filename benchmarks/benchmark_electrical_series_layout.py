@@ -0,0 +1,104 @@
+"""Write throughput, file size and random-window read latency of the raw ElectricalSeries for several layouts."""
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+import h5py
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile, NWBHDF5IO
+
+from mease_lab_to_nwb.utils import add_electrical_series
+
+sampling_frequency = 30000.0
+num_channels = 64
+duration = 60.0  # seconds
+num_windows = 50
+window_duration = 1.0  # seconds, all channels
+channel_window_duration = 30.0  # seconds, a single channel
+layouts = dict(
+    default=dict(),
+    frames_10k=dict(chunk_frames=10000),
+    frames_10k_shuffle=dict(chunk_frames=10000, shuffle=True),
+    frames_10k_lzf=dict(chunk_frames=10000, compression="lzf"),
+    frames_100k_by_8=dict(chunk_frames=100000, chunk_channels=8),
+    frames_30k_by_1=dict(chunk_frames=30000, chunk_channels=1, shuffle=True),
+    uncompressed=dict(chunk_frames=10000, compression=None),
+)
+
+
+def make_synthetic_recording(folder_path):
+    rng = np.random.default_rng(0)
+    num_frames = int(duration * sampling_frequency)
+    # Smooth background plus noise, closer to real traces than white noise for compression
+    background = np.cumsum(rng.integers(-3, 4, (num_channels, num_frames)), axis=1)
+    traces = background + rng.integers(-20, 20, (num_channels, num_frames))
+    file_path = folder_path / "traces.npy"
+    np.save(file_path, traces.astype("int16"))
+    recording = se.NumpyRecordingExtractor(
+        timeseries=str(file_path), sampling_frequency=sampling_frequency
+    )
+    recording.set_channel_gains(0.195)
+    recording.has_unscaled = True
+    return recording
+
+
+def write_layout(recording, nwbfile_path, write_options):
+    nwbfile = NWBFile("description", "id", datetime(2020, 1, 1).astimezone())
+    se.NwbRecordingExtractor.add_devices(recording=recording, nwbfile=nwbfile)
+    se.NwbRecordingExtractor.add_electrode_groups(recording=recording, nwbfile=nwbfile)
+    se.NwbRecordingExtractor.add_electrodes(recording=recording, nwbfile=nwbfile)
+    add_electrical_series(
+        recording=recording, nwbfile=nwbfile, buffer_mb=64.0, **write_options
+    )
+    with NWBHDF5IO(str(nwbfile_path), mode="w") as io:
+        io.write(nwbfile)
+
+
+def read_windows(nwbfile_path):
+    """Median latency (ms) of reading random time windows of all channels, and of single channels."""
+    rng = np.random.default_rng(1)
+    window_frames = int(window_duration * sampling_frequency)
+    channel_window_frames = int(channel_window_duration * sampling_frequency)
+    with h5py.File(nwbfile_path, mode="r") as file:
+        dataset = file["acquisition/ElectricalSeries_raw/data"]
+        num_frames = dataset.shape[0]
+        window_times = []
+        channel_times = []
+        for _ in range(num_windows):
+            start = rng.integers(0, num_frames - window_frames)
+            t0 = perf_counter()
+            dataset[start : start + window_frames, :]
+            window_times.append(perf_counter() - t0)
+
+            start = rng.integers(0, num_frames - channel_window_frames)
+            channel = rng.integers(0, num_channels)
+            t0 = perf_counter()
+            dataset[start : start + channel_window_frames, channel]
+            channel_times.append(perf_counter() - t0)
+    return 1e3 * np.median(window_times), 1e3 * np.median(channel_times)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        recording = make_synthetic_recording(Path(tmpdir))
+        size_mb = recording.get_num_frames() * num_channels * 2 / 1e6
+        print(
+            f"{num_channels} channels, {duration:.0f} s at {sampling_frequency:.0f} Hz ({size_mb:.0f} MB); "
+            f"read latencies are medians over {num_windows} windows"
+        )
+        print(
+            f"{'layout':>20} {'write MB/s':>11} {'file MB':>8} "
+            f"{f'{window_duration:.0f} s window (ms)':>20} {f'{channel_window_duration:.0f} s channel (ms)':>21}"
+        )
+        for name, write_options in layouts.items():
+            nwbfile_path = Path(tmpdir) / f"{name}.nwb"
+            t0 = perf_counter()
+            write_layout(recording, nwbfile_path, write_options)
+            elapsed = perf_counter() - t0
+            file_mb = nwbfile_path.stat().st_size / 1e6
+            window_ms, channel_ms = read_windows(nwbfile_path)
+            print(
+                f"{name:>20} {size_mb / elapsed:11.1f} {file_mb:8.1f} {window_ms:20.1f} {channel_ms:21.1f}"
+            )
@@ -0,0 +1,42 @@
+"""Throughput of the chunked LFP extraction (band-pass filter and decimation) by number of worker processes."""
+import os
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import spikeextractors as se
+
+from mease_lab_to_nwb.lfp import compute_lfp
+
+sampling_frequency = 30000.0
+num_channels = 32
+duration = 60.0  # seconds
+num_workers_list = [1, 2, 4, 8]
+
+
+def make_synthetic_recording(folder_path):
+    rng = np.random.default_rng(0)
+    num_frames = int(duration * sampling_frequency)
+    traces = rng.normal(0, 10, (num_channels, num_frames)).astype("float32")
+    file_path = folder_path / "traces.npy"
+    np.save(file_path, traces)
+    return se.NumpyRecordingExtractor(
+        timeseries=str(file_path), sampling_frequency=sampling_frequency
+    )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        recording = make_synthetic_recording(Path(tmpdir))
+        size_mb = recording.get_num_frames() * num_channels * 4 / 1e6
+        print(
+            f"{num_channels} channels, {duration:.0f} s at {sampling_frequency:.0f} Hz "
+            f"({size_mb:.0f} MB), {os.cpu_count()} CPUs"
+        )
+        print(f"{'workers':>8} {'time (s)':>9} {'MB/s':>8}")
+        for num_workers in num_workers_list:
+            t0 = perf_counter()
+            compute_lfp(recording, num_workers=num_workers)
+            elapsed = perf_counter() - t0
+            print(f"{num_workers:8d} {elapsed:9.2f} {size_mb / elapsed:8.1f}")
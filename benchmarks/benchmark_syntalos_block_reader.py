@@ -0,0 +1,78 @@
+"""Compare the per-file get_traces path of MultiRecordingTimeExtractor with the block reader of Syntalos recordings."""
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from spikeextractors import MultiRecordingTimeExtractor
+
+from mease_lab_to_nwb import SyntalosRecordingExtractor
+
+# Point this to an existing Syntalos intan folder; its first rhd file and tsync file are used as templates
+template_folder_path = Path(
+    "D:/Syntalos/Latest Syntalos Recording _20200730/intan-signals"
+)
+num_files = 20
+num_windows = 200
+window_frames_list = [3000, 30000, 300000]
+scan_frames = 1000000
+
+
+def make_synthetic_folder(folder_path):
+    rhd_template = sorted(template_folder_path.glob("*.rhd"))[0]
+    tsync_template = next(template_folder_path.glob("*.tsync"))
+    prefix = "_".join(rhd_template.stem.split("_")[:-2])
+    start = datetime(2020, 7, 30, 12, 0, 0)
+    for i in range(num_files):
+        date = (start + timedelta(minutes=i)).strftime("%y%m%d_%H%M%S")
+        shutil.copy(rhd_template, folder_path / f"{prefix}_{date}.rhd")
+    shutil.copy(tsync_template, folder_path / tsync_template.name)
+
+
+def time_reads(get_traces, windows):
+    t0 = perf_counter()
+    for start_frame, end_frame in windows:
+        get_traces(start_frame=start_frame, end_frame=end_frame, return_scaled=False)
+    return perf_counter() - t0
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder_path = Path(tmpdir)
+        make_synthetic_folder(folder_path)
+        recording = SyntalosRecordingExtractor(folder_path=folder_path)
+        num_frames = recording.get_num_frames()
+        num_channels = recording.get_num_channels()
+        readers = dict(
+            per_file=lambda **kwargs: MultiRecordingTimeExtractor.get_traces(
+                recording, **kwargs
+            ),
+            block_reader=recording.get_traces,
+        )
+        # Warm up the page cache and open all files
+        for get_traces in readers.values():
+            time_reads(get_traces, [(0, num_frames)])
+
+        print(f"{num_files} files, {num_frames} frames, {num_channels} channels")
+        print(f"{'read':>22} {'per file (s)':>13} {'block reader (s)':>17}")
+        rng = np.random.default_rng(0)
+        for window_frames in window_frames_list:
+            # Windows centered on file boundaries, so that every read spans two files
+            boundaries = recording._block_reader.cumulative_frames[1:-1]
+            centers = rng.choice(boundaries, num_windows)
+            windows = [
+                (max(center - window_frames // 2, 0), center + window_frames // 2)
+                for center in centers
+            ]
+            times = [time_reads(get_traces, windows) for get_traces in readers.values()]
+            label = f"{num_windows} x {window_frames} frames"
+            print(f"{label:>22} {times[0]:13.2f} {times[1]:17.2f}")
+
+        windows = [
+            (start_frame, min(start_frame + scan_frames, num_frames))
+            for start_frame in range(0, num_frames, scan_frames)
+        ]
+        times = [time_reads(get_traces, windows) for get_traces in readers.values()]
+        print(f"{'sequential scan':>22} {times[0]:13.2f} {times[1]:17.2f}")
@@ -0,0 +1,43 @@
+"""Compare serial and threaded opening of a synthetic Syntalos folder made of N copies of one rhd file."""
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+from mease_lab_to_nwb import SyntalosRecordingExtractor
+
+# Point this to an existing Syntalos intan folder; its first rhd file and tsync file are used as templates
+template_folder_path = Path(
+    "D:/Syntalos/Latest Syntalos Recording _20200730/intan-signals"
+)
+num_files_list = [10, 100, 300]
+num_workers_list = [1, 4, 8, 16]
+
+
+def make_synthetic_folder(folder_path, num_files):
+    rhd_template = sorted(template_folder_path.glob("*.rhd"))[0]
+    tsync_template = next(template_folder_path.glob("*.tsync"))
+    prefix = "_".join(rhd_template.stem.split("_")[:-2])
+    start = datetime(2020, 7, 30, 12, 0, 0)
+    for i in range(num_files):
+        date = (start + timedelta(minutes=i)).strftime("%y%m%d_%H%M%S")
+        shutil.copy(rhd_template, folder_path / f"{prefix}_{date}.rhd")
+    shutil.copy(tsync_template, folder_path / tsync_template.name)
+
+
+if __name__ == "__main__":
+    print(f"{'files':>6} {'workers':>8} {'open (s)':>9}")
+    for num_files in num_files_list:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            folder_path = Path(tmpdir)
+            make_synthetic_folder(folder_path, num_files)
+            for num_workers in num_workers_list:
+                t0 = perf_counter()
+                recording = SyntalosRecordingExtractor(
+                    folder_path=folder_path, num_workers=num_workers
+                )
+                open_time = perf_counter() - t0
+                assert len(recording.recordings) == num_files
+                print(f"{num_files:6d} {num_workers:8d} {open_time:9.2f}")
+                del recording
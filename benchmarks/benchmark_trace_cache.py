@@ -0,0 +1,64 @@
+"""Cost of filling the trace cache, of a cache hit, and of reading traces from the cache rather than the source."""
+import os
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import spikeextractors as se
+
+from mease_lab_to_nwb.tracecache import TraceCache
+
+sampling_frequency = 30000.0
+num_channels = 32
+duration = 120.0  # seconds
+block_frames = 1000000
+
+
+def make_synthetic_recording(folder_path):
+    rng = np.random.default_rng(0)
+    num_frames = int(duration * sampling_frequency)
+    traces = rng.integers(-2000, 2000, (num_channels, num_frames), dtype="int16")
+    file_path = folder_path / "traces.npy"
+    np.save(file_path, traces)
+    recording = se.NumpyRecordingExtractor(
+        timeseries=str(file_path), sampling_frequency=sampling_frequency
+    )
+    recording.set_channel_gains(0.195)
+    recording.has_unscaled = True
+    return recording
+
+
+def read_all(recording):
+    num_frames = recording.get_num_frames()
+    for start in range(0, num_frames, block_frames):
+        recording.get_traces(
+            start_frame=start, end_frame=min(start + block_frames, num_frames)
+        )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        recording = make_synthetic_recording(Path(tmpdir))
+        size_mb = recording.get_num_frames() * num_channels * 2 / 1e6
+        print(
+            f"{num_channels} channels, {duration:.0f} s at {sampling_frequency:.0f} Hz "
+            f"({size_mb:.0f} MB of int16), {os.cpu_count()} CPUs"
+        )
+        cache = TraceCache(Path(tmpdir) / "cache")
+        timings = dict()
+        t0 = perf_counter()
+        cache.cache_recording(recording)
+        timings["fill the cache"] = perf_counter() - t0
+        t0 = perf_counter()
+        cached_recording = cache.cache_recording(recording)
+        timings["cache hit"] = perf_counter() - t0
+        t0 = perf_counter()
+        read_all(recording)
+        timings["read the source"] = perf_counter() - t0
+        t0 = perf_counter()
+        read_all(cached_recording)
+        timings["read the cache"] = perf_counter() - t0
+        print(f"{'':>16} {'time (s)':>9} {'MB/s':>8}")
+        for name, elapsed in timings.items():
+            print(f"{name:>16} {elapsed:9.3f} {size_mb / elapsed:8.1f}")
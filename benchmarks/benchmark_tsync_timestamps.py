@@ -0,0 +1,76 @@
+"""Compare the searchsorted tsync timestamp reconstruction against the original per-sync-point loop."""
+from time import perf_counter
+
+import numpy as np
+
+from mease_lab_to_nwb.convert_syntalos.syntalosrecordingextractor import (
+    tsync_timestamps,
+)
+
+sampling_frequency = 30000.0
+durations = [60.0, 600.0]  # seconds
+num_sync_points = [10, 100, 1000]
+max_loop_operations = (
+    2e9  # frames x sync points above which the loop version is skipped
+)
+
+
+def tsync_timestamps_loop(sync_map, num_frames, sampling_frequency):
+    tv_usec = np.arange(num_frames, dtype=np.float64) / sampling_frequency * 1e6
+    tv_adj_usec = np.arange(num_frames, dtype=np.float64) / sampling_frequency * 1e6
+
+    init_offset_usec = offset_usec = sync_map[0][0] - sync_map[0][1]
+    idx = np.where(tv_usec <= sync_map[0][0])[0]
+    tv_adj_usec[idx] -= init_offset_usec
+
+    for s, sync in enumerate(sync_map):
+        if s < len(sync_map) - 1:
+            idx = np.where((tv_usec > sync[0]) & (tv_usec <= sync_map[s + 1][0]))[0]
+            offset_usec = sync_map[s + 1][0] - sync_map[s + 1][1]
+        else:
+            idx = np.where(tv_usec > sync[0])[0]
+        tv_adj_usec[idx] -= offset_usec
+
+    return tv_adj_usec / 1e6
+
+
+def make_sync_map(duration, num_sync_points, seed=0):
+    """Evenly spread sync points with a slowly drifting device clock, in microseconds."""
+    rng = np.random.default_rng(seed)
+    master_times = np.sort(rng.uniform(0, duration * 1e6, num_sync_points)).astype(
+        np.int64
+    )
+    drift = np.cumsum(rng.integers(-50, 50, num_sync_points))
+    return np.stack([master_times, master_times - 1000 - drift], axis=1)
+
+
+if __name__ == "__main__":
+    print(
+        f"{'duration (s)':>12} {'sync points':>12} {'loop (s)':>10} {'searchsorted (s)':>17} {'speedup':>8}"
+    )
+    for duration in durations:
+        num_frames = int(duration * sampling_frequency)
+        for num_sync in num_sync_points:
+            sync_map = make_sync_map(duration, num_sync)
+
+            t0 = perf_counter()
+            timestamps = tsync_timestamps(sync_map, num_frames, sampling_frequency)
+            vectorized_time = perf_counter() - t0
+
+            if num_frames * num_sync <= max_loop_operations:
+                t0 = perf_counter()
+                loop_timestamps = tsync_timestamps_loop(
+                    sync_map, num_frames, sampling_frequency
+                )
+                loop_time = perf_counter() - t0
+                assert np.array_equal(
+                    timestamps, loop_timestamps
+                ), "Outputs are not bit-identical!"
+                loop_text = f"{loop_time:10.3f}"
+                speedup_text = f"{loop_time / vectorized_time:7.0f}x"
+            else:
+                loop_text = f"{'skipped':>10}"
+                speedup_text = f"{'-':>8}"
+            print(
+                f"{duration:12.0f} {num_sync:12d} {loop_text} {vectorized_time:17.4f} {speedup_text}"
+            )
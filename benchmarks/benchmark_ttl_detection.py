@@ -0,0 +1,76 @@
+"""Compare the vectorized TTL interval detection against the original sample-by-sample loop."""
+from time import perf_counter
+
+import numpy as np
+import spikeextractors as se
+from pynwb.misc import IntervalSeries
+
+from mease_lab_to_nwb.convert_ced.cedstimulusinterface import intervals_from_traces
+
+sampling_frequency = 30030.03
+pulse_frequency = 10.0  # Hz
+pulse_width = 0.01  # seconds
+durations = [1.0, 10.0, 60.0, 600.0]  # seconds
+max_loop_duration = 60.0  # the loop version becomes impractically slow beyond this
+
+
+def intervals_from_traces_loop(recording, channel_id):
+    interval_series = IntervalSeries("loop", "loop", data=[], timestamps=[])
+    tr = recording.get_traces(channel_id)[0]
+    dt = 1.0 / recording.get_sampling_frequency()
+    threshold = np.amin(tr) + 0.5 * np.ptp(tr)
+    i = 0
+    n = len(tr)
+    while i < n and tr[i] > threshold:
+        i = i + 1
+    try:
+        while i < n:
+            while tr[i] <= threshold:
+                i = i + 1
+            interval_start = i * dt
+            while tr[i] > threshold:
+                i = i + 1
+            interval_stop = i * dt
+            interval_series.add_interval(interval_start, interval_stop)
+    except IndexError:
+        assert i == len(tr)
+    return interval_series
+
+
+def make_recording(duration):
+    num_frames = int(duration * sampling_frequency)
+    times = np.arange(num_frames) / sampling_frequency
+    trace = 5.0 * ((times * pulse_frequency) % 1.0 < pulse_width * pulse_frequency)
+    trace += np.random.default_rng(0).normal(0, 0.05, num_frames)
+    return se.NumpyRecordingExtractor(
+        timeseries=trace[np.newaxis].astype("float32"),
+        sampling_frequency=sampling_frequency,
+    )
+
+
+if __name__ == "__main__":
+    print(
+        f"{'duration (s)':>12} {'frames':>10} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}"
+    )
+    for duration in durations:
+        recording = make_recording(duration)
+
+        t0 = perf_counter()
+        interval_series = intervals_from_traces("bench", "bench", recording, 0)
+        vectorized_time = perf_counter() - t0
+
+        if duration <= max_loop_duration:
+            t0 = perf_counter()
+            loop_interval_series = intervals_from_traces_loop(recording, 0)
+            loop_time = perf_counter() - t0
+            assert np.array_equal(
+                interval_series.timestamps, loop_interval_series.timestamps
+            )
+            loop_text = f"{loop_time:10.3f}"
+            speedup_text = f"{loop_time / vectorized_time:7.0f}x"
+        else:
+            loop_text = f"{'skipped':>10}"
+            speedup_text = f"{'-':>8}"
+        print(
+            f"{duration:12.0f} {recording.get_num_frames():10d} {loop_text} {vectorized_time:15.4f} {speedup_text}"
+        )
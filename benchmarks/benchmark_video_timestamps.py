@@ -0,0 +1,62 @@
+"""Compare the original np.append loop over video segments with the parallel, preallocated assembly."""
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from mease_lab_to_nwb.convert_syntalos.syntalosimageinterface import (
+    concatenate_video_timestamps,
+    list_video_files,
+)
+
+frames_per_segment = 1500  # one minute at 25 fps
+num_segments_list = [100, 1000, 5000]
+num_workers_list = [1, 4, 8]
+
+
+def make_synthetic_folder(folder_path, num_segments):
+    for i in range(num_segments):
+        (folder_path / f"TIS Camera_{i + 1}.mkv").touch()
+        frames = np.arange(i * frames_per_segment, (i + 1) * frames_per_segment)
+        pd.DataFrame(dict(frame=frames, timestamp=frames * 40)).to_csv(
+            folder_path / f"TIS Camera_{i + 1}_timestamps.csv", sep=";", index=False
+        )
+
+
+def append_video_timestamps(video_file_paths):
+    video_timestamps = np.empty(0)
+    for video_file_path in video_file_paths:
+        video_time_df = pd.read_csv(
+            str(video_file_path).replace(".mkv", "_timestamps.csv"),
+            delimiter=";",
+            skipinitialspace=True,
+        )
+        video_timestamps = np.append(
+            video_timestamps, video_time_df["timestamp"].to_numpy() / 1e3
+        )
+    return video_timestamps
+
+
+if __name__ == "__main__":
+    print(f"{'segments':>9} {'method':>12} {'time (s)':>9}")
+    for num_segments in num_segments_list:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            folder_path = Path(tmpdir)
+            make_synthetic_folder(folder_path, num_segments)
+            video_file_paths = list_video_files(folder_path)
+
+            t0 = perf_counter()
+            append_timestamps = append_video_timestamps(video_file_paths)
+            print(f"{num_segments:9d} {'np.append':>12} {perf_counter() - t0:9.2f}")
+            for num_workers in num_workers_list:
+                t0 = perf_counter()
+                timestamps, _ = concatenate_video_timestamps(
+                    video_file_paths, num_workers=num_workers
+                )
+                elapsed = perf_counter() - t0
+                assert np.array_equal(timestamps, append_timestamps)
+                print(
+                    f"{num_segments:9d} {f'{num_workers} workers':>12} {elapsed:9.2f}"
+                )
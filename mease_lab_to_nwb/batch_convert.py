@@ -0,0 +1,430 @@
+"""Convert many CED and Syntalos sessions in parallel, from a root directory or a manifest of sessions."""
+import csv
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+
+import toml
+
+SESSION_TYPES = ["ced", "syntalos"]
+SUMMARY_FIELDS = [
+    "session",
+    "type",
+    "status",
+    "seconds",
+    "input_gb",
+    "gb_per_s",
+    "nwbfile_path",
+    "error",
+]
+STATUS_SUFFIX = ".status.json"
+
+
+def make_session(
+    session_type: str,
+    path: str,
+    nwbfile_path: Optional[str] = None,
+    session_description: Optional[str] = None,
+    session_start: Optional[str] = None,
+):
+    """
+    Describe a session to convert.
+
+    Parameters
+    ----------
+    session_type: str
+        "ced" or "syntalos".
+    path: str
+        Path to the .smrx file for CED, or to the session folder (containing intan-signals) for Syntalos.
+    nwbfile_path: str, optional
+        Output path. Defaults to the .smrx path with a .nwb suffix for CED, and to
+        <session folder>/<session folder name>.nwb for Syntalos.
+    session_description: str, optional
+    session_start: str or datetime, optional
+        Session start time (a string in ISO format or a datetime), only used for CED sessions (Syntalos sessions get it from the file names).
+        Defaults to 1970-01-01, as in convert_ced.py.
+    """
+    assert (
+        session_type in SESSION_TYPES
+    ), f"Unknown session type '{session_type}'! Options: {SESSION_TYPES}"
+    path = Path(path)
+    if nwbfile_path is None:
+        if session_type == "ced":
+            nwbfile_path = path.with_suffix(".nwb")
+        else:
+            nwbfile_path = path / f"{path.name}.nwb"
+    return dict(
+        type=session_type,
+        path=str(path),
+        nwbfile_path=str(nwbfile_path),
+        session_description=session_description or "Enter session description here.",
+        session_start=session_start or None,
+    )
+
+
+def find_sessions(root_path: str):
+    """
+    Find the sessions below a root directory.
+
+    Every .smrx file is a CED session, and every folder with an intan-signals subfolder is a Syntalos session.
+    """
+    root_path = Path(root_path)
+    sessions = [
+        make_session("ced", file_path)
+        for file_path in sorted(root_path.rglob("*.smrx"))
+    ]
+    sessions.extend(
+        make_session("syntalos", intan_folder_path.parent)
+        for intan_folder_path in sorted(root_path.rglob("intan-signals"))
+        if intan_folder_path.is_dir()
+    )
+    return sessions
+
+
+def read_manifest(manifest_path: str):
+    """
+    Read the sessions of a manifest file.
+
+    A CSV manifest has one row per session, with the columns type and path, and optionally nwbfile_path,
+    session_description and session_start. A TOML manifest has one [[session]] table per session with the same keys.
+    Relative paths are relative to the manifest.
+    """
+    manifest_path = Path(manifest_path)
+    if manifest_path.suffix == ".toml":
+        rows = toml.load(manifest_path).get("session", [])
+    elif manifest_path.suffix == ".csv":
+        with open(manifest_path, "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        raise ValueError("The manifest must be a .csv or a .toml file!")
+
+    sessions = []
+    for row in rows:
+        row = {key: value for key, value in row.items() if value not in [None, ""]}
+        paths = {
+            key: str(manifest_path.parent / row[key])
+            for key in ["path", "nwbfile_path"]
+            if key in row
+        }
+        sessions.append(
+            make_session(
+                session_type=row["type"].lower(),
+                path=paths["path"],
+                nwbfile_path=paths.get("nwbfile_path"),
+                session_description=row.get("session_description"),
+                session_start=row.get("session_start"),
+            )
+        )
+    return sessions
+
+
+def get_input_files(session: dict):
+    """Files read by the conversion of a session."""
+    path = Path(session["path"])
+    if session["type"] == "ced":
+        return [path]
+    return [
+        file_path
+        for folder_path in [path / "intan-signals", path / "events", path / "videos"]
+        if folder_path.is_dir()
+        for file_path in folder_path.rglob("*")
+        if file_path.is_file() and not file_path.name.startswith(".")
+    ]
+
+
+def get_status_path(nwbfile_path: str):
+    """Path of the status file of a batch conversion, next to the NWBFile."""
+    return Path(f"{nwbfile_path}{STATUS_SUFFIX}")
+
+
+def get_partial_path(nwbfile_path: str):
+    """Path of the NWBFile while it is being written, renamed to nwbfile_path once the conversion succeeds."""
+    nwbfile_path = Path(nwbfile_path)
+    return nwbfile_path.with_name(f".{nwbfile_path.name}.partial")
+
+
+def write_status(nwbfile_path: str, **status):
+    """Record a successful conversion, with the size and modification time of the NWBFile it wrote."""
+    stat = Path(nwbfile_path).stat()
+    with open(get_status_path(nwbfile_path), "w") as f:
+        json.dump(
+            dict(status, size=stat.st_size, mtime_ns=stat.st_mtime_ns), f, indent=2
+        )
+
+
+def is_up_to_date(session: dict):
+    """
+    Whether the NWBFile of a session was written by a successful conversion and is more recent than all of its
+    input files.
+
+    The status file written after a successful conversion must match the size and modification time of the
+    NWBFile, so that a file left by a failed or interrupted conversion is never up to date.
+    """
+    nwbfile_path = Path(session["nwbfile_path"])
+    if not nwbfile_path.is_file():
+        return False
+    try:
+        with open(get_status_path(nwbfile_path), "r") as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stat = nwbfile_path.stat()
+    if (
+        status.get("status") != "converted"
+        or status.get("size") != stat.st_size
+        or status.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        return False
+    return all(
+        file_path.stat().st_mtime <= stat.st_mtime
+        for file_path in get_input_files(session)
+    )
+
+
+def convert_session(session: dict, stub_test: bool = False):
+    """
+    Convert a single session, as in convert_ced.py and convert_syntalos.py, and return its summary row.
+
+    The NWBFile is written to a hidden partial file next to it (see get_partial_path), which replaces the NWBFile
+    and gets a status file only if the conversion succeeds; it is deleted otherwise.
+    """
+    from mease_lab_to_nwb import CEDNWBConverter, SyntalosNWBConverter
+
+    path = Path(session["path"])
+    partial_path = get_partial_path(session["nwbfile_path"])
+    input_gb = sum(file_path.stat().st_size for file_path in get_input_files(session))
+    input_gb /= 1e9
+    t0 = perf_counter()
+    try:
+        if session["type"] == "ced":
+            source_data = dict(
+                CEDRecording=dict(file_path=str(path)),
+                CEDStimulus=dict(file_path=str(path)),
+            )
+            conversion_options = dict(
+                CEDRecording=dict(stub_test=stub_test),
+                CEDStimulus=dict(stub_test=stub_test),
+            )
+            converter = CEDNWBConverter(source_data)
+            metadata = converter.get_metadata()
+            session_start = session["session_start"] or datetime(1970, 1, 1)
+            if isinstance(session_start, str):
+                session_start = datetime.fromisoformat(session_start)
+            metadata["NWBFile"].update(session_start_time=session_start)
+        else:
+            source_data = dict(
+                SyntalosRecording=dict(folder_path=str(path / "intan-signals"))
+            )
+            event_file_path = path / "events" / "table.csv"
+            if event_file_path.is_file():
+                source_data.update(SyntalosEvent=dict(file_path=str(event_file_path)))
+            video_folder_path = path / "videos"
+            if video_folder_path.is_dir():
+                source_data.update(
+                    SyntalosImage=dict(folder_path=str(video_folder_path))
+                )
+            conversion_options = dict(SyntalosRecording=dict(stub_test=stub_test))
+            converter = SyntalosNWBConverter(source_data)
+            metadata = converter.get_metadata()
+        metadata["NWBFile"].update(session_description=session["session_description"])
+        converter.run_conversion(
+            nwbfile_path=str(partial_path),
+            metadata=metadata,
+            conversion_options=conversion_options,
+            overwrite=True,
+        )
+        os.replace(partial_path, session["nwbfile_path"])
+        status, error = "converted", ""
+    except Exception as e:
+        traceback.print_exc()
+        status, error = "failed", f"{type(e).__name__}: {e}"
+        if partial_path.exists():
+            partial_path.unlink()
+    seconds = perf_counter() - t0
+    if status == "converted":
+        write_status(
+            session["nwbfile_path"],
+            status=status,
+            finished=datetime.now().isoformat(),
+            seconds=round(seconds, 3),
+        )
+    return dict(
+        session=session["path"],
+        type=session["type"],
+        status=status,
+        seconds=round(seconds, 3),
+        input_gb=round(input_gb, 6),
+        gb_per_s=round(input_gb / seconds, 6) if status == "converted" else "",
+        nwbfile_path=session["nwbfile_path"],
+        error=error,
+    )
+
+
+def get_num_workers(
+    num_workers: Optional[int] = None,
+    memory_budget_gb: Optional[float] = None,
+    memory_per_session_gb: float = 2.0,
+):
+    """
+    Number of sessions converted at once.
+
+    Each running conversion is assumed to use up to memory_per_session_gb of memory (the recordings are streamed,
+    so this does not grow with the size of the session), so at most memory_budget_gb / memory_per_session_gb
+    sessions run at once.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if memory_budget_gb is not None:
+        num_workers = min(num_workers, int(memory_budget_gb // memory_per_session_gb))
+    return max(num_workers, 1)
+
+
+def run_batch_conversion(
+    sessions: list,
+    summary_path: Optional[str] = None,
+    num_workers: Optional[int] = None,
+    memory_budget_gb: Optional[float] = None,
+    memory_per_session_gb: float = 2.0,
+    overwrite: bool = False,
+    stub_test: bool = False,
+):
+    """
+    Convert sessions in a process pool.
+
+    Parameters
+    ----------
+    sessions: list
+        Sessions to convert, as returned by find_sessions or read_manifest.
+    summary_path: str, optional
+        If given, the summary is written to this CSV file.
+    num_workers: int, optional
+        Maximum number of processes. Defaults to the number of CPUs.
+    memory_budget_gb: float, optional
+        Total memory available to the conversions. The default is no limit.
+    memory_per_session_gb: float, optional
+        Memory assumed to be used by each conversion. The default is 2 GB.
+    overwrite: bool, optional
+        If False (default), sessions whose NWBFile was written by a successful conversion and is more recent than
+        their input files are skipped (see is_up_to_date).
+    stub_test: bool, optional
+        If True, truncates all data to a small size for fast testing. The default is False.
+
+    Returns
+    -------
+    summary: list
+        One dict per session with its status, conversion time, input size and throughput in GB/s.
+    """
+    num_workers = get_num_workers(
+        num_workers=num_workers,
+        memory_budget_gb=memory_budget_gb,
+        memory_per_session_gb=memory_per_session_gb,
+    )
+    summary = []
+    to_convert = []
+    for session in sessions:
+        if not overwrite and is_up_to_date(session):
+            summary.append(
+                dict(
+                    session=session["path"],
+                    type=session["type"],
+                    status="up to date",
+                    nwbfile_path=session["nwbfile_path"],
+                )
+            )
+        else:
+            to_convert.append(session)
+    print(
+        f"Converting {len(to_convert)} sessions with {num_workers} workers "
+        f"({len(summary)} already up to date)."
+    )
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for row in executor.map(
+            convert_session, to_convert, [stub_test] * len(to_convert)
+        ):
+            print(
+                f"{row['status']}: {row['session']} ({row['seconds']:.1f} s, {row['gb_per_s'] or 0:.3f} GB/s)"
+            )
+            summary.append(row)
+
+    if summary_path is not None:
+        with open(summary_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summary)
+        print(f"Summary saved at {summary_path}!")
+    return summary
+
+
+def parse_arguments():
+    """
+    Command line batch conversion.
+
+    Usage:
+    $ mease-batch-convert [source] [--summary] [--workers] [--memory-budget] [--overwrite] [--stub]
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert many CED and Syntalos sessions to NWB in parallel.",
+    )
+    parser.add_argument(
+        "source",
+        help="Root directory to search for sessions, or a .csv/.toml manifest of sessions.",
+    )
+    parser.add_argument(
+        "--summary",
+        default="conversion_summary.csv",
+        help="Path of the CSV summary. Defaults to conversion_summary.csv.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Maximum number of processes."
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=None,
+        help="Total memory (GB) available to the conversions.",
+    )
+    parser.add_argument(
+        "--memory-per-session",
+        type=float,
+        default=2.0,
+        help="Memory (GB) assumed to be used by each conversion. Defaults to 2.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Convert sessions even if their NWBFile is up to date.",
+    )
+    parser.add_argument(
+        "--stub", action="store_true", help="Truncate all data for fast testing."
+    )
+    return parser.parse_args()
+
+
+def batch_convert_shortcut():
+    run_args = parse_arguments()
+    source = Path(run_args.source)
+    if source.is_dir():
+        sessions = find_sessions(source)
+    else:
+        sessions = read_manifest(source)
+    run_batch_conversion(
+        sessions=sessions,
+        summary_path=run_args.summary,
+        num_workers=run_args.workers,
+        memory_budget_gb=run_args.memory_budget,
+        memory_per_session_gb=run_args.memory_per_session,
+        overwrite=run_args.overwrite,
+        stub_test=run_args.stub,
+    )
+
+
+if __name__ == "__main__":
+    batch_convert_shortcut()
@@ -0,0 +1,58 @@
+"""Declarative routing of the channels of an smrx file to the data interfaces of the CED converter."""
+import re
+from typing import Optional
+
+# Each rule routes the channels it matches to an interface of CEDNWBConverter. A rule matches a channel if all of
+# its conditions hold: "title" and "unit" are regular expressions searched in the channel title and units, and
+# "rate" is an inclusive (min, max) range of sampling rates in Hz. Stimulus rules also give the role of the
+# channel in CEDStimulusInterface. The first matching rule wins, and unmatched channels are never read.
+CHANNEL_RULES = [
+    dict(target="CEDRecording", title=r"Rhd"),
+    dict(target="CEDStimulus", title=r"^CED_Mech$", role="mechanical_pressure"),
+    dict(target="CEDStimulus", title=r"^MechTTL$", role="mechanical_ttl"),
+    dict(target="CEDStimulus", title=r"^Laser$", role="laser"),
+    dict(target="CEDLFP", title=r"LFP"),
+]
+
+
+def match_channel_rule(info: dict, rule: dict):
+    """Whether the info of an smrx channel (as returned by get_channel_info) satisfies the conditions of a rule."""
+    if "title" in rule and re.search(rule["title"], info["title"]) is None:
+        return False
+    if "unit" in rule and re.search(rule["unit"], info["unit"]) is None:
+        return False
+    if "rate" in rule and not rule["rate"][0] <= info["rate"] <= rule["rate"][1]:
+        return False
+    return True
+
+
+def route_channels(channels_info: dict, rules: Optional[list] = None):
+    """
+    Route the channels of an smrx file with a rule table.
+
+    Parameters
+    ----------
+    channels_info: dict
+        The info of each channel, by smrx channel index (see SmrxFile.channels_info).
+    rules: list, optional
+        The rule table. Defaults to CHANNEL_RULES.
+
+    Returns
+    -------
+    routes: dict
+        For each target with at least one channel, a dict with the smrx_channel_ids routed to it, in channel order,
+        and their roles (None for rules without a role).
+    """
+    if rules is None:
+        rules = CHANNEL_RULES
+    routes = dict()
+    for ch, info in sorted(channels_info.items()):
+        for rule in rules:
+            if match_channel_rule(info, rule):
+                route = routes.setdefault(
+                    rule["target"], dict(smrx_channel_ids=[], roles=[])
+                )
+                route["smrx_channel_ids"].append(ch)
+                route["roles"].append(rule.get("role"))
+                break
+    return routes
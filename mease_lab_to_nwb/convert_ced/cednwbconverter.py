@@ -1,13 +1,26 @@
 """Authors: Cody Baker and Ben Dichter."""
 from pathlib import Path
 from datetime import datetime
+from time import perf_counter
 from typing import Optional
 
 import spikeextractors as se
-from pynwb import NWBHDF5IO
-from nwb_conversion_tools import NWBConverter, CEDRecordingInterface
+from pynwb import NWBFile, NWBHDF5IO
+from nwb_conversion_tools import NWBConverter
 from nwb_conversion_tools.utils.spike_interface import write_recording
 
+from ..lfp import add_lfp_electrical_series
+from ..resumablewrite import (
+    check_resumable_write,
+    get_conversion_fingerprint,
+    get_resume_conversion_options,
+    load_journal,
+    write_nwbfile_resumable,
+)
+from ..utils import get_timing_report, prepare_interfaces, record_conversion_times
+from .cedchannelrules import route_channels
+from .cedrecordinginterface import CEDLFPInterface, CEDRecordingInterface
+from .cedsmrxfile import get_smrx_file
 from .cedstimulusinterface import CEDStimulusInterface
 
 
@@ -43,22 +56,40 @@ def quick_write(
 
 class CEDNWBConverter(NWBConverter):
     data_interface_classes = dict(
-        CEDRecording=CEDRecordingInterface, CEDStimulus=CEDStimulusInterface
+        CEDRecording=CEDRecordingInterface,
+        CEDStimulus=CEDStimulusInterface,
+        CEDLFP=CEDLFPInterface,
     )
 
-    def __init__(self, source_data):
-        channel_info = self.data_interface_classes[
-            "CEDRecording"
-        ].RX.get_all_channels_info(source_data["CEDRecording"]["file_path"])
-        rhd_channels = []
-        stim_channels = []
-        for ch, info in channel_info.items():
-            if "Rhd" in info["title"]:
-                rhd_channels.append(ch)
-            if info["title"] in ["CED_Mech", "MechTTL", "Laser"]:
-                stim_channels.append(ch)
-        source_data["CEDRecording"].update(smrx_channel_ids=rhd_channels)
-        source_data["CEDStimulus"].update(smrx_channel_ids=stim_channels)
+    def __init__(self, source_data, channel_rules: Optional[list] = None):
+        """
+        Route the channels of the smrx file to the interfaces with a rule table.
+
+        The smrx file is opened and its channel table parsed once; all interfaces then share that handle
+        (see cedsmrxfile.get_smrx_file). Each interface in source_data gets the channels routed to it, and the
+        CEDLFP interface is added if any channel is routed to it.
+
+        Parameters
+        ----------
+        source_data : dict
+        channel_rules : list, optional
+            The rule table, see cedchannelrules.CHANNEL_RULES (the default).
+        """
+        file_path = source_data["CEDRecording"]["file_path"]
+        routes = route_channels(
+            get_smrx_file(file_path).channels_info, rules=channel_rules
+        )
+        if "CEDLFP" in routes:
+            source_data.setdefault("CEDLFP", dict(file_path=file_path))
+        for name, interface_source_data in source_data.items():
+            route = routes.get(name, dict(smrx_channel_ids=[], roles=[]))
+            interface_source_data.update(smrx_channel_ids=route["smrx_channel_ids"])
+            if name == "CEDStimulus":
+                interface_source_data.update(smrx_channel_roles=route["roles"])
+        if "CEDLFP" in source_data:
+            source_data["CEDLFP"].update(
+                channel_id_offset=len(source_data["CEDRecording"]["smrx_channel_ids"])
+            )
         super().__init__(source_data)
 
     def get_metadata(self):
@@ -71,3 +102,154 @@ class CEDNWBConverter(NWBConverter):
             institution="EMBL - Heidelberg", lab="Mease", session_id=session_id
         )
         return metadata
+
+    def run_conversion(
+        self,
+        metadata: dict,
+        save_to_file: bool = True,
+        nwbfile_path: Optional[str] = None,
+        overwrite: bool = False,
+        nwbfile: Optional[NWBFile] = None,
+        conversion_options: Optional[dict] = None,
+        pipeline: bool = True,
+        num_workers: Optional[int] = None,
+        resumable: bool = False,
+        lfp_options: Optional[dict] = None,
+    ):
+        """
+        Run the NWB conversion over all the instantiated data interfaces.
+
+        In pipeline mode, the stimulus channels are decoded and the TTL intervals detected in a thread pool before
+        the NWBFile is built and written serially, and the time spent by each interface is reported.
+
+        Parameters
+        ----------
+        metadata : dict
+        save_to_file : bool, optional
+        nwbfile_path : str, optional
+        overwrite : bool, optional
+        nwbfile : NWBFile, optional
+        conversion_options : dict, optional
+        pipeline : bool, optional
+            If True (default), prepare the interfaces concurrently before building the NWBFile.
+        num_workers : int, optional
+            Number of threads of the pipeline. The default is the thread pool default.
+        resumable : bool, optional
+            If True, the raw traces and the stimulus datasets are written chunk by chunk with their progress
+            recorded in a journal next to the NWBFile, and a conversion that was interrupted is resumed from the
+            last committed chunk (see resumablewrite.write_nwbfile_resumable). The journal records a fingerprint of
+            the smrx file, the metadata and the options; if they match, the stimulus channels are neither decoded
+            again nor scanned for TTL pulses, and only the frames after the last committed chunk are read. Otherwise
+            the conversion starts from scratch. The default is False.
+        lfp_options : dict, optional
+            If given, the LFP is computed from the CEDRecording channels with these options (see
+            lfp.LFPChunkIterator: freq_min, freq_max, lfp_rate, ...), on a process pool while the NWBFile is written.
+            It is named ElectricalSeries_lfp_decimated if the file also has LFP channels (CEDLFP), and
+            ElectricalSeries_lfp otherwise. The NWBFile is then always written anew. The default is None.
+        """
+        write_later = resumable or lfp_options is not None
+        if lfp_options is not None and save_to_file and not resumable:
+            if nwbfile_path is None:
+                raise TypeError("A path must be provided to save the NWBFile!")
+            if Path(nwbfile_path).is_file() and not overwrite:
+                raise ValueError(
+                    f"The NWBFile {nwbfile_path} already exists! Appending is not supported with the LFP "
+                    "stage; use overwrite=True to replace it."
+                )
+        t0 = perf_counter()
+        fingerprint = None
+        resume = False
+        if resumable and save_to_file:
+            check_resumable_write(nwbfile_path=nwbfile_path, overwrite=overwrite)
+            fingerprint = get_conversion_fingerprint(
+                source_data={
+                    name: interface.source_data
+                    for name, interface in self.data_interface_objects.items()
+                },
+                options=dict(
+                    metadata=metadata,
+                    conversion_options=conversion_options,
+                    lfp_options=lfp_options,
+                ),
+            )
+            resume = load_journal(nwbfile_path, fingerprint=fingerprint) is not None
+            if resume:
+                conversion_options = get_resume_conversion_options(
+                    self.data_interface_objects, conversion_options
+                )
+        timings = dict()
+        if pipeline:
+            timings = prepare_interfaces(
+                data_interface_objects=self.data_interface_objects,
+                conversion_options=conversion_options,
+                num_workers=num_workers,
+            )
+        with record_conversion_times(self.data_interface_objects, timings):
+            result = super().run_conversion(
+                metadata=metadata,
+                save_to_file=save_to_file and not write_later,
+                nwbfile_path=None if write_later else nwbfile_path,
+                overwrite=overwrite,
+                nwbfile=nwbfile,
+                conversion_options=conversion_options,
+            )
+        if lfp_options is not None:
+            self.add_lfp(
+                nwbfile=result,
+                lfp_options=lfp_options,
+                conversion_options=conversion_options,
+                resume=resume,
+            )
+        if write_later and save_to_file:
+            if resumable:
+                write_nwbfile_resumable(
+                    nwbfile=result,
+                    nwbfile_path=nwbfile_path,
+                    fingerprint=fingerprint,
+                    resume=resume,
+                )
+            else:
+                with NWBHDF5IO(str(nwbfile_path), mode="w") as io:
+                    io.write(result)
+            print(f"NWB file saved at {nwbfile_path}!")
+            result = None
+        for line in get_timing_report(timings, total_time=perf_counter() - t0):
+            print(line)
+        return result
+
+    def add_lfp(
+        self,
+        nwbfile: NWBFile,
+        lfp_options: dict,
+        conversion_options: Optional[dict] = None,
+        resume: bool = False,
+    ):
+        """
+        Compute the LFP of the CEDRecording channels and add it to the NWBFile.
+
+        The recording is truncated as in the conversion of the CEDRecording interface if its stub_test option is
+        set, and its times are written if its use_times option is. When resuming an interrupted resumable write,
+        the channels are read from the smrx file without being cached. See lfp.add_lfp_electrical_series.
+        """
+        interface = self.data_interface_objects["CEDRecording"]
+        recording_options = (conversion_options or dict()).get("CEDRecording", dict())
+        if recording_options.get("stub_test", False):
+            recording = se.SubRecordingExtractor(
+                interface.recording_extractor,
+                end_frame=min(100, interface.recording_extractor.get_num_frames()),
+            )
+        elif resume:
+            recording = interface.recording_extractor
+        else:
+            recording = interface.cache_traces()
+        if "CEDLFP" in self.data_interface_objects:
+            name = "ElectricalSeries_lfp_decimated"
+        else:
+            name = "ElectricalSeries_lfp"
+        add_lfp_electrical_series(
+            recording=recording,
+            nwbfile=nwbfile,
+            name=name,
+            use_times=recording_options.get("use_times", False),
+            **lfp_options,
+        )
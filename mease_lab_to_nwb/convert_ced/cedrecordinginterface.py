@@ -0,0 +1,226 @@
+"""Authors: Cody Baker and Ben Dichter."""
+
+from copy import deepcopy
+from typing import Optional
+
+import numpy as np
+
+from nwb_conversion_tools import CEDRecordingInterface as BaseCEDRecordingInterface
+from pynwb import NWBFile
+from spikeextractors import NwbRecordingExtractor, SubRecordingExtractor
+
+from ..probes import (
+    add_group_electrical_series,
+    apply_probe_file,
+    update_electrode_group_metadata,
+)
+from ..tracecache import CachedRecordingExtractor, cache_recording
+from ..utils import add_electrical_series
+
+from .cedsmrxfile import SharedCEDRecordingExtractor
+
+
+class CEDRecordingInterface(BaseCEDRecordingInterface):
+    """
+    Data interface class for converting the Rhd channels of a CED file, through its shared smrx file handle.
+
+    Parameters
+    ----------
+    file_path: str
+    smrx_channel_ids: list
+        The smrx indices of the Rhd channels.
+    probe_file: str, optional
+        Path to a .prb or .csv probe file, or name of a probe file of the probe_files folder (e.g.
+        cambridge_neurotech_H3), setting the channel order, groups and locations (see probes.apply_probe_file).
+    cache_folder: str, optional
+        Folder of a trace cache (see tracecache.TraceCache). If given, the Rhd channels are decoded once into the
+        cache, and the conversion and later stages read them from there.
+    cache_gb: float, optional
+        Size budget of the trace cache in GB. The default is no limit.
+    """
+
+    RX = SharedCEDRecordingExtractor
+
+    @classmethod
+    def get_source_schema(cls):
+        source_schema = super().get_source_schema()
+        source_schema["properties"].update(
+            probe_file=dict(
+                type="string",
+                format="file",
+                description="Path to a .prb or .csv probe file, or name of a probe file of the probe_files folder.",
+            ),
+            cache_folder=dict(
+                type="string",
+                format="directory",
+                description="Folder of a trace cache; the Rhd channels are decoded once into it and converted from it.",
+            ),
+            cache_gb=dict(
+                type="number",
+                exclusiveMinimum=0,
+                description="Size budget of the trace cache in GB.",
+            ),
+        )
+        return source_schema
+
+    def __init__(
+        self,
+        file_path: str,
+        smrx_channel_ids: list,
+        probe_file: Optional[str] = None,
+        cache_folder: Optional[str] = None,
+        cache_gb: Optional[float] = None,
+    ):
+        super().__init__(file_path=file_path, smrx_channel_ids=smrx_channel_ids)
+        if probe_file is not None:
+            self.source_data.update(probe_file=probe_file)
+            self.recording_extractor = apply_probe_file(
+                self.recording_extractor, probe_file
+            )
+        if cache_folder is not None:
+            # The Rhd channels are only decoded into the cache on first use (see cache_traces)
+            self.source_data.update(cache_folder=cache_folder, cache_gb=cache_gb)
+
+    def cache_traces(self):
+        """
+        Return the recording, after decoding it into the trace cache of the cache_folder source option, if given.
+
+        This is done on the first use of the traces (prepare_conversion, run_conversion or the LFP stage of the
+        converter), so that building the interface, e.g. for its metadata or schema, does not decode the recording.
+        """
+        cache_folder = self.source_data.get("cache_folder")
+        if cache_folder is not None and not isinstance(
+            self.recording_extractor, CachedRecordingExtractor
+        ):
+            self.recording_extractor = cache_recording(
+                self.recording_extractor,
+                cache_folder,
+                max_gb=self.source_data.get("cache_gb"),
+            )
+        return self.recording_extractor
+
+    def prepare_conversion(self, stub_test: bool = False, resume: bool = False):
+        """
+        Decode the Rhd channels into the trace cache ahead of run_conversion, if a cache_folder is given.
+
+        When resuming an interrupted resumable write (resume=True), the channels are not cached: only the frames
+        after the last committed chunk are decoded, from the smrx file.
+        """
+        if not stub_test and not resume:
+            self.cache_traces()
+
+    def get_metadata(self):
+        metadata = super().get_metadata()
+        if "probe_file" in self.source_data:
+            update_electrode_group_metadata(
+                metadata=metadata,
+                recording=self.recording_extractor,
+                probe_file=self.source_data["probe_file"],
+            )
+        return metadata
+
+    def run_conversion(
+        self,
+        nwbfile: NWBFile,
+        metadata: dict = None,
+        stub_test: bool = False,
+        use_times: bool = False,
+        group_series: bool = False,
+        num_workers: int = 2,
+        resume: bool = False,
+    ):
+        """
+        Convert the Rhd channels, as one ElectricalSeries, or one per channel group if group_series is True.
+
+        The traces are written block by block, with num_workers threads reading ahead (see
+        utils.add_electrical_series), so that they can also be written in resumable mode. With group_series, each
+        channel group (e.g. each shank of the probe file) is written as ElectricalSeries_raw_group<group> (see
+        probes.add_group_electrical_series); the groups are then decoded from the smrx file in turn, unless the
+        cache_folder source option is given, in which case the channels are decoded once into the trace cache
+        (taking as much disk space as the raw traces) and the groups are read from there. With resume, the NWBFile is
+        built to resume an interrupted resumable write, and the channels are read from the smrx file without being
+        cached (see prepare_conversion).
+        """
+        if not stub_test and not resume:
+            self.cache_traces()
+        if stub_test or self.subset_channels is not None:
+            recording = self.subset_recording(stub_test=stub_test)
+        else:
+            recording = self.recording_extractor
+        # Same content as NwbRecordingExtractor.write_recording, with the traces streamed through a chunk iterator
+        for add_function in [
+            NwbRecordingExtractor.add_devices,
+            NwbRecordingExtractor.add_electrode_groups,
+            NwbRecordingExtractor.add_electrodes,
+        ]:
+            add_function(recording=recording, nwbfile=nwbfile, metadata=metadata)
+        if group_series:
+            add_group_electrical_series(
+                recording=recording,
+                nwbfile=nwbfile,
+                use_times=use_times,
+                num_workers=num_workers,
+            )
+        else:
+            add_electrical_series(
+                recording=recording,
+                nwbfile=nwbfile,
+                use_times=use_times,
+                num_workers=num_workers,
+            )
+        NwbRecordingExtractor.add_epochs(
+            recording=recording, nwbfile=nwbfile, metadata=metadata
+        )
+
+
+class CEDLFPInterface(CEDRecordingInterface):
+    """
+    Data interface class for converting the LFP channels of a CED file to an LFP ElectricalSeries.
+
+    Parameters
+    ----------
+    file_path: str
+    smrx_channel_ids: list
+        The smrx indices of the LFP channels.
+    channel_id_offset: int, optional
+        Added to the channel ids of the LFP channels, so that their electrodes do not collide with those of the
+        raw recording. The default is 0.
+    """
+
+    def __init__(
+        self, file_path: str, smrx_channel_ids: list, channel_id_offset: int = 0
+    ):
+        super().__init__(file_path=file_path, smrx_channel_ids=smrx_channel_ids)
+        self.source_data.update(channel_id_offset=channel_id_offset)
+        if channel_id_offset != 0:
+            self.recording_extractor = SubRecordingExtractor(
+                self.recording_extractor,
+                renamed_channel_ids=[
+                    ch + channel_id_offset
+                    for ch in self.recording_extractor.get_channel_ids()
+                ],
+            )
+
+    def run_conversion(
+        self,
+        nwbfile: NWBFile,
+        metadata: dict = None,
+        stub_test: bool = False,
+        use_times: bool = False,
+    ):
+        # The LFP channels have no location; if a probe file gave the Rhd electrodes one, fill its columns with NaN
+        if nwbfile.electrodes is not None and "rel_x" in nwbfile.electrodes.colnames:
+            metadata = deepcopy(metadata) if metadata is not None else dict()
+            num_channels = self.recording_extractor.get_num_channels()
+            metadata.setdefault("Ecephys", dict()).setdefault("Electrodes", []).extend(
+                dict(name=name, description=name, data=[np.nan] * num_channels)
+                for name in ["rel_x", "rel_y"]
+            )
+        BaseCEDRecordingInterface.run_conversion(
+            self,
+            nwbfile=nwbfile,
+            metadata=metadata,
+            stub_test=stub_test,
+            use_times=use_times,
+            write_as="lfp",
+        )
@@ -0,0 +1,146 @@
+"""Shared access to smrx files, so that the channel table of a file is parsed once per conversion."""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from spikeextractors import CEDRecordingExtractor, RecordingExtractor
+from spikeextractors.extractors.cedextractors.utils import get_channel_info
+
+try:
+    from sonpy import lib as sp
+
+    HAVE_SONPY = True
+except ImportError:
+    HAVE_SONPY = False
+
+MAX_OPEN_FILES = 8
+
+_open_files = OrderedDict()
+_open_files_lock = threading.Lock()
+
+
+class SmrxFile:
+    """
+    An smrx file opened through sonpy, with the info of all of its channels.
+
+    Parameters
+    ----------
+    file_path: str or Path
+        Path to the .smrx file.
+    """
+
+    def __init__(self, file_path):
+        assert HAVE_SONPY, CEDRecordingExtractor.installation_mesg
+        self.file_path = Path(file_path)
+        self.son_file = sp.SonFile(sName=str(file_path), bReadOnly=True)
+        if self.son_file.GetOpenError() != 0:
+            raise ValueError(
+                "Error opening file:",
+                sp.GetErrorString(self.son_file.GetOpenError()),
+            )
+        self.channels_info = {
+            i: get_channel_info(self.son_file, i)
+            for i in range(self.son_file.MaxChannels())
+            if self.son_file.ChannelType(i) != sp.DataType.Off
+        }
+        # sonpy file handles are not thread-safe
+        self.lock = threading.Lock()
+
+
+def get_smrx_file(file_path) -> SmrxFile:
+    """
+    Open an smrx file, or return the SmrxFile already opened for it if the file did not change since.
+
+    The last MAX_OPEN_FILES files are kept open, so that the converter and its interfaces share a single handle and
+    channel table per file.
+    """
+    file_path = Path(file_path).resolve()
+    stat = file_path.stat()
+    key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+    with _open_files_lock:
+        if key in _open_files:
+            _open_files.move_to_end(key)
+        else:
+            _open_files[key] = SmrxFile(file_path)
+            while len(_open_files) > MAX_OPEN_FILES:
+                _open_files.popitem(last=False)
+        return _open_files[key]
+
+
+class SharedCEDRecordingExtractor(CEDRecordingExtractor):
+    """
+    CEDRecordingExtractor reading from the shared SmrxFile of its file (see get_smrx_file).
+
+    Unlike CEDRecordingExtractor, it neither opens the file again nor parses the info of its channels again.
+
+    Parameters
+    ----------
+    file_path: str
+        Path to the .smrx file to be extracted
+    smrx_channel_ids: list of int
+        List with indexes of valid smrx channels. Does not match necessarily
+        with extractor id.
+    """
+
+    def __init__(self, file_path, smrx_channel_ids: list):
+        assert self.installed, self.installation_mesg
+        file_path = Path(file_path)
+        assert (
+            file_path.is_file() and file_path.suffix == ".smrx"
+        ), "file_path must lead to a .smrx file!"
+        assert len(smrx_channel_ids) > 0, "'smrx_channel_ids' cannot be an empty list!"
+        RecordingExtractor.__init__(self)
+
+        self._smrx_file = get_smrx_file(file_path)
+        self._recording_file_path = file_path
+        self._recording_file = self._smrx_file.son_file
+        self._channelid_to_smrxind = dict()
+        self._channel_smrxinfo = dict()
+        self._channel_names = []
+        gains = []
+        for i, ind in enumerate(smrx_channel_ids):
+            if ind not in self._smrx_file.channels_info:
+                raise ValueError(f"Channel {ind} is type Off and cannot be used")
+            self._channelid_to_smrxind[i] = ind
+            self._channel_smrxinfo[i] = self._smrx_file.channels_info[ind]
+            # from 16-bit encoded int / to ADC +-5V input / to measured Volts, in uV
+            gains.append(self._channel_smrxinfo[i]["scale"] / 6553.6 * 1000)
+            self._channel_names.append(self._channel_smrxinfo[i]["title"])
+        self.set_channel_gains(gains=gains)
+        self.has_unscaled = True
+
+        rate0 = self._channel_smrxinfo[0]["rate"]
+        for info in self._channel_smrxinfo.values():
+            assert info["rate"] == rate0, (
+                "Inconsistency between 'sampling_frequency' of different channels. "
+                "The extractor only supports channels with the same 'rate'"
+            )
+        self.set_times(
+            times=(
+                self._channel_smrxinfo[0]["frame_offset"]
+                + np.arange(self.get_num_frames())
+            )
+            / self.get_sampling_frequency()
+        )
+        self._kwargs = {
+            "file_path": str(file_path.absolute()),
+            "smrx_channel_ids": smrx_channel_ids,
+        }
+
+    def get_traces(
+        self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+    ):
+        with self._smrx_file.lock:
+            return super().get_traces(
+                channel_ids=channel_ids,
+                start_frame=start_frame,
+                end_frame=end_frame,
+                return_scaled=return_scaled,
+            )
+
+    @staticmethod
+    def get_all_channels_info(file_path):
+        """Info of all channels of the smrx file, by smrx channel index, from its shared SmrxFile."""
+        return get_smrx_file(file_path).channels_info
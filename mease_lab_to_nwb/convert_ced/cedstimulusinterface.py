@@ -1,4 +1,6 @@
 """Authors: Cody Baker and Alessio Buccino."""
+from typing import Optional
+
 import numpy as np
 
 from pynwb import NWBFile, TimeSeries
@@ -10,7 +12,29 @@ from nwb_conversion_tools.datainterfaces.ecephys.baserecordingextractorinterface
     BaseRecordingExtractorInterface,
 )
 from nwb_conversion_tools.utils.json_schema import get_schema_from_method_signature
-from spikeextractors import RecordingExtractor, CEDRecordingExtractor
+from spikeextractors import (
+    RecordingExtractor,
+    CacheRecordingExtractor,
+    SubRecordingExtractor,
+)
+
+from ..utils import ReadCountingRecordingExtractor, RecordingTracesChunkIterator
+from .cedsmrxfile import SharedCEDRecordingExtractor
+
+# Roles of the stimulus channels when none are given, by position in smrx_channel_ids
+DEFAULT_STIMULUS_ROLES = ["mechanical_pressure", "mechanical_ttl", "laser"]
+# Name and description of the IntervalSeries of each TTL role; channels with the generic "ttl" role are named after
+# their title instead
+TTL_STIMULI = dict(
+    mechanical_ttl=(
+        "MechanicalStimulus",
+        "Activation times inferred from TTL commands for mechanical stimulus.",
+    ),
+    laser=(
+        "LaserStimulus",
+        "Activation times inferred from TTL commands for cortical laser stimulus.",
+    ),
+)
 
 
 def check_module(nwbfile, name, description=None):
@@ -34,8 +58,175 @@ def check_module(nwbfile, name, description=None):
         return nwbfile.create_processing_module(name, description)
 
 
+def detect_ttl_edges(
+    trace: np.ndarray,
+    threshold: float,
+    hysteresis: float = 0.0,
+    initial_state: Optional[bool] = None,
+):
+    """Locate the threshold crossings of a TTL trace.
+
+    The trace is considered 'high' once it rises above threshold + hysteresis / 2 and 'low' once it drops to or
+    below threshold - hysteresis / 2. With zero hysteresis this is a plain 'trace > threshold' comparison.
+
+    Parameters
+    ----------
+    trace: np.ndarray
+        One-dimensional TTL trace.
+    threshold: float
+        Detection threshold.
+    hysteresis: float (optional, defaults to 0.)
+        Width of the dead band centered on the threshold.
+    initial_state: bool | None (optional)
+        State of the sample preceding the trace. If None, the state of the first sample is used,
+        so that no crossing is reported at index 0.
+
+    Returns
+    -------
+    rising: np.ndarray
+        Indices of the first 'high' sample of each pulse.
+    falling: np.ndarray
+        Indices of the first 'low' sample after each pulse.
+    final_state: bool
+        State of the last sample, to be passed as initial_state of the following trace block.
+    """
+    if len(trace) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), initial_state
+    if initial_state is None:
+        initial_state = bool(trace[0] > threshold)
+    high = trace > threshold + 0.5 * hysteresis
+    if hysteresis > 0:
+        # Each sample inherits the state of the last sample that left the dead band
+        decided = high | (trace <= threshold - 0.5 * hysteresis)
+        last_decided = np.where(decided, np.arange(len(trace)), -1)
+        np.maximum.accumulate(last_decided, out=last_decided)
+        undecided = last_decided < 0
+        high = high[last_decided]
+        high[undecided] = initial_state
+    crossings = np.flatnonzero(np.diff(high, prepend=initial_state))
+    crossing_states = high[crossings]
+    return crossings[crossing_states], crossings[~crossing_states], bool(high[-1])
+
+
+def pair_ttl_edges(
+    rising: np.ndarray,
+    falling: np.ndarray,
+    starts_high: bool = False,
+    min_pulse_width: int = 0,
+):
+    """Pair rising and falling edges into pulses.
+
+    A falling edge preceding the first rising edge (trace starting above threshold) and a final rising edge
+    without a matching falling edge (trace ending above threshold) are discarded.
+
+    Parameters
+    ----------
+    rising: np.ndarray
+        Sorted indices of rising edges.
+    falling: np.ndarray
+        Sorted indices of falling edges; must alternate with the rising edges.
+    starts_high: bool (optional, defaults to False)
+        Whether the trace starts above threshold, in which case the first falling edge closes no pulse.
+    min_pulse_width: int (optional, defaults to 0)
+        Pulses shorter than this number of samples are dropped.
+
+    Returns
+    -------
+    starts, stops: np.ndarray
+        Sample indices of the start and stop of each pulse.
+    """
+    if starts_high:
+        falling = falling[1:]
+    num_pulses = min(len(rising), len(falling))
+    starts = rising[:num_pulses]
+    stops = falling[:num_pulses]
+    if min_pulse_width > 0:
+        keep = stops - starts >= min_pulse_width
+        starts = starts[keep]
+        stops = stops[keep]
+    return starts, stops
+
+
+def build_interval_series(
+    name: str, description: str, start_times: np.ndarray, stop_times: np.ndarray
+):
+    """Build an IntervalSeries from arrays of start and stop times, in the layout of IntervalSeries.add_interval."""
+    data = np.tile(np.array([1, -1], dtype=np.int8), len(start_times))
+    timestamps = np.empty(2 * len(start_times), dtype=np.float64)
+    timestamps[0::2] = start_times
+    timestamps[1::2] = stop_times
+    return IntervalSeries(name, description, data=data, timestamps=timestamps)
+
+
+class TraceLevelCounter:
+    """Running count of the distinct values of a trace that is read block by block.
+
+    Traces decoded from integer ADC samples only take a bounded number of distinct values, so the counts stay small
+    no matter how long the recording is. If more than max_distinct_values different values are seen, only the
+    running range is kept and the level counts have to be collected in a second pass with count_levels.
+    """
+
+    def __init__(self, max_distinct_values: int = 2 ** 16):
+        self.max_distinct_values = max_distinct_values
+        self.exact = True
+        self.values = None
+        self.counts = None
+        self.min_value = None
+        self.max_value = None
+        self.num_samples = 0
+
+    def update(self, trace: np.ndarray):
+        block_min = np.amin(trace)
+        block_max = np.amax(trace)
+        if self.min_value is None:
+            self.min_value = block_min
+            self.max_value = block_max
+            self.values = np.empty(0, dtype=trace.dtype)
+            self.counts = np.empty(0, dtype=np.int64)
+        else:
+            self.min_value = min(self.min_value, block_min)
+            self.max_value = max(self.max_value, block_max)
+        self.num_samples += len(trace)
+        if not self.exact:
+            return
+        values, inverse = np.unique(
+            np.concatenate([self.values, trace]), return_inverse=True
+        )
+        if len(values) > self.max_distinct_values:
+            self.exact = False
+            self.values = None
+            self.counts = None
+            return
+        weights = np.concatenate([self.counts, np.ones(len(trace), dtype=np.int64)])
+        self.values = values
+        self.counts = np.bincount(inverse.ravel(), weights=weights).astype(np.int64)
+
+    def count_levels(self, lower: float, upper: float):
+        """Return the number of samples below lower and above upper."""
+        return np.sum(self.counts[self.values < lower]), np.sum(
+            self.counts[self.values > upper]
+        )
+
+
+def iter_trace_blocks(recording: RecordingExtractor, channel_id: int, chunk_size: int):
+    """Iterate over (start_frame, trace) blocks of a single channel of the recording."""
+    num_frames = recording.get_num_frames()
+    for start_frame in range(0, num_frames, chunk_size):
+        end_frame = min(start_frame + chunk_size, num_frames)
+        trace = recording.get_traces(
+            channel_ids=[channel_id], start_frame=start_frame, end_frame=end_frame
+        )[0]
+        yield start_frame, trace
+
+
 def intervals_from_traces(
-    name: str, description: str, recording: RecordingExtractor, channel_id: int
+    name: str,
+    description: str,
+    recording: RecordingExtractor,
+    channel_id: int,
+    hysteresis: float = 0.0,
+    min_pulse_width: float = 0.0,
+    chunk_size: Optional[int] = None,
 ):
     """Extract interval times from TTL pulses.
 
@@ -45,46 +236,90 @@ def intervals_from_traces(
     Uses a heuristic to detect when TTL data was not collected (and signal is just zero + noise):
     if the fraction of points outside the upper/lower quartiles is too low, returns empty arrays.
     This avoids conversion of pure noise into a huge number of spurious intervals.
+
+    If chunk_size is set, the channel is streamed in blocks of chunk_size frames so that memory use does not depend
+    on the duration of the recording. The heuristic is computed in a single pass with a TraceLevelCounter and the
+    edges are detected in a second pass, carrying the threshold state across block boundaries.
+
+    Parameters
+    ----------
+    name: str
+    description: str
+    recording: RecordingExtractor
+    channel_id: int
+        Channel holding the TTL trace.
+    hysteresis: float (optional, defaults to 0.)
+        Width of the dead band around the threshold, in the units of the trace.
+    min_pulse_width: float (optional, defaults to 0.)
+        Pulses shorter than this duration (in seconds) are discarded.
+    chunk_size: int | None (optional)
+        Number of frames per block in streaming mode. If None, the whole trace is loaded at once.
     """
-    interval_series = IntervalSeries(name, description, data=[], timestamps=[])
-    tr = recording.get_traces(channel_id)[0]
     dt = 1.0 / recording.get_sampling_frequency()
-
-    min_value = np.amin(tr)
-    peak_to_peak = np.ptp(tr)
+    if chunk_size is None:
+        tr = recording.get_traces(channel_id)[0]
+        min_value = np.amin(tr)
+        peak_to_peak = np.ptp(tr)
+        n_upper_quartile = np.sum(tr > min_value + 0.75 * peak_to_peak)
+        n_lower_quartile = np.sum(tr < min_value + 0.25 * peak_to_peak)
+        num_samples = len(tr)
+        blocks = [(0, tr)]
+    else:
+        level_counter = TraceLevelCounter()
+        for _, trace in iter_trace_blocks(recording, channel_id, chunk_size):
+            level_counter.update(trace)
+        min_value = level_counter.min_value
+        peak_to_peak = level_counter.max_value - level_counter.min_value
+        lower = min_value + 0.25 * peak_to_peak
+        upper = min_value + 0.75 * peak_to_peak
+        if level_counter.exact:
+            n_lower_quartile, n_upper_quartile = level_counter.count_levels(
+                lower=lower, upper=upper
+            )
+        else:
+            n_lower_quartile = n_upper_quartile = 0
+            for _, trace in iter_trace_blocks(recording, channel_id, chunk_size):
+                n_lower_quartile += np.sum(trace < lower)
+                n_upper_quartile += np.sum(trace > upper)
+        num_samples = level_counter.num_samples
+        blocks = iter_trace_blocks(recording, channel_id, chunk_size)
     threshold = min_value + 0.5 * peak_to_peak
-    n_upper_quartile = np.sum(tr > min_value + 0.75 * peak_to_peak)
-    n_lower_quartile = np.sum(tr < min_value + 0.25 * peak_to_peak)
-    fraction = (n_upper_quartile + n_lower_quartile) / len(tr)
+    fraction = (n_upper_quartile + n_lower_quartile) / num_samples
     if fraction < 0.75:
         print(
             f"Fraction of points in upper/lower quartiles too low: {fraction}. Assuming there is no TTL pulse data."
         )
-        return interval_series
-    i = 0
-    n = len(tr)
-    while i < n and tr[i] > threshold:
-        i = i + 1
-    if i > 0:
-        print(f"Warning: trace starts above threshold - skipped first {i} points")
-    try:
-        while i < n:
-            while tr[i] <= threshold:
-                i = i + 1
-            interval_start = i * dt
-            while tr[i] > threshold:
-                i = i + 1
-            interval_stop = i * dt
-            interval_series.add_interval(interval_start, interval_stop)
-    except IndexError:
-        assert i == len(tr)
-    return interval_series
+        return build_interval_series(name, description, np.empty(0), np.empty(0))
+
+    rising = []
+    falling = []
+    state = None
+    for start_frame, trace in blocks:
+        if state is None:
+            starts_high = bool(trace[0] > threshold)
+        block_rising, block_falling, state = detect_ttl_edges(
+            trace=trace, threshold=threshold, hysteresis=hysteresis, initial_state=state
+        )
+        rising.append(block_rising + start_frame)
+        falling.append(block_falling + start_frame)
+    rising = np.concatenate(rising)
+    falling = np.concatenate(falling)
+    if starts_high:
+        skipped = falling[0] if len(falling) > 0 else num_samples
+        print(f"Warning: trace starts above threshold - skipped first {skipped} points")
+    starts, stops = pair_ttl_edges(
+        rising=rising,
+        falling=falling,
+        starts_high=starts_high,
+        min_pulse_width=int(np.ceil(min_pulse_width / dt)),
+    )
+    return build_interval_series(name, description, starts * dt, stops * dt)
 
 
 class CEDStimulusInterface(BaseRecordingExtractorInterface):
     """Primary data interface class for converting CED mechanical and cortical laser stimuli."""
 
-    RX = CEDRecordingExtractor
+    RX = SharedCEDRecordingExtractor
 
     @classmethod
     def get_source_schema(cls):
@@ -101,43 +336,204 @@ class CEDStimulusInterface(BaseRecordingExtractorInterface):
         )
         return source_schema
 
-    def run_conversion(
-        self, nwbfile: NWBFile, metadata: dict = None, stub_test: bool = False
+    def __init__(
+        self,
+        file_path: str,
+        smrx_channel_ids: list,
+        smrx_channel_roles: Optional[list] = None,
     ):
-        nwbfile.add_stimulus(
-            intervals_from_traces(
-                "MechanicalStimulus",
-                "Activation times inferred from TTL commands for mechanical stimulus.",
-                self.recording_extractor,
-                1,
+        """
+        Parameters
+        ----------
+        file_path : str
+        smrx_channel_ids : list
+            The smrx indices of the stimulus channels.
+        smrx_channel_roles : list, optional
+            The role of each channel: "mechanical_pressure", "mechanical_ttl", "laser", or "ttl" for any other TTL
+            channel (converted to an IntervalSeries named after the channel title). Defaults to
+            DEFAULT_STIMULUS_ROLES.
+        """
+        super().__init__(file_path=file_path, smrx_channel_ids=smrx_channel_ids)
+        if smrx_channel_roles is None:
+            smrx_channel_roles = DEFAULT_STIMULUS_ROLES[: len(smrx_channel_ids)]
+        assert len(smrx_channel_roles) == len(
+            smrx_channel_ids
+        ), "There must be one role per stimulus channel!"
+        self.source_data.update(smrx_channel_roles=smrx_channel_roles)
+        self.channel_roles = list(smrx_channel_roles)
+
+    def get_channel_id(self, role: str):
+        """Channel id of the channel with the given role, or None if there is none."""
+        if role in self.channel_roles:
+            return self.channel_roles.index(role)
+        return None
+
+    def prepare_conversion(
+        self,
+        chunk_size: int = 1000000,
+        hysteresis: float = 0.0,
+        min_pulse_width: float = 0.0,
+        resume: bool = False,
+    ):
+        """
+        Decode the stimulus channels into the temporary cache and detect the TTL intervals ahead of run_conversion.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Number of frames decoded at once from the smrx file and scanned at once for TTL pulses.
+            The default is 1000000.
+        hysteresis : float, optional
+            Width of the dead band around the threshold of the TTL channels, in unscaled units of the traces.
+            The default is 0.
+        min_pulse_width : float, optional
+            TTL pulses shorter than this duration (in seconds) are discarded. The default is 0.
+        resume : bool, optional
+            If True, the NWBFile is built to resume an interrupted resumable write (see
+            resumablewrite.write_nwbfile_resumable), in which the TTL intervals are already written: the channels
+            are neither decoded into the cache nor scanned for TTL pulses, and the pressure and laser series are read
+            from the smrx file from their last committed frame on. The default is False.
+        """
+        if resume:
+            self._prepared_data = dict(
+                cached_recording=self.recording_extractor, interval_series=[]
             )
+            return
+        self.read_counter = ReadCountingRecordingExtractor(self.recording_extractor)
+        cached_recording = CacheRecordingExtractor(
+            self.read_counter, return_scaled=False, chunk_size=chunk_size
         )
-        nwbfile.add_stimulus(
-            intervals_from_traces(
-                "LaserStimulus",
-                "Activation times inferred from TTL commands for cortical laser stimulus.",
-                self.recording_extractor,
-                2,
+        for line in self.read_counter.get_read_report():
+            print(line)
+
+        interval_series = []
+        for channel_id, role in enumerate(self.channel_roles):
+            if role in TTL_STIMULI:
+                name, description = TTL_STIMULI[role]
+            elif role == "ttl":
+                title = self.recording_extractor.channel_names[channel_id]
+                name = f"{title}Stimulus"
+                description = f"Activation times inferred from TTL commands on {title}."
+            else:
+                continue
+            interval_series.append(
+                intervals_from_traces(
+                    name,
+                    description,
+                    cached_recording,
+                    channel_id,
+                    hysteresis=hysteresis,
+                    min_pulse_width=min_pulse_width,
+                    chunk_size=chunk_size,
+                )
             )
+        self._prepared_data = dict(
+            cached_recording=cached_recording, interval_series=interval_series
         )
+
+    def run_conversion(
+        self,
+        nwbfile: NWBFile,
+        metadata: dict = None,
+        stub_test: bool = False,
+        chunk_size: int = 1000000,
+        hysteresis: float = 0.0,
+        min_pulse_width: float = 0.0,
+        chunk_frames: Optional[int] = None,
+        compression: Optional[str] = "gzip",
+        compression_opts: Optional[int] = None,
+        resume: bool = False,
+    ):
+        """
+        Convert the mechanical and laser stimuli, and the intervals of any other TTL channel.
+
+        All stimulus channels are decoded from the smrx file together, in a single chunked pass, into a temporary
+        binary cache. The TTL intervals and the pressure and laser series are then read from that cache, so each
+        channel goes through sonpy only once. If prepare_conversion was called beforehand (e.g. by the converter,
+        concurrently with other interfaces), its cache and TTL intervals are used.
+
+        Parameters
+        ----------
+        nwbfile : NWBFile
+        metadata : dict
+        stub_test : bool, optional
+            If true, truncates the pressure and laser series to a small size for fast testing. The default is False.
+        chunk_size : int, optional
+            Number of frames decoded at once from the smrx file and scanned at once for TTL pulses.
+            The default is 1000000.
+        hysteresis : float, optional
+            Width of the dead band around the threshold of the TTL channels, in unscaled units of the traces.
+            The default is 0.
+        min_pulse_width : float, optional
+            TTL pulses shorter than this duration (in seconds) are discarded. The default is 0.
+        chunk_frames : int, optional
+            Number of frames per HDF5 chunk of the pressure and laser series. The default lets the backend decide.
+        compression : str, optional
+            Compression filter of the pressure and laser series ("gzip", "lzf" or None). The default is "gzip".
+        compression_opts : int, optional
+            Compression level when using "gzip".
+        resume : bool, optional
+            If True, skips the decoding and the TTL detection to resume an interrupted resumable write (see
+            prepare_conversion). The default is False.
+        """
+        if getattr(self, "_prepared_data", None) is None:
+            self.prepare_conversion(
+                chunk_size=chunk_size,
+                hysteresis=hysteresis,
+                min_pulse_width=min_pulse_width,
+                resume=resume,
+            )
+        prepared_data, self._prepared_data = self._prepared_data, None
+        cached_recording = prepared_data["cached_recording"]
+
+        for interval_series in prepared_data["interval_series"]:
+            nwbfile.add_stimulus(interval_series)
         if stub_test or self.subset_channels is not None:
-            recording = self.subset_recording(stub_test=stub_test)
+            subset_kwargs = dict()
+            if stub_test:
+                subset_kwargs.update(
+                    end_frame=min([100, cached_recording.get_num_frames()])
+                )
+            if self.subset_channels is not None:
+                subset_kwargs.update(channel_ids=self.subset_channels)
+            recording = SubRecordingExtractor(cached_recording, **subset_kwargs)
         else:
-            recording = self.recording_extractor
+            recording = cached_recording
 
         # Pressure values
-        nwbfile.add_stimulus(
-            TimeSeries(
-                name="MechanicalPressure",
-                data=H5DataIO(recording.get_traces(0).T, compression="gzip"),
-                unit=self.recording_extractor._channel_smrxinfo[0]["unit"],
-                conversion=recording.get_channel_property(0, "gain"),
-                rate=recording.get_sampling_frequency(),
-                description="Pressure sensor attached to the mechanical stimulus used to repeatedly evoke spiking.",
+        pressure_channel_id = self.get_channel_id("mechanical_pressure")
+        if pressure_channel_id is not None:
+            pressure_chunk_shape = None
+            if chunk_frames is not None:
+                pressure_chunk_shape = (chunk_frames, 1)
+            nwbfile.add_stimulus(
+                TimeSeries(
+                    name="MechanicalPressure",
+                    data=H5DataIO(
+                        RecordingTracesChunkIterator(
+                            recording=recording,
+                            channel_ids=[pressure_channel_id],
+                            buffer_frames=chunk_size,
+                            chunk_shape=pressure_chunk_shape,
+                        ),
+                        compression=compression,
+                        compression_opts=compression_opts,
+                    ),
+                    unit=self.recording_extractor._channel_smrxinfo[
+                        pressure_channel_id
+                    ]["unit"],
+                    conversion=recording.get_channel_property(
+                        pressure_channel_id, "gain"
+                    ),
+                    rate=recording.get_sampling_frequency(),
+                    description="Pressure sensor attached to the mechanical stimulus used to repeatedly evoke spiking.",
+                )
             )
-        )
 
         # Laser as optogenetic stimulus
+        laser_channel_id = self.get_channel_id("laser")
+        if laser_channel_id is None:
+            return
         ogen_device = nwbfile.create_device(
             name="ogen_device", description="ogen description"
         )
@@ -152,7 +548,16 @@ class CEDStimulusInterface(BaseRecordingExtractorInterface):
         nwbfile.add_stimulus(
             OptogeneticSeries(
                 name="Laser",
-                data=recording.get_traces(2)[0],
+                data=H5DataIO(
+                    RecordingTracesChunkIterator(
+                        recording=recording,
+                        channel_ids=laser_channel_id,
+                        buffer_frames=chunk_size,
+                        chunk_shape=None if chunk_frames is None else (chunk_frames,),
+                    ),
+                    compression=compression,
+                    compression_opts=compression_opts,
+                ),
                 site=ogen_site,
                 rate=recording.get_sampling_frequency(),
                 description="Laser TTL.",
@@ -8,7 +8,7 @@ from mease_lab_to_nwb import SyntalosNWBConverter
 base_path = Path("D:/Syntalos/Latest Syntalos Recording _20200730")
 intan_folder_path = base_path / "intan-signals"
 event_file_path = base_path / "events" / "table.csv"
-video_folder_path = base_path / "videos" / "TIS Camera"
+video_folder_path = base_path / "videos"  # one subfolder per camera
 nwbfile_path = base_path / "Syntalos_test.nwb"
 
 # Enter Session and Subject information here
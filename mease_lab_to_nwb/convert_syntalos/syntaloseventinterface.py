@@ -1,12 +1,132 @@
 """Authors: Cody Baker and Ben Dichter."""
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
 from hdmf.backends.hdf5.h5_utils import H5DataIO
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
 from ndx_events import LabeledEvents
 from nwb_conversion_tools.basedatainterface import BaseDataInterface
 from pynwb import NWBFile
 
+EVENT_TABLE_DTYPES = dict(Time="float64", Tag="str")
+
+
+def read_event_table_chunks(
+    file_path: str, column: str, chunk_size: int = 1000000, start: int = 0
+):
+    """Iterate over a column of a Syntalos event table, chunk_size rows at a time, from row start on."""
+    return pd.read_csv(
+        file_path,
+        delimiter=";",
+        usecols=[column],
+        dtype={column: EVENT_TABLE_DTYPES[column]},
+        keep_default_na=False,
+        skiprows=range(1, start + 1),
+        chunksize=chunk_size,
+    )
+
+
+def read_event_labels(file_path: str, chunk_size: int = 1000000):
+    """
+    Scan the Tag column of a Syntalos event table.
+
+    Returns
+    -------
+    labels: np.ndarray
+        The sorted unique tags, so that the label codes are the same from run to run.
+    num_events: int
+        The number of rows of the table.
+    """
+    labels = np.array([], dtype=object)
+    num_events = 0
+    for chunk in read_event_table_chunks(file_path, "Tag", chunk_size=chunk_size):
+        labels = np.union1d(labels, pd.unique(chunk["Tag"]))
+        num_events += len(chunk)
+    return labels, num_events
+
+
+class EventTableChunkIterator(AbstractDataChunkIterator):
+    """
+    Data chunk iterator over the timestamps or the label codes of a Syntalos event table.
+
+    The table is read chunk by chunk, so that only chunk_size rows are held in memory at a time.
+
+    Parameters
+    ----------
+    file_path: str
+        Path to the event table (events/table.csv).
+    num_events: int
+        Number of rows of the table, as returned by read_event_labels.
+    labels: np.ndarray (optional)
+        Sorted unique tags, as returned by read_event_labels. If given, the iterator yields the index of the Tag of
+        each event in labels (uint8); otherwise, it yields the Time of each event in seconds.
+    chunk_size: int (optional, defaults to 1000000)
+        Number of rows read at a time.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        num_events: int,
+        labels: Optional[np.ndarray] = None,
+        chunk_size: int = 1000000,
+    ):
+        self.file_path = file_path
+        self.labels = labels
+        if labels is not None:
+            assert (
+                len(labels) <= np.iinfo("uint8").max + 1
+            ), "LabeledEvents supports at most 256 different labels!"
+        self.chunk_size = int(chunk_size)
+        self._num_events = num_events
+        self._reader = None
+        self._start = 0
+
+    def __iter__(self):
+        return self
+
+    def seek(self, start: int):
+        """Set the index of the first event of the next chunk, e.g. to resume an interrupted write."""
+        self._start = start
+        self._reader = None
+
+    def __next__(self):
+        if self._start >= self._num_events:
+            raise StopIteration
+        if self._reader is None:
+            column = "Time" if self.labels is None else "Tag"
+            self._reader = read_event_table_chunks(
+                self.file_path, column, chunk_size=self.chunk_size, start=self._start
+            )
+        chunk = next(self._reader)
+        if self.labels is None:
+            data = chunk["Time"].to_numpy() / 1e3
+        else:
+            codes = np.searchsorted(self.labels, chunk["Tag"].to_numpy())
+            data = codes.astype("uint8")
+        start = self._start
+        end = start + len(data)
+        self._start = end
+        return DataChunk(data=data, selection=np.s_[start:end])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return None
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return np.dtype("float64" if self.labels is None else "uint8")
+
+    @property
+    def maxshape(self):
+        return (self._num_events,)
+
 
 class SyntalosEventInterface(BaseDataInterface):
     """Conversion class for Syntalos Events."""
@@ -17,22 +137,45 @@ class SyntalosEventInterface(BaseDataInterface):
             required=["file_path"], properties=dict(file_path=dict(type="string"))
         )
 
-    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
-        event_file = self.source_data["file_path"]
-        events_data = pd.read_csv(event_file, delimiter=";")
-        event_timestamps = events_data["Time"].to_numpy() / 1e3
-        event_labels = events_data["Tag"].to_numpy()
-        unique_events = set(event_labels)
-        events_map = {event: n for n, event in enumerate(unique_events)}
-        event_data = [events_map[event] for event in event_labels]
+    def prepare_conversion(self, chunk_size: int = 1000000):
+        """Scan the labels of the event table ahead of run_conversion."""
+        labels, num_events = read_event_labels(
+            self.source_data["file_path"], chunk_size=chunk_size
+        )
+        self._prepared_data = dict(labels=labels, num_events=num_events)
+
+    def run_conversion(
+        self, nwbfile: NWBFile, metadata: dict, chunk_size: int = 1000000
+    ):
+        """
+        Add the event table to the NWBFile as LabeledEvents.
+
+        The labels are the sorted unique tags; the timestamps and label codes are streamed from the table during
+        the write, chunk_size rows at a time.
+        """
+        if getattr(self, "_prepared_data", None) is None:
+            self.prepare_conversion(chunk_size=chunk_size)
+        prepared_data, self._prepared_data = self._prepared_data, None
 
+        event_file = self.source_data["file_path"]
+        timestamps = EventTableChunkIterator(
+            event_file,
+            num_events=prepared_data["num_events"],
+            chunk_size=chunk_size,
+        )
+        data = EventTableChunkIterator(
+            event_file,
+            num_events=prepared_data["num_events"],
+            labels=prepared_data["labels"],
+            chunk_size=chunk_size,
+        )
         # Custom labeled events
         events = LabeledEvents(
             name="LabeledEvents",
             description="Events from the experiment.",
-            timestamps=H5DataIO(event_timestamps, compression="gzip"),
+            timestamps=H5DataIO(timestamps, compression="gzip"),
             resolution=np.nan,
-            data=H5DataIO(event_data, compression="gzip"),
-            labels=list(unique_events),  # does not suppoort compression
+            data=H5DataIO(data, compression="gzip"),
+            labels=list(prepared_data["labels"]),  # does not suppoort compression
         )
         nwbfile.add_acquisition(events)
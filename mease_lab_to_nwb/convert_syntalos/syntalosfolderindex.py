@@ -0,0 +1,119 @@
+"""Sidecar index of Syntalos intan folders, so that a session can be reopened without parsing every file."""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+INDEX_FILE_NAME = ".syntalos_index.json"
+INDEX_VERSION = 1
+
+
+def list_syntalos_folder(folder_path):
+    """Return the (unsorted) .rhd files and the .tsync file of a Syntalos intan folder."""
+    file_paths = [p for p in Path(folder_path).iterdir() if p.suffix == ".rhd"]
+    for file_path in file_paths:
+        assert file_path.is_file(), "The provided file does not exist!"
+    assert len(file_paths) >= 1, "No rhd files found in the folder path!"
+    tsync_files = [p for p in Path(folder_path).iterdir() if p.suffix == ".tsync"]
+    assert (
+        len(tsync_files) == 1
+    ), "Only one tsync file should be present in the Syntalos folder!"
+    return file_paths, tsync_files[0]
+
+
+def sort_rhd_files(file_paths: list):
+    """Order .rhd files by the date at the end of their name (..._YYMMDD_HHMMSS.rhd)."""
+    dates = [
+        datetime.strptime("-".join(file_path.stem.split("_")[-2:]), "%y%m%d-%H%M%S")
+        for file_path in file_paths
+    ]
+    return [file_paths[i] for i in np.argsort(dates, kind="stable")]
+
+
+def file_signature(file_path):
+    """Name, size and modification time of a file, used to detect changes."""
+    stat = Path(file_path).stat()
+    return dict(name=Path(file_path).name, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def to_json_compatible(obj):
+    """Recursively convert numpy types, tuples and paths so that obj round-trips through JSON."""
+    if isinstance(obj, dict):
+        return {str(key): to_json_compatible(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [to_json_compatible(value) for value in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Path):
+        return str(obj)
+    return obj
+
+
+def load_folder_index(folder_path) -> Optional[dict]:
+    """
+    Load the sidecar index of a Syntalos intan folder.
+
+    Parameters
+    ----------
+    folder_path: str or Path
+        The path to the .rhd files.
+
+    Returns
+    -------
+    index: dict or None
+        The index, or None if it is missing, unreadable, or if any .rhd or .tsync file was added, removed or
+        modified (different size or modification time) since it was written.
+    """
+    index_path = Path(folder_path) / INDEX_FILE_NAME
+    if not index_path.is_file():
+        return None
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    rhd_file_paths, tsync_file_path = list_syntalos_folder(folder_path)
+    file_paths = rhd_file_paths + [tsync_file_path]
+    indexed_files = index["rhd_files"] + [index["tsync_file"]]
+    signatures = sorted(
+        tuple(file_signature(file_path).values()) for file_path in file_paths
+    )
+    indexed_signatures = sorted(
+        (file["name"], file["size"], file["mtime_ns"]) for file in indexed_files
+    )
+    if signatures != indexed_signatures:
+        return None
+    return index
+
+
+def save_folder_index(folder_path, index: dict):
+    """
+    Write the sidecar index of a Syntalos intan folder.
+
+    The file is written next to the data and replaced atomically. If the folder is not writable, the index is
+    simply not saved.
+    """
+    index_path = Path(folder_path) / INDEX_FILE_NAME
+    tmp_path = index_path.with_name(f"{INDEX_FILE_NAME}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(dict(index, version=INDEX_VERSION), f)
+        os.replace(tmp_path, index_path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Unable to save the Syntalos folder index at {index_path}: {e}")
+        if tmp_path.is_file():
+            tmp_path.unlink()
+
+
+def get_session_id(folder_path):
+    """Name (without suffix) of the first .rhd file of a Syntalos intan folder."""
+    index = load_folder_index(folder_path)
+    if index is not None:
+        return Path(index["rhd_files"][0]["name"]).stem
+    rhd_file_paths, _ = list_syntalos_folder(folder_path)
+    return sort_rhd_files(rhd_file_paths)[0].stem
@@ -1,5 +1,11 @@
 """Authors: Cody Baker and Ben Dichter."""
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
@@ -8,6 +14,164 @@ from nwb_conversion_tools.basedatainterface import BaseDataInterface
 from pynwb import NWBFile
 from pynwb.image import ImageSeries
 
+from .syntalosfolderindex import file_signature
+
+FRAME_INDEX_FILE_NAME = ".syntalos_frame_index.json"
+FRAME_INDEX_VERSION = 1
+
+
+def natural_sort_key(file_path):
+    """Key ordering file names by their numbers, so that e.g. video_2.mkv comes before video_10.mkv."""
+    return [
+        int(part) if part.isdigit() else part
+        for part in re.split(r"(\d+)", Path(file_path).name)
+    ]
+
+
+def list_video_files(folder_path):
+    """The .mkv segments of a Syntalos video folder, in natural order of their names."""
+    return sorted(
+        (x for x in Path(folder_path).iterdir() if x.suffix == ".mkv"),
+        key=natural_sort_key,
+    )
+
+
+def get_timestamps_file_path(video_file_path):
+    """Path of the timestamps CSV of a video segment."""
+    video_file_path = Path(video_file_path)
+    return video_file_path.with_name(f"{video_file_path.stem}_timestamps.csv")
+
+
+def read_video_timestamps(video_file_path):
+    """Timestamps (in seconds) of the frames of a video segment, read from the timestamp column of its CSV."""
+    video_time_df = pd.read_csv(
+        get_timestamps_file_path(video_file_path),
+        delimiter=";",
+        skipinitialspace=True,
+        usecols=["timestamp"],
+        dtype=dict(timestamp="float64"),
+    )
+    return video_time_df["timestamp"].to_numpy() / 1e3
+
+
+def concatenate_video_timestamps(
+    video_file_paths: list, num_workers: Optional[int] = None
+):
+    """
+    Read the timestamps of video segments in a thread pool and concatenate them in the order of video_file_paths.
+
+    Returns
+    -------
+    timestamps: np.ndarray
+        The timestamps of all segments, in seconds.
+    frame_counts: list
+        The number of frames of each segment.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        segment_timestamps = list(executor.map(read_video_timestamps, video_file_paths))
+    frame_counts = [len(x) for x in segment_timestamps]
+    timestamps = np.empty(sum(frame_counts), dtype=np.float64)
+    start = 0
+    for x in segment_timestamps:
+        timestamps[start : start + len(x)] = x
+        start += len(x)
+    return timestamps, frame_counts
+
+
+def find_camera_folders(folder_path):
+    """
+    The camera folders of a Syntalos videos folder, sorted by name.
+
+    If folder_path itself contains .mkv segments, it is the only camera folder.
+    """
+    folder_path = Path(folder_path)
+    if any(x.suffix == ".mkv" for x in folder_path.iterdir()):
+        return [folder_path]
+    return sorted(
+        x
+        for x in folder_path.iterdir()
+        if x.is_dir() and any(y.suffix == ".mkv" for y in x.iterdir())
+    )
+
+
+def get_segment_signatures(video_file_paths: list):
+    """Signatures of the video segments and of their timestamps CSVs, used to detect changes."""
+    return [
+        [file_signature(x), file_signature(get_timestamps_file_path(x))]
+        for x in video_file_paths
+    ]
+
+
+def load_frame_index(camera_folder_path) -> Optional[dict]:
+    """
+    Load the frame index cached in a camera folder.
+
+    Returns
+    -------
+    frame_index: dict or None
+        The index, with the names of the segments, their frame_counts and the starting_frame of each segment,
+        or None if it is missing, unreadable, or if any segment or timestamps CSV changed since it was written.
+    """
+    index_path = Path(camera_folder_path) / FRAME_INDEX_FILE_NAME
+    if not index_path.is_file():
+        return None
+    try:
+        with open(index_path, "r") as f:
+            frame_index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if frame_index.get("version") != FRAME_INDEX_VERSION:
+        return None
+    video_file_paths = list_video_files(camera_folder_path)
+    if frame_index["signatures"] != get_segment_signatures(video_file_paths):
+        return None
+    return frame_index
+
+
+def make_frame_index(video_file_paths: list, frame_counts: list):
+    """Frame index of a camera: its segments, their frame counts and the global starting frame of each."""
+    starting_frame = np.concatenate([[0], np.cumsum(frame_counts)[:-1]])
+    return dict(
+        segments=[Path(x).name for x in video_file_paths],
+        frame_counts=[int(x) for x in frame_counts],
+        starting_frame=[int(x) for x in starting_frame],
+        signatures=get_segment_signatures(video_file_paths),
+    )
+
+
+def save_frame_index(camera_folder_path, frame_index: dict):
+    """
+    Cache the frame index in a camera folder.
+
+    The file is replaced atomically. If the folder is not writable, the index is simply not saved.
+    """
+    index_path = Path(camera_folder_path) / FRAME_INDEX_FILE_NAME
+    tmp_path = index_path.with_name(f"{FRAME_INDEX_FILE_NAME}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(dict(frame_index, version=FRAME_INDEX_VERSION), f)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print(f"Unable to save the frame index at {index_path}: {e}")
+        if tmp_path.is_file():
+            tmp_path.unlink()
+
+
+def locate_frame(frame_index: dict, frame: int):
+    """
+    Find the segment containing a global frame number, by binary search over the starting frames.
+
+    Returns
+    -------
+    segment: str
+        The name of the video segment.
+    segment_frame: int
+        The frame number within the segment.
+    """
+    assert 0 <= frame < sum(frame_index["frame_counts"]), "Frame out of range!"
+    i = np.searchsorted(frame_index["starting_frame"], frame, side="right") - 1
+    return frame_index["segments"][i], int(frame - frame_index["starting_frame"][i])
+
 
 class SyntalosImageInterface(BaseDataInterface):
     """Conversion class for Syntalos Images."""
@@ -15,32 +179,63 @@ class SyntalosImageInterface(BaseDataInterface):
     @classmethod
     def get_source_schema(cls):
         return dict(
-            required=["folder_path"], properties=dict(folder_path=dict(type="string"))
+            required=["folder_path"],
+            properties=dict(
+                folder_path=dict(
+                    type="string",
+                    description="Path to the videos folder, with one subfolder per camera, or to a single camera "
+                    "folder.",
+                )
+            ),
         )
 
-    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
-        video_folder = Path(self.source_data["folder_path"])
-        video_file_path_list = [
-            str(x) for x in video_folder.iterdir() if x.suffix == ".mkv"
-        ]
-
-        video_timestamps = np.empty(0)
-        for video_file_path in video_file_path_list:
-            video_time_df = pd.read_csv(
-                video_file_path.replace(".mkv", "_timestamps.csv"),
-                delimiter=";",
-                skipinitialspace=True,
+    def prepare_conversion(self, num_workers: Optional[int] = None):
+        """
+        Assemble the video timestamps of each camera ahead of run_conversion.
+
+        The frame index of each camera is cached next to its videos (see load_frame_index).
+        """
+        self._prepared_data = []
+        for camera_folder_path in find_camera_folders(self.source_data["folder_path"]):
+            video_file_paths = list_video_files(camera_folder_path)
+            video_timestamps, frame_counts = concatenate_video_timestamps(
+                video_file_paths, num_workers=num_workers
             )
-            video_timestamps = np.append(
-                video_timestamps, video_time_df["timestamp"].to_numpy() / 1e3
+            frame_index = load_frame_index(camera_folder_path)
+            if frame_index is None or frame_index["frame_counts"] != frame_counts:
+                frame_index = make_frame_index(video_file_paths, frame_counts)
+                save_frame_index(camera_folder_path, frame_index)
+            self._prepared_data.append(
+                dict(
+                    camera=camera_folder_path.name,
+                    external_file=[str(x) for x in video_file_paths],
+                    starting_frame=frame_index["starting_frame"],
+                    timestamps=video_timestamps,
+                )
             )
 
-        # Custom labeled events
-        videos = ImageSeries(
-            name="Videos",
-            description="Videos recorded by TIS camera.",
-            format="external",
-            external_file=video_file_path_list,
-            timestamps=H5DataIO(video_timestamps, compression="gzip"),
-        )
-        nwbfile.add_acquisition(videos)
+    def run_conversion(
+        self, nwbfile: NWBFile, metadata: dict, num_workers: Optional[int] = None
+    ):
+        """
+        Add one external ImageSeries per camera to the NWBFile.
+
+        A single camera is named Videos; with several cameras, each is named Videos_<camera folder name>.
+        """
+        if getattr(self, "_prepared_data", None) is None:
+            self.prepare_conversion(num_workers=num_workers)
+        prepared_data, self._prepared_data = self._prepared_data, None
+
+        for camera_data in prepared_data:
+            name = "Videos"
+            if len(prepared_data) > 1:
+                name = f"Videos_{camera_data['camera']}"
+            videos = ImageSeries(
+                name=name,
+                description=f"Videos recorded by {camera_data['camera']}.",
+                format="external",
+                external_file=camera_data["external_file"],
+                starting_frame=camera_data["starting_frame"],
+                timestamps=H5DataIO(camera_data["timestamps"], compression="gzip"),
+            )
+            nwbfile.add_acquisition(videos)
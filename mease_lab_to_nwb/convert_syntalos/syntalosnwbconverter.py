@@ -2,15 +2,32 @@
 from pathlib import Path
 import toml
 from datetime import datetime
+from time import perf_counter
 from typing import Optional, Union
 import numpy as np
 
 from nwb_conversion_tools import NWBConverter
 import spikeextractors as se
-from pynwb import NWBHDF5IO
+from pynwb import NWBFile, NWBHDF5IO
 
+from ..lfp import add_lfp_electrical_series
+from ..resumablewrite import (
+    check_resumable_write,
+    get_conversion_fingerprint,
+    get_resume_conversion_options,
+    load_journal,
+    write_nwbfile_resumable,
+)
+from ..utils import (
+    copy_frame_times,
+    get_timing_report,
+    prepare_interfaces,
+    record_conversion_times,
+)
+from .syntalosfolderindex import get_session_id
 from .syntaloseventinterface import SyntalosEventInterface
 from .syntalosimageinterface import SyntalosImageInterface
+from .syntalosrecordingextractor import SyntalosRecordingExtractor
 from .syntalosrecordinginterface import SyntalosRecordingInterface
 
 OptionalArrayType = Optional[Union[list, np.ndarray]]
@@ -27,7 +44,7 @@ def quick_write(
 ):
     """Automatically extracts required session info from intan_folder_path and writes NWBFile in spikeextractors."""
     intan_folder_path = Path(intan_folder_path)
-    session_id = [x for x in intan_folder_path.iterdir() if x.suffix == ".rhd"][0].stem
+    session_id = get_session_id(intan_folder_path)
     session_start = datetime.strptime(session_id[-13:], "%y%m%d_%H%M%S")
     nwbfile_kwargs = dict(
         session_description=session_description,
@@ -35,6 +52,16 @@ def quick_write(
         session_id=session_id,
     )
     if sorting is not None:
+        if (
+            use_times
+            and sorting._times is None
+            and "frame_to_time" not in vars(sorting)
+        ):
+            # e.g. a sorting from ss.run_sorter, whose times are those of the preprocessed recording
+            print(
+                "The sorting has no frame times, using the tsync-synchronized times of the session."
+            )
+            copy_frame_times(sorting, SyntalosRecordingExtractor(intan_folder_path))
         se.NwbSortingExtractor.write_sorting(
             sorting=sorting,
             save_path=save_path,
@@ -48,6 +75,32 @@ def quick_write(
         )
 
 
+def add_sorting_and_lfp(
+    nwbfile: NWBFile,
+    sorting: Optional[se.SortingExtractor] = None,
+    recording_lfp: Optional[se.RecordingExtractor] = None,
+    use_times: bool = True,
+):
+    """Add a sorting and an LFP recording to the NWBFile, unless it already contains units or LFP."""
+    if sorting is not None:
+        if nwbfile.units is not None:
+            print("The NWBFile already contains units, skipping the sorting.")
+        else:
+            se.NwbSortingExtractor.write_sorting(
+                sorting=sorting, nwbfile=nwbfile, use_times=use_times
+            )
+    if recording_lfp is not None:
+        if (
+            "ecephys" in nwbfile.processing
+            and "LFP" in nwbfile.processing["ecephys"].data_interfaces
+        ):
+            print("The NWBFile already contains LFP, skipping the LFP recording.")
+        else:
+            se.NwbRecordingExtractor.write_recording(
+                recording=recording_lfp, nwbfile=nwbfile, write_as_lfp=True
+            )
+
+
 class SyntalosNWBConverter(NWBConverter):
     """Primary conversion class for Syntalos."""
 
@@ -56,15 +109,20 @@ class SyntalosNWBConverter(NWBConverter):
         SyntalosImage=SyntalosImageInterface,
         SyntalosRecording=SyntalosRecordingInterface,
     )
+    # Name (or name prefix) of the acquisition containers written by each interface, used to skip the interfaces
+    # already in a file when appending
+    interface_acquisition_names = dict(
+        SyntalosEvent="LabeledEvents",
+        SyntalosImage="Videos",
+        SyntalosRecording="ElectricalSeries_raw",
+    )
 
     def get_metadata(self):
         metadata = super().get_metadata()
         intan_folder_path = Path(
             self.data_interface_objects["SyntalosRecording"].source_data["folder_path"]
         )
-        session_id = [x for x in intan_folder_path.iterdir() if x.suffix == ".rhd"][
-            0
-        ].stem
+        session_id = get_session_id(intan_folder_path)
         session_start = datetime.strptime(session_id[-13:], "%y%m%d_%H%M%S")
         metadata["NWBFile"].update(
             institution="EMBL - Heidelberg",
@@ -90,10 +148,21 @@ class SyntalosNWBConverter(NWBConverter):
         sorting: Optional[se.SortingExtractor] = None,
         recording_lfp: Optional[se.RecordingExtractor] = None,
         use_times: bool = True,
+        pipeline: bool = True,
+        num_workers: Optional[int] = None,
+        resumable: bool = False,
+        lfp_options: Optional[dict] = None,
     ):
         """
         Build nwbfile object, auto-populate with minimal values if missing.
 
+        If the NWBFile at nwbfile_path exists and overwrite is False, the conversion is appended to it: only the
+        interfaces, sorting and LFP that are not in the file yet are converted and written, and the data already
+        in the file is neither loaded nor rewritten.
+
+        In pipeline mode, the event table and the video timestamps are read concurrently in a thread pool first;
+        the NWBFile is then built and written serially.
+
         Parameters
         ----------
         metadata : dict
@@ -107,35 +176,213 @@ class SyntalosNWBConverter(NWBConverter):
             A RecordingExtractor object to write to the NWBFile.
         use_times : bool
             If True, tsync timestamps are written to NWB.
+        pipeline : bool
+            If True (default), prepare the interfaces concurrently before building the NWBFile.
+        num_workers : int, optional
+            Number of threads of the pipeline. The default is the thread pool default.
+        resumable : bool
+            If True, the recording and accelerometer datasets are written chunk by chunk with their progress
+            recorded in a journal next to the NWBFile, and a conversion that was interrupted is resumed from the
+            last committed chunk (see resumablewrite.write_nwbfile_resumable). The journal records a fingerprint of
+            the source files, the metadata and the options; if they match, the recording is not read into the trace
+            cache again and only the frames after the last committed chunk are read. Otherwise the conversion starts
+            from scratch. The default is False.
+        lfp_options : dict, optional
+            If given, the LFP is computed from the raw recording with these options (see lfp.LFPChunkIterator:
+            freq_min, freq_max, lfp_rate, ...), on a process pool while the NWBFile is written, and replaces
+            recording_lfp. The default is None (no LFP stage).
         """
-        nwbfile = super().run_conversion(
-            metadata=metadata, save_to_file=False, conversion_options=conversion_options
+        if save_to_file and nwbfile_path is None:
+            raise TypeError(
+                "A path to the output file must be provided, but nwbfile_path got value None"
+            )
+        append = (
+            save_to_file
+            and not resumable
+            and Path(nwbfile_path).is_file()
+            and not overwrite
         )
-        if sorting is not None:
-            se.NwbSortingExtractor.write_sorting(
-                sorting=sorting, nwbfile=nwbfile, use_times=use_times
+
+        t0 = perf_counter()
+        if append:
+            timings = self._append_to_nwbfile(
+                nwbfile_path=nwbfile_path,
+                metadata=metadata,
+                conversion_options=conversion_options,
+                sorting=sorting,
+                recording_lfp=recording_lfp,
+                use_times=use_times,
+                pipeline=pipeline,
+                num_workers=num_workers,
+                lfp_options=lfp_options,
             )
-        if recording_lfp is not None:
-            se.NwbRecordingExtractor.write_recording(
-                recording=recording_lfp, nwbfile=nwbfile, write_as_lfp=True
+            for line in get_timing_report(timings, total_time=perf_counter() - t0):
+                print(line)
+            return
+
+        fingerprint = None
+        resume = False
+        if save_to_file and resumable:
+            check_resumable_write(nwbfile_path=nwbfile_path, overwrite=overwrite)
+            fingerprint = get_conversion_fingerprint(
+                source_data={
+                    name: interface.source_data
+                    for name, interface in self.data_interface_objects.items()
+                },
+                options=dict(
+                    metadata=metadata,
+                    conversion_options=conversion_options,
+                    use_times=use_times,
+                    lfp_options=lfp_options,
+                ),
+            )
+            resume = load_journal(nwbfile_path, fingerprint=fingerprint) is not None
+            if resume:
+                conversion_options = get_resume_conversion_options(
+                    self.data_interface_objects, conversion_options
+                )
+        timings = dict()
+        if pipeline:
+            timings = prepare_interfaces(
+                data_interface_objects=self.data_interface_objects,
+                conversion_options=conversion_options,
+                num_workers=num_workers,
+            )
+        with record_conversion_times(self.data_interface_objects, timings):
+            nwbfile = super().run_conversion(
+                metadata=metadata,
+                save_to_file=False,
+                conversion_options=conversion_options,
+            )
+        if lfp_options is not None:
+            self.add_lfp(
+                nwbfile=nwbfile,
+                lfp_options=lfp_options,
+                use_times=use_times,
+                conversion_options=conversion_options,
+                resume=resume,
             )
+        add_sorting_and_lfp(
+            nwbfile=nwbfile,
+            sorting=sorting,
+            recording_lfp=recording_lfp,
+            use_times=use_times,
+        )
 
         if save_to_file:
-            if nwbfile_path is None:
-                raise TypeError(
-                    "A path to the output file must be provided, but nwbfile_path got value None"
+            t1 = perf_counter()
+            if resumable:
+                write_nwbfile_resumable(
+                    nwbfile=nwbfile,
+                    nwbfile_path=nwbfile_path,
+                    fingerprint=fingerprint,
+                    resume=resume,
                 )
-
-            if Path(nwbfile_path).is_file() and not overwrite:
-                mode = "r+"
             else:
-                mode = "w"
-
-            with NWBHDF5IO(nwbfile_path, mode=mode) as io:
-                if mode == "r+":
-                    nwbfile = io.read()
-
-                io.write(nwbfile)
+                with NWBHDF5IO(nwbfile_path, mode="w") as io:
+                    io.write(nwbfile)
             print(f"NWB file saved at {nwbfile_path}!")
+            timings["NWBFile write"] = dict(add=perf_counter() - t1)
+            for line in get_timing_report(timings, total_time=perf_counter() - t0):
+                print(line)
         else:
+            for line in get_timing_report(timings, total_time=perf_counter() - t0):
+                print(line)
             return nwbfile
+
+    def add_lfp(
+        self,
+        nwbfile: NWBFile,
+        lfp_options: dict,
+        use_times: bool = True,
+        conversion_options: Optional[dict] = None,
+        resume: bool = False,
+    ):
+        """
+        Compute the LFP of the raw recording and add it to the NWBFile, unless it already contains LFP.
+
+        The raw recording is truncated as in the conversion of the SyntalosRecording interface if its stub_test
+        option is set. When resuming an interrupted resumable write, it is read from the rhd files without being
+        cached. See lfp.add_lfp_electrical_series.
+        """
+        if (
+            "ecephys" in nwbfile.processing
+            and "LFP" in nwbfile.processing["ecephys"].data_interfaces
+        ):
+            print("The NWBFile already contains LFP, skipping the LFP stage.")
+            return
+        interface = self.data_interface_objects["SyntalosRecording"]
+        conversion_options = conversion_options or dict()
+        if conversion_options.get("SyntalosRecording", dict()).get("stub_test", False):
+            recording = se.SubRecordingExtractor(
+                interface.recording_extractor,
+                end_frame=min(100, interface.recording_extractor.get_num_frames()),
+            )
+        elif resume:
+            recording = interface.recording_extractor
+        else:
+            recording = interface.cache_traces()
+        add_lfp_electrical_series(
+            recording=recording, nwbfile=nwbfile, use_times=use_times, **lfp_options
+        )
+
+    def _append_to_nwbfile(
+        self,
+        nwbfile_path: str,
+        metadata: dict,
+        conversion_options: Optional[dict] = None,
+        sorting: Optional[se.SortingExtractor] = None,
+        recording_lfp: Optional[se.RecordingExtractor] = None,
+        use_times: bool = True,
+        pipeline: bool = True,
+        num_workers: Optional[int] = None,
+        lfp_options: Optional[dict] = None,
+    ):
+        """
+        Add the containers that are not yet in an existing NWBFile, and write only those.
+
+        The interfaces whose acquisition container is already in the file are skipped without being prepared.
+        The existing datasets are read lazily and left untouched: on write, hdmf only writes the new containers.
+        """
+        conversion_options = conversion_options or dict()
+        with NWBHDF5IO(nwbfile_path, mode="r+") as io:
+            nwbfile = io.read()
+            new_interfaces = dict()
+            for name, interface in self.data_interface_objects.items():
+                prefix = self.interface_acquisition_names.get(name)
+                if prefix is not None and any(
+                    x.startswith(prefix) for x in nwbfile.acquisition
+                ):
+                    print(f"{name} is already in {nwbfile_path}, skipping it.")
+                else:
+                    new_interfaces[name] = interface
+            timings = dict()
+            if pipeline:
+                timings = prepare_interfaces(
+                    data_interface_objects=new_interfaces,
+                    conversion_options=conversion_options,
+                    num_workers=num_workers,
+                )
+            with record_conversion_times(new_interfaces, timings):
+                for name, interface in new_interfaces.items():
+                    interface.run_conversion(
+                        nwbfile, metadata, **conversion_options.get(name, dict())
+                    )
+            if lfp_options is not None:
+                self.add_lfp(
+                    nwbfile=nwbfile,
+                    lfp_options=lfp_options,
+                    use_times=use_times,
+                    conversion_options=conversion_options,
+                )
+            add_sorting_and_lfp(
+                nwbfile=nwbfile,
+                sorting=sorting,
+                recording_lfp=recording_lfp,
+                use_times=use_times,
+            )
+            t1 = perf_counter()
+            io.write(nwbfile)
+        print(f"NWB file appended at {nwbfile_path}!")
+        timings["NWBFile write"] = dict(add=perf_counter() - t1)
+        return timings
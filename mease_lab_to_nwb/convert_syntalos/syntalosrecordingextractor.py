@@ -1,10 +1,229 @@
 """Authors: Alessio Buccino and Cody Baker."""
-from spikeextractors import IntanRecordingExtractor, MultiRecordingTimeExtractor
+from spikeextractors import (
+    IntanRecordingExtractor,
+    MultiRecordingTimeExtractor,
+    RecordingExtractor,
+)
+from spikeextractors.extraction_tools import check_get_traces_args
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from typing import Optional
 import numpy as np
 from edlio.dataio.tsyncfile import TSyncFile, LegacyTSyncFile
 
+from .syntalosfolderindex import (
+    file_signature,
+    list_syntalos_folder,
+    load_folder_index,
+    save_folder_index,
+    sort_rhd_files,
+    to_json_compatible,
+)
+
+
+class LazyIntanRecordingExtractor(RecordingExtractor):
+    """
+    Stand-in for an IntanRecordingExtractor whose properties are known from the Syntalos folder index.
+
+    The .rhd file is only opened when its traces or its pyintan file (_recording) are first accessed.
+
+    Parameters
+    ----------
+    file_path: str or Path
+        Path to the .rhd file.
+    num_frames: int
+    sampling_frequency: float
+    channel_gains: list
+    channel_offsets: list
+    """
+
+    has_unscaled = True
+
+    def __init__(
+        self,
+        file_path: str,
+        num_frames: int,
+        sampling_frequency: float,
+        channel_gains: list,
+        channel_offsets: list,
+    ):
+        RecordingExtractor.__init__(self)
+        self._recording_file = file_path
+        self._intan_recording = None
+        self._num_frames = num_frames
+        self._fs = sampling_frequency
+        self._channel_ids = list(range(len(channel_gains)))
+        self.set_channel_gains(gains=channel_gains)
+        self.set_channel_offsets(offsets=channel_offsets)
+        self._kwargs = dict(
+            file_path=str(Path(file_path).absolute()),
+            num_frames=num_frames,
+            sampling_frequency=sampling_frequency,
+            channel_gains=list(channel_gains),
+            channel_offsets=list(channel_offsets),
+        )
+
+    @property
+    def intan_recording(self):
+        if self._intan_recording is None:
+            self._intan_recording = IntanRecordingExtractor(
+                file_path=self._recording_file
+            )
+        return self._intan_recording
+
+    @property
+    def _recording(self):
+        return self.intan_recording._recording
+
+    def get_channel_ids(self):
+        return self._channel_ids
+
+    def get_num_frames(self):
+        return self._num_frames
+
+    def get_sampling_frequency(self):
+        return self._fs
+
+    @check_get_traces_args
+    def get_traces(
+        self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+    ):
+        # Scaling, if any, is applied once by check_get_traces_args with the indexed gains and offsets
+        return self.intan_recording.get_traces(
+            channel_ids=channel_ids,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            return_scaled=False,
+        )
+
+
+def get_intan_memmaps(recording: RecordingExtractor):
+    """
+    Memmaps of the amplifier channels of an Intan recording, in the order of its channel ids.
+
+    Each memmap is a field of the pyintan memmap of the file, with shape (num_blocks, samples_per_block), or
+    (num_frames,) for channels with one sample per block. Returns None for other recordings.
+    """
+    if isinstance(recording, LazyIntanRecordingExtractor):
+        recording = recording.intan_recording
+    if not isinstance(recording, IntanRecordingExtractor):
+        return None
+    return [
+        recording._recording._raw_data[ch["name"]] for ch in recording._analog_channels
+    ]
+
+
+def copy_memmap_frames(memmap: np.ndarray, start: int, end: int, out: np.ndarray):
+    """
+    Copy the frames [start, end) of an Intan channel memmap into the one-dimensional array out.
+
+    The complete blocks are copied straight into a (num_blocks, samples_per_block) view of out, so that only the
+    partial blocks at the edges are sliced separately.
+    """
+    if memmap.ndim == 1:
+        out[:] = memmap[start:end]
+        return
+    block_size = memmap.shape[1]
+    position = 0
+    head = start % block_size
+    if head != 0:
+        position = min(block_size - head, end - start)
+        out[:position] = memmap[start // block_size, head : head + position]
+    num_blocks = (end - start - position) // block_size
+    if num_blocks > 0:
+        first_block = (start + position) // block_size
+        block_end = position + num_blocks * block_size
+        out[position:block_end].reshape(num_blocks, block_size)[:] = memmap[
+            first_block : first_block + num_blocks
+        ]
+        position = block_end
+    if position < end - start:
+        out[position:] = memmap[
+            (start + position) // block_size, : end - start - position
+        ]
+
+
+class MultiFileBlockReader:
+    """
+    Reader of frame ranges of recordings concatenated in time, possibly spanning several files.
+
+    Global frames are mapped to (file, frame in file) with a cumulative frame index and np.searchsorted, and the
+    raw traces of each file are copied straight from its Intan memmaps into a single preallocated array. Recordings
+    without Intan memmaps are read with their get_traces method.
+
+    Parameters
+    ----------
+    recordings: list
+        The recordings, in time order, with the same channel ids.
+    """
+
+    def __init__(self, recordings: list):
+        self.recordings = recordings
+        self.channel_ids = list(recordings[0].get_channel_ids())
+        num_frames = [recording.get_num_frames() for recording in recordings]
+        self.cumulative_frames = np.concatenate([[0], np.cumsum(num_frames)])
+        self._memmaps = dict()
+
+    def locate(self, frames):
+        """Return the file index and the frame in that file of each global frame."""
+        frames = np.asarray(frames)
+        file_indices = np.searchsorted(self.cumulative_frames, frames, side="right") - 1
+        file_indices = np.clip(file_indices, 0, len(self.recordings) - 1)
+        return file_indices, frames - self.cumulative_frames[file_indices]
+
+    def get_memmaps(self, file_index: int):
+        if file_index not in self._memmaps:
+            self._memmaps[file_index] = get_intan_memmaps(self.recordings[file_index])
+        return self._memmaps[file_index]
+
+    def read(self, channel_ids: list, start_frame: int, end_frame: int):
+        """
+        Return the unscaled traces of the frames [start_frame, end_frame) of the given channels.
+
+        Returns
+        -------
+        traces: np.ndarray
+            Array with shape (num_channels, end_frame - start_frame).
+        """
+        channel_idxs = [self.channel_ids.index(ch) for ch in channel_ids]
+        (first_file, last_file), (first_offset, _) = self.locate(
+            [start_frame, end_frame - 1]
+        )
+        traces = None
+        for file_index in range(first_file, last_file + 1):
+            file_start_frame = self.cumulative_frames[file_index]
+            start = first_offset if file_index == first_file else 0
+            end = min(
+                end_frame - file_start_frame,
+                self.recordings[file_index].get_num_frames(),
+            )
+            out_start = file_start_frame + start - start_frame
+            out_end = out_start + end - start
+            memmaps = self.get_memmaps(file_index)
+            if memmaps is None:
+                block = self.recordings[file_index].get_traces(
+                    channel_ids=channel_ids,
+                    start_frame=start,
+                    end_frame=end,
+                    return_scaled=False,
+                )
+                if traces is None:
+                    traces = np.empty(
+                        (len(channel_ids), end_frame - start_frame), dtype=block.dtype
+                    )
+                traces[:, out_start:out_end] = block
+                continue
+            if traces is None:
+                traces = np.empty(
+                    (len(channel_ids), end_frame - start_frame),
+                    dtype=memmaps[0].dtype,
+                )
+            for i, channel_idx in enumerate(channel_idxs):
+                copy_memmap_frames(
+                    memmaps[channel_idx], start, end, traces[i, out_start:out_end]
+                )
+        return traces
+
 
 # class SyntalosMultiRecordingExtractor(MultiRecordingTimeExtractor):
 class SyntalosRecordingExtractor(MultiRecordingTimeExtractor):
@@ -14,49 +233,137 @@ class SyntalosRecordingExtractor(MultiRecordingTimeExtractor):
     The recording extractor is an MultiRecordingTimeExtractor with multiple IntanRecordingExtractors,
     but synchronization is performed using the .tsync file.
 
+    Traces are read with a MultiFileBlockReader, so that a frame range spanning several files is copied from
+    their memmaps into a single array.
+
+    The file order, frame counts, channel gains and offsets and the tsync sync points are stored in a sidecar
+    index in the folder (see syntalosfolderindex), so that reopening an unchanged session does not parse any
+    .rhd header or the .tsync file; the .rhd files are then opened on first access to their traces.
+
     Parameters
     ----------
     folder_path: str or Path
         The path to the .rhd files
+    num_workers: int or None
+        Number of threads used to open the .rhd files. If 1, the files are opened serially.
+        If None (default), the thread pool default is used.
+    use_index: bool
+        If True (default), read the folder index if it is up to date, and write it otherwise.
     """
 
-    def __init__(self, folder_path: str):
-        file_paths = [p for p in Path(folder_path).iterdir() if p.suffix == ".rhd"]
-        for file_path in file_paths:
-            assert file_path.is_file(), "The provided file does not exist!"
-            assert (
-                file_path.suffix == ".rhd"
-            ), "The provided file is not an '.rhd' file!"
-        assert len(file_paths) >= 1, "No rhd files found in the folder path!"
-        tsync_files = [
-            p for p in file_paths[0].parent.iterdir() if p.suffix == ".tsync"
-        ]
-        assert (
-            len(tsync_files) == 1
-        ), "Only one tsync file should be present in the Syntalos folder!"
-
-        # order rhd files by date
-        dates = []
-        for file_path in file_paths:
-            file_name = file_path.stem
-            date = datetime.strptime(
-                "-".join(file_name.split("_")[-2:]), "%y%m%d-%H%M%S"
-            )
-            dates.append(date)
-        files_sorted = np.array(file_paths)[np.argsort(dates)]
+    def __init__(
+        self,
+        folder_path: str,
+        num_workers: Optional[int] = None,
+        use_index: bool = True,
+    ):
+        folder_index = load_folder_index(folder_path) if use_index else None
+        if folder_index is not None:
+            recordings = [
+                LazyIntanRecordingExtractor(
+                    file_path=Path(folder_path) / file["name"],
+                    num_frames=file["num_frames"],
+                    sampling_frequency=folder_index["sampling_frequency"],
+                    channel_gains=folder_index["channel_gains"],
+                    channel_offsets=folder_index["channel_offsets"],
+                )
+                for file in folder_index["rhd_files"]
+            ]
+            sync_map = np.array(folder_index["tsync_file"]["times"], dtype=np.int64)
+        else:
+            file_paths, tsync_file = list_syntalos_folder(folder_path)
+            signatures = [file_signature(p) for p in file_paths + [tsync_file]]
+            files_sorted = sort_rhd_files(file_paths)
 
-        recordings = []
-        for file_path in files_sorted:
-            intan_recording = IntanRecordingExtractor(file_path=file_path)
-            recordings.append(intan_recording)
+            # header parsing and memmap setup are independent for each file; map keeps the date order
+            if num_workers == 1:
+                recordings = [
+                    IntanRecordingExtractor(file_path=file_path)
+                    for file_path in files_sorted
+                ]
+            else:
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    recordings = list(
+                        executor.map(IntanRecordingExtractor, files_sorted)
+                    )
+            for file_path, intan_recording in zip(files_sorted[1:], recordings[1:]):
+                if (
+                    intan_recording.get_channel_ids() != recordings[0].get_channel_ids()
+                    or intan_recording.get_sampling_frequency()
+                    != recordings[0].get_sampling_frequency()
+                ):
+                    raise ValueError(
+                        f"The file {file_path.name} does not have the same channels and sampling frequency "
+                        f"as {files_sorted[0].name}!"
+                    )
+            sync_map = _read_tsync_times(tsync_file)
+
+            signatures = {signature["name"]: signature for signature in signatures}
+            folder_index = to_json_compatible(
+                dict(
+                    rhd_files=[
+                        dict(
+                            signatures[file_path.name],
+                            num_frames=recording.get_num_frames(),
+                        )
+                        for file_path, recording in zip(files_sorted, recordings)
+                    ],
+                    tsync_file=dict(signatures[tsync_file.name], times=sync_map),
+                    sampling_frequency=recordings[0].get_sampling_frequency(),
+                    channel_gains=recordings[0].get_channel_gains(),
+                    channel_offsets=recordings[0].get_channel_offsets(),
+                )
+            )
+            if use_index:
+                save_folder_index(folder_path, folder_index)
+        self.folder_index = folder_index
 
         super().__init__(recordings)
-        timestamps = _get_timestamps_with_tsync(self, tsync_files[0])
-        self.set_times(timestamps)
-        self._kwargs = {"folder_path": str(Path(folder_path).absolute())}
+        self._block_reader = MultiFileBlockReader(recordings)
+        self._tsync_timestamps = TSyncTimestamps(
+            sync_map=sync_map,
+            num_frames=self.get_num_frames(),
+            sampling_frequency=self.get_sampling_frequency(),
+        )
+        self._kwargs = {
+            "folder_path": str(Path(folder_path).absolute()),
+            "num_workers": num_workers,
+            "use_index": use_index,
+        }
+
+    @check_get_traces_args
+    def get_traces(
+        self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+    ):
+        # Frame ranges spanning several files are filled into a single array (see MultiFileBlockReader);
+        # the scaling of the first file applies to all of them, as its gains and offsets are those of the folder
+        traces = self._block_reader.read(
+            channel_ids=channel_ids, start_frame=start_frame, end_frame=end_frame
+        )
+        if return_scaled:
+            first_recording = self._recordings[0]
+            gains = first_recording.get_channel_gains(channel_ids=channel_ids)
+            offsets = first_recording.get_channel_offsets(channel_ids=channel_ids)
+            traces = traces.astype("float32") * gains[:, None] + offsets[:, None]
+            traces = traces.astype("float32")
+        return traces
+
+    def frame_to_time(self, frames):
+        return self._tsync_timestamps.frame_to_time(frames)
+
+    def time_to_frame(self, times):
+        return self._tsync_timestamps.time_to_frame(times)
 
+    def get_times(
+        self, start_frame: Optional[int] = None, end_frame: Optional[int] = None
+    ):
+        """Return the tsync-synchronized times (in seconds) of the frames in [start_frame, end_frame)."""
+        return self._tsync_timestamps.get_times(
+            start_frame=start_frame, end_frame=end_frame
+        )
 
-def _get_timestamps_with_tsync(recording, tsync_file):
+
+def _read_tsync_times(tsync_file):
     try:
         tsync = TSyncFile(tsync_file)
     except:
@@ -64,23 +371,113 @@ def _get_timestamps_with_tsync(recording, tsync_file):
             tsync = LegacyTSyncFile(tsync_file)
         except:
             raise RuntimeError("The .tsync file could not be parsed.")
+    return tsync.times
 
-    sync_map = tsync.times
-    num_frames = recording.get_num_frames()
-    sampling_frequency = recording.get_sampling_frequency()
-    tv_usec = np.arange(num_frames, dtype=np.float64) / sampling_frequency * 1e6
-    tv_adj_usec = np.arange(num_frames, dtype=np.float64) / sampling_frequency * 1e6
 
-    init_offset_usec = offset_usec = sync_map[0][0] - sync_map[0][1]
-    idx = np.where(tv_usec <= sync_map[0][0])[0]
-    tv_adj_usec[idx] -= init_offset_usec
+class TSyncTimestamps:
+    """
+    Compact model of the tsync-synchronized frame times.
+
+    Only the sync points of the tsync file are stored; the time of any frame is computed on demand.
+    Frames up to the first sync point are corrected with the offset of the first sync point, frames in
+    (sync[s - 1], sync[s]] with the offset of sync point s, and frames after the last sync point keep the
+    offset of the last one.
+
+    Parameters
+    ----------
+    sync_map: np.ndarray
+        Array of (master time, device time) pairs in microseconds, as in TSyncFile.times.
+    num_frames: int
+    sampling_frequency: float
+    """
+
+    def __init__(
+        self, sync_map: np.ndarray, num_frames: int, sampling_frequency: float
+    ):
+        sync_map = np.asarray(sync_map)
+        assert len(sync_map) > 0, "The tsync file does not contain any sync points!"
+        self.sync_times_usec = sync_map[:, 0].astype(np.float64)
+        self.offsets_usec = sync_map[:, 0] - sync_map[:, 1]
+        self.num_frames = num_frames
+        self.sampling_frequency = sampling_frequency
+
+    def _correct(self, tv_usec: np.ndarray):
+        segments = np.searchsorted(self.sync_times_usec, tv_usec, side="left")
+        segments = np.minimum(segments, len(self.offsets_usec) - 1)
+        return (tv_usec - self.offsets_usec[segments]) / 1e6
+
+    def frame_to_time(self, frames):
+        """Return the synchronized time (in seconds) of a frame or array of frames."""
+        tv_usec = np.asarray(frames).astype(np.float64) / self.sampling_frequency * 1e6
+        return self._correct(tv_usec)
+
+    def get_times(
+        self, start_frame: Optional[int] = None, end_frame: Optional[int] = None
+    ):
+        """Return the synchronized times (in seconds) of the frames in [start_frame, end_frame)."""
+        start_frame = 0 if start_frame is None else start_frame
+        end_frame = self.num_frames if end_frame is None else end_frame
+        tv_usec = np.arange(start_frame, end_frame, dtype=np.float64)
+        tv_usec /= self.sampling_frequency
+        tv_usec *= 1e6
+        return self._correct(tv_usec)
+
+    def _segment_start_frames(self):
+        """First frame of each constant-offset segment."""
+        # First frame strictly after each sync point, refined to absorb floating point errors
+        frames = np.floor(self.sync_times_usec / 1e6 * self.sampling_frequency).astype(
+            np.int64
+        )
+        frames = np.clip(frames, 0, self.num_frames)
+        for _ in range(2):
+            tv_usec = frames.astype(np.float64) / self.sampling_frequency * 1e6
+            frames = np.where(tv_usec <= self.sync_times_usec, frames + 1, frames)
+            tv_usec = (frames - 1).astype(np.float64) / self.sampling_frequency * 1e6
+            frames = np.where(
+                (frames > 0) & (tv_usec > self.sync_times_usec), frames - 1, frames
+            )
+        return np.clip(np.concatenate([[0], frames[:-1]]), 0, self.num_frames)
+
+    def time_to_frame(self, times):
+        """
+        Return the first frame whose synchronized time is greater or equal than each of the given times.
+
+        Equivalent to np.searchsorted on the dense array of frame times, assuming that it is sorted.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        start_frames = self._segment_start_frames()
+        end_frames = np.append(start_frames[1:], self.num_frames)
+        segment_start_times = np.where(
+            start_frames < self.num_frames,
+            self.frame_to_time(np.minimum(start_frames, self.num_frames - 1)),
+            np.inf,
+        )
+        segments = np.searchsorted(segment_start_times, times, side="right") - 1
+        segments = np.clip(segments, 0, len(start_frames) - 1)
+        offsets_usec = self.offsets_usec[segments]
+        frames = np.ceil((times * 1e6 + offsets_usec) / 1e6 * self.sampling_frequency)
+        frames = np.clip(
+            frames.astype(np.int64), start_frames[segments], end_frames[segments]
+        )
+        for _ in range(2):
+            previous = np.maximum(frames - 1, 0)
+            frames = np.where(
+                (frames > start_frames[segments])
+                & (self.frame_to_time(previous) >= times),
+                previous,
+                frames,
+            )
+            current = np.minimum(frames, self.num_frames - 1)
+            frames = np.where(
+                (frames < end_frames[segments]) & (self.frame_to_time(current) < times),
+                frames + 1,
+                frames,
+            )
+        return frames.astype("int64")
 
-    for s, sync in enumerate(sync_map):
-        if s < len(sync_map) - 1:
-            idx = np.where((tv_usec > sync[0]) & (tv_usec <= sync_map[s + 1][0]))[0]
-            offset_usec = sync_map[s + 1][0] - sync_map[s + 1][1]
-        else:
-            idx = np.where(tv_usec > sync[0])[0]
-        tv_adj_usec[idx] -= offset_usec
 
-    return tv_adj_usec / 1e6
+def tsync_timestamps(sync_map: np.ndarray, num_frames: int, sampling_frequency: float):
+    """Compute the dense array of synchronized times (in seconds) of all frames."""
+    return TSyncTimestamps(
+        sync_map=sync_map, num_frames=num_frames, sampling_frequency=sampling_frequency
+    ).get_times()
@@ -1,6 +1,9 @@
 """Authors: Cody Baker and Ben Dichter."""
+
 import numpy as np
+from copy import deepcopy
 from pathlib import Path
+from typing import Optional
 
 from spikeextractors import NwbRecordingExtractor, SubRecordingExtractor
 from pynwb import NWBFile, TimeSeries
@@ -8,8 +11,21 @@ from nwb_conversion_tools.datainterfaces.ecephys.baserecordingextractorinterface
     BaseRecordingExtractorInterface,
 )
 from nwb_conversion_tools import IntanRecordingInterface
+from nwb_conversion_tools.utils.json_schema import get_schema_from_method_signature
 from hdmf.backends.hdf5.h5_utils import H5DataIO
 
+from ..probes import (
+    add_group_electrical_series,
+    apply_probe_file,
+    update_electrode_group_metadata,
+)
+from ..utils import (
+    FrameTimesChunkIterator,
+    MultiMemmapChunkIterator,
+    add_electrical_series,
+)
+from ..tracecache import CachedRecordingExtractor, cache_recording
+from .syntalosfolderindex import save_folder_index, to_json_compatible
 from .syntalosrecordingextractor import SyntalosRecordingExtractor
 
 
@@ -19,17 +35,24 @@ def all_equal(lst: list):
 
 
 def write_accelerometer_data(
-    nwbfile: NWBFile, recording, stub_test: bool = False, use_times: bool = False
+    nwbfile: NWBFile,
+    recording,
+    stub_test: bool = False,
+    use_times: bool = False,
+    buffer_frames: int = 1000000,
+    chunk_frames: int = 10000,
 ):
     """
     Add accelerometer data from a single rhd file to the NWBFile.
 
     Expects full timestamps from the higher-frequency recording extractor.
+    The auxiliary channels are written block by block, reading buffer_frames frames at a time, with HDF5 chunks of
+    chunk_frames frames.
     """
-    if isinstance(recording, SubRecordingExtractor):
-        this_recording = recording._parent_recording
-    else:
-        this_recording = recording
+    # The Syntalos recording below the stub, channel subset and probe SubRecordingExtractors
+    this_recording = recording
+    while isinstance(this_recording, SubRecordingExtractor):
+        this_recording = this_recording._parent_recording
     accel_channels = np.array(
         [
             ch
@@ -60,22 +83,22 @@ def write_accelerometer_data(
 
     conversion = channel_conversion[0]
     accel_sampling_rate = accel_channel_sampling_rate[0]
+    # Lazy view over the AUX memmaps of all rhd files: only the frames of each written block are read
     all_memmaps = [
-        [
-            x._recording._raw_data[accel_channels[j]["name"]].flatten()
-            for j in range(accel_channels.size)
-        ]
+        [x._recording._raw_data[ch["name"]] for ch in accel_channels]
         for x in this_recording._recordings
     ]
-
-    all_accel_data = np.concatenate(np.moveaxis(np.array(all_memmaps), 2, 1))
-    if stub_test:
-        all_accel_data = all_accel_data[:100, :]
+    accel_data = MultiMemmapChunkIterator(
+        memmaps=all_memmaps,
+        num_frames=100 if stub_test else None,
+        buffer_frames=buffer_frames,
+        chunk_shape=(chunk_frames, accel_channels.size),
+    )
 
     tseries_kwargs = dict(
         name="Accelerometer",
         description="Data recorded from auxiliary channels from an intan device, tracking acceleration.",
-        data=H5DataIO(all_accel_data, compression="gzip"),
+        data=H5DataIO(accel_data, compression="gzip"),
         unit=accel_channel_units[0],
         resolution=np.nan,
         conversion=conversion,
@@ -83,12 +106,14 @@ def write_accelerometer_data(
     if not use_times:
         tseries_kwargs.update(rate=accel_sampling_rate)
     else:
-        accel_timestamps = recording.frame_to_time(
-            np.arange(
-                0,
-                this_recording.get_num_frames(),
-                this_recording.get_sampling_frequency() / accel_sampling_rate,
-            ).astype(int)
+        # Times of every (fs / accel_sampling_rate)-th frame, computed block by block from the tsync model
+        accel_timestamps = FrameTimesChunkIterator(
+            recording=recording,
+            num_frames=this_recording.get_num_frames(),
+            frame_step=this_recording.get_sampling_frequency() / accel_sampling_rate,
+            buffer_size=buffer_frames,
+            chunk_shape=(chunk_frames,),
+            num_times=accel_data.maxshape[0],
         )
         tseries_kwargs.update(timestamps=H5DataIO(accel_timestamps, compression="gzip"))
 
@@ -100,14 +125,137 @@ class SyntalosRecordingInterface(BaseRecordingExtractorInterface):
 
     RX = SyntalosRecordingExtractor
 
+    @classmethod
+    def get_source_schema(cls):
+        source_schema = super().get_source_schema()
+        source_schema["properties"].update(
+            probe_file=dict(
+                type="string",
+                format="file",
+                description="Path to a .prb or .csv probe file, or name of a probe file of the probe_files folder "
+                "(e.g. tetrode_32), setting the channel groups and locations.",
+            ),
+            cache_folder=dict(
+                type="string",
+                format="directory",
+                description="Folder of a trace cache; the raw traces are read once into it and converted from it.",
+            ),
+            cache_gb=dict(
+                type="number",
+                exclusiveMinimum=0,
+                description="Size budget of the trace cache in GB.",
+            ),
+        )
+        return source_schema
+
+    def __init__(
+        self,
+        probe_file: Optional[str] = None,
+        cache_folder: Optional[str] = None,
+        cache_gb: Optional[float] = None,
+        **source_data,
+    ):
+        super().__init__(**source_data)
+        self.syntalos_recording = self.recording_extractor
+        if probe_file is not None:
+            self.source_data.update(probe_file=probe_file)
+            self.recording_extractor = apply_probe_file(
+                self.recording_extractor, probe_file
+            )
+        if cache_folder is not None:
+            # The traces are only cached on first use (see cache_traces), not to read them for the metadata
+            self.source_data.update(cache_folder=cache_folder, cache_gb=cache_gb)
+
+    def cache_traces(self):
+        """
+        Return the recording, after reading it into the trace cache of the cache_folder source option, if given.
+
+        The traces (and tsync times) are then read from the memory-mapped cache by every later stage. This is done
+        on the first use of the traces (prepare_conversion, run_conversion or the LFP stage of the converter), so
+        that building the interface, e.g. for its metadata or schema, does not read the recording.
+        """
+        cache_folder = self.source_data.get("cache_folder")
+        if cache_folder is not None and not isinstance(
+            self.recording_extractor, CachedRecordingExtractor
+        ):
+            self.recording_extractor = cache_recording(
+                self.recording_extractor,
+                cache_folder,
+                max_gb=self.source_data.get("cache_gb"),
+            )
+        return self.recording_extractor
+
+    def prepare_conversion(self, stub_test: bool = False, resume: bool = False):
+        """
+        Read the recording into the trace cache ahead of run_conversion, if a cache_folder is given.
+
+        When resuming an interrupted resumable write (resume=True), the recording is not cached: only the frames
+        after the last committed chunk are read, from the rhd files.
+        """
+        if not stub_test and not resume:
+            self.cache_traces()
+
+    @classmethod
+    def get_conversion_options_schema(cls):
+        conversion_options_schema = get_schema_from_method_signature(
+            class_method=cls.run_conversion, exclude=["nwbfile", "metadata"]
+        )
+        conversion_options_schema["properties"].update(
+            chunk_frames=dict(
+                type=["integer", "null"],
+                minimum=1,
+                description="Number of frames per HDF5 chunk of the traces.",
+            ),
+            chunk_channels=dict(
+                type=["integer", "null"],
+                minimum=1,
+                description="Number of channels per HDF5 chunk of the traces.",
+            ),
+            compression=dict(
+                type=["string", "null"],
+                enum=["gzip", "lzf", None],
+                default="gzip",
+                description="Compression filter of the traces.",
+            ),
+            compression_opts=dict(
+                type=["integer", "null"],
+                minimum=0,
+                maximum=9,
+                description="Level of the gzip compression.",
+            ),
+            shuffle=dict(
+                type="boolean",
+                default=False,
+                description="Whether to apply the byte shuffle filter before compression.",
+            ),
+            buffer_mb=dict(
+                type=["number", "null"],
+                exclusiveMinimum=0,
+                description="Size in MB of the blocks of traces read at a time.",
+            ),
+        )
+        return conversion_options_schema
+
     def get_metadata(self):
-        intan_filepath = [
-            x
-            for x in Path(self.source_data["folder_path"]).iterdir()
-            if x.suffix == ".rhd"
-        ][0]
-        temp_intan_interface = IntanRecordingInterface(file_path=intan_filepath)
-        return temp_intan_interface.get_metadata()
+        # The metadata of the first rhd file is cached in the folder index next to the file table
+        folder_path = Path(self.source_data["folder_path"])
+        folder_index = self.syntalos_recording.folder_index
+        if "metadata" not in folder_index:
+            intan_filepath = folder_path / folder_index["rhd_files"][0]["name"]
+            temp_intan_interface = IntanRecordingInterface(file_path=intan_filepath)
+            folder_index["metadata"] = to_json_compatible(
+                temp_intan_interface.get_metadata()
+            )
+            if self.source_data.get("use_index", True):
+                save_folder_index(folder_path, folder_index)
+        metadata = deepcopy(folder_index["metadata"])
+        if "probe_file" in self.source_data:
+            update_electrode_group_metadata(
+                metadata=metadata,
+                recording=self.recording_extractor,
+                probe_file=self.source_data["probe_file"],
+            )
+        return metadata
 
     def run_conversion(
         self,
@@ -117,10 +265,23 @@ class SyntalosRecordingInterface(BaseRecordingExtractorInterface):
         add_accelerometer: bool = True,
         overwrite: bool = False,
         use_times: bool = True,
+        chunk_frames: Optional[int] = None,
+        chunk_channels: Optional[int] = None,
+        compression: Optional[str] = "gzip",
+        compression_opts: Optional[int] = None,
+        shuffle: bool = False,
+        buffer_mb: Optional[float] = None,
+        group_series: bool = False,
+        num_workers: Optional[int] = None,
+        resume: bool = False,
     ):
         """
         Primary conversion function for Syntalos recordings.
 
+        The raw traces are written block by block with the given HDF5 layout (see utils.add_electrical_series).
+        With group_series, each channel group (e.g. each tetrode of the probe file) is written as its own
+        ElectricalSeries instead (see probes.add_group_electrical_series).
+
         Parameters
         ----------
         nwbfile : NWBFile
@@ -133,24 +294,75 @@ class SyntalosRecordingInterface(BaseRecordingExtractorInterface):
             If true, uses the timestamps obtained from the tsync file. The default is True.
         overwrite: bool
             If using save_path, whether or not to overwrite the NWBFile if it already exists.
-
+        chunk_frames: int, optional
+            Number of frames per HDF5 chunk of the traces. The default leaves the chunking to the backend.
+        chunk_channels: int, optional
+            Number of channels per HDF5 chunk of the traces, used with chunk_frames. Defaults to all channels.
+        compression: str, optional
+            Compression filter of the traces: "gzip" (default), "lzf" or None.
+        compression_opts: int, optional
+            Level of the gzip compression (0-9).
+        shuffle: bool, optional
+            If true, applies the byte shuffle filter before compression. The default is False.
+        buffer_mb: float, optional
+            Size in MB of the blocks of traces read at a time. The default is 1000000 frames.
+        group_series: bool, optional
+            If true, writes one ElectricalSeries per channel group, named ElectricalSeries_raw_group<group>,
+            instead of ElectricalSeries_raw. Each group is then read from the rhd files in turn, unless the
+            cache_folder source option is given, in which case the recording is read once into the trace cache
+            (taking as much disk space as the raw traces) and the groups from there. The default is False.
+        num_workers: int, optional
+            Number of threads reading blocks of traces ahead of the write. The default reads them serially, or
+            with 2 threads per group with group_series.
+        resume: bool, optional
+            If true, the NWBFile is built to resume an interrupted resumable write, and the recording is read from
+            the rhd files without being cached (see prepare_conversion). The default is False.
         """
+        if not stub_test and not resume:
+            self.cache_traces()
         if stub_test or self.subset_channels is not None:
             recording = self.subset_recording(stub_test=stub_test)
         else:
             recording = self.recording_extractor
 
-        NwbRecordingExtractor.write_recording(
-            recording=recording,
-            nwbfile=nwbfile,
-            metadata=metadata,
-            use_times=use_times,
-            overwrite=overwrite,
+        # Same content as NwbRecordingExtractor.write_recording, with the traces streamed through a chunk iterator
+        for add_function in [
+            NwbRecordingExtractor.add_devices,
+            NwbRecordingExtractor.add_electrode_groups,
+            NwbRecordingExtractor.add_electrodes,
+        ]:
+            add_function(recording=recording, nwbfile=nwbfile, metadata=metadata)
+        write_options = dict(
+            chunk_frames=chunk_frames,
+            chunk_channels=chunk_channels,
+            compression=compression,
+            compression_opts=compression_opts,
+            shuffle=shuffle,
+            buffer_mb=buffer_mb,
+        )
+        if group_series:
+            add_group_electrical_series(
+                recording=recording,
+                nwbfile=nwbfile,
+                use_times=use_times,
+                num_workers=num_workers or 2,
+                **write_options,
+            )
+        else:
+            add_electrical_series(
+                recording=recording,
+                nwbfile=nwbfile,
+                use_times=use_times,
+                num_workers=num_workers,
+                **write_options,
+            )
+        NwbRecordingExtractor.add_epochs(
+            recording=recording, nwbfile=nwbfile, metadata=metadata
         )
         if add_accelerometer:
             write_accelerometer_data(
                 nwbfile=nwbfile,
-                recording=recording,
+                recording=self.syntalos_recording,
                 stub_test=stub_test,
                 use_times=use_times,
             )
@@ -0,0 +1,327 @@
+"""LFP extraction: low-pass or band-pass filtering and decimation of recordings in overlapping chunks, in parallel."""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import spikeextractors as se
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+from pynwb import NWBFile
+from pynwb.ecephys import ElectricalSeries, LFP
+from scipy.signal import butter, sosfiltfilt
+
+from .utils import FrameTimesChunkIterator
+
+_worker_recording = None
+
+
+def get_lfp_filter(
+    sampling_frequency: float,
+    freq_min: Optional[float] = 1.0,
+    freq_max: float = 300.0,
+    order: int = 3,
+):
+    """Butterworth filter (second-order sections) of the LFP: band-pass, or low-pass if freq_min is None."""
+    if freq_min is None:
+        return butter(
+            order, freq_max, btype="lowpass", fs=sampling_frequency, output="sos"
+        )
+    return butter(
+        order,
+        [freq_min, freq_max],
+        btype="bandpass",
+        fs=sampling_frequency,
+        output="sos",
+    )
+
+
+def get_margin_frames(
+    sampling_frequency: float, freq_min: Optional[float] = 1.0, freq_max: float = 300.0
+):
+    """Frames read on each side of a chunk, so that the filter transients at its edges have decayed (5 periods)."""
+    lowest_frequency = freq_max if freq_min is None else freq_min
+    return int(np.ceil(5 * sampling_frequency / lowest_frequency))
+
+
+def filter_and_decimate(
+    recording: se.RecordingExtractor,
+    sos: np.ndarray,
+    decimation: int,
+    start: int,
+    end: int,
+    margin_frames: int,
+):
+    """
+    Compute the LFP frames [start, end) of a recording.
+
+    LFP frame i is the zero-phase filtered recording at frame i * decimation. The frames are computed from the
+    recording frames they span plus margin_frames on each side (clipped to the recording), so that the result only
+    differs from filtering the full recording by the transients at the edges of that margin.
+
+    Returns
+    -------
+    lfp: np.ndarray
+        The LFP traces (in uV), with shape (end - start, num_channels).
+    """
+    first = start * decimation
+    last = (end - 1) * decimation + 1
+    read_start = max(first - margin_frames, 0)
+    read_end = min(last + margin_frames, recording.get_num_frames())
+    traces = recording.get_traces(
+        start_frame=read_start, end_frame=read_end, return_scaled=True
+    )
+    filtered = sosfiltfilt(sos, traces.astype(np.float64), axis=1)
+    lfp = filtered[:, first - read_start : last - read_start : decimation]
+    return lfp.T.astype(np.float32)
+
+
+def _init_worker(recording_dict: dict):
+    global _worker_recording
+    _worker_recording = se.load_extractor_from_dict(recording_dict)
+
+
+def _filter_and_decimate_in_worker(*args):
+    return filter_and_decimate(_worker_recording, *args)
+
+
+class LFPChunkIterator(AbstractDataChunkIterator):
+    """
+    Data chunk iterator over the LFP of a recording, computed chunk by chunk on a process pool.
+
+    The recording is rebuilt in each worker process from its serialized dict, so it must be dumpable; otherwise a
+    thread pool is used. At most two chunks per worker are computed ahead of the write.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    freq_min: float (optional, defaults to 1.)
+        Low cutoff of the band-pass filter, in Hz. If None, a low-pass filter is used.
+    freq_max: float (optional, defaults to 300.)
+        High cutoff, in Hz. It must be below the Nyquist frequency of the LFP.
+    lfp_rate: float (optional, defaults to 1000.)
+        Target sampling rate of the LFP, in Hz. The recording is decimated by the closest integer factor.
+    order: int (optional, defaults to 3)
+        Order of the Butterworth filter.
+    chunk_frames: int (optional, defaults to 100000)
+        Number of LFP frames computed at a time by a worker.
+    margin_frames: int (optional)
+        Recording frames read on each side of a chunk. Defaults to get_margin_frames.
+    num_workers: int (optional)
+        Number of worker processes. The default is the number of CPUs.
+    chunk_shape: tuple (optional)
+        Recommended HDF5 chunk shape. If None, the chunking is left to the backend.
+    """
+
+    def __init__(
+        self,
+        recording: se.RecordingExtractor,
+        freq_min: Optional[float] = 1.0,
+        freq_max: float = 300.0,
+        lfp_rate: float = 1000.0,
+        order: int = 3,
+        chunk_frames: int = 100000,
+        margin_frames: Optional[int] = None,
+        num_workers: Optional[int] = None,
+        chunk_shape: Optional[tuple] = None,
+    ):
+        self.recording = recording
+        sampling_frequency = recording.get_sampling_frequency()
+        self.decimation = max(int(round(sampling_frequency / lfp_rate)), 1)
+        self.sampling_frequency = sampling_frequency / self.decimation
+        assert (
+            freq_max < self.sampling_frequency / 2
+        ), f"freq_max must be below the Nyquist frequency of the LFP ({self.sampling_frequency / 2} Hz)!"
+        self.sos = get_lfp_filter(
+            sampling_frequency, freq_min=freq_min, freq_max=freq_max, order=order
+        )
+        if margin_frames is None:
+            margin_frames = get_margin_frames(
+                sampling_frequency, freq_min=freq_min, freq_max=freq_max
+            )
+        self.margin_frames = margin_frames
+        self.chunk_frames = int(chunk_frames)
+        self.num_workers = num_workers
+        self._num_frames = int(np.ceil(recording.get_num_frames() / self.decimation))
+        self._num_channels = recording.get_num_channels()
+        if chunk_shape is not None:
+            chunk_shape = (min(chunk_shape[0], self._num_frames), chunk_shape[1])
+        self._chunk_shape = chunk_shape
+        self._executor = None
+        self._pending = deque()
+        self._next_start = 0
+        self._start = 0
+
+    def _start_executor(self):
+        if self.recording.check_if_dumpable():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_init_worker,
+                initargs=(self.recording.make_serialized_dict(),),
+            )
+            self._worker_function = _filter_and_decimate_in_worker
+            self._worker_args = ()
+        else:
+            print("The recording is not dumpable; computing the LFP in threads.")
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+            self._worker_function = filter_and_decimate
+            self._worker_args = (self.recording,)
+
+    def _cancel_pending(self):
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def close(self):
+        """Shut down the worker pool."""
+        self._cancel_pending()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __iter__(self):
+        return self
+
+    def seek(self, start: int):
+        """Set the first LFP frame of the next chunk, e.g. to resume an interrupted write."""
+        self._cancel_pending()
+        self._next_start = start
+        self._start = start
+
+    def __next__(self):
+        if self._start >= self._num_frames:
+            self.close()
+            raise StopIteration
+        if self._executor is None:
+            self._start_executor()
+        max_pending = 2 * (self.num_workers or os.cpu_count() or 1)
+        while self._next_start < self._num_frames and len(self._pending) < max_pending:
+            end = min(self._next_start + self.chunk_frames, self._num_frames)
+            future = self._executor.submit(
+                self._worker_function,
+                *self._worker_args,
+                self.sos,
+                self.decimation,
+                self._next_start,
+                end,
+                self.margin_frames,
+            )
+            self._pending.append((self._next_start, end, future))
+            self._next_start = end
+        start, end, future = self._pending.popleft()
+        self._start = end
+        return DataChunk(data=future.result(), selection=np.s_[start:end, :])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return self._chunk_shape
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return np.dtype("float32")
+
+    @property
+    def maxshape(self):
+        return self._num_frames, self._num_channels
+
+
+def compute_lfp(recording: se.RecordingExtractor, **lfp_options):
+    """
+    Compute the full LFP of a recording in memory.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    lfp_options: dict
+        Options of LFPChunkIterator.
+
+    Returns
+    -------
+    lfp: np.ndarray
+        The LFP traces (in uV), with shape (num_lfp_frames, num_channels).
+    sampling_frequency: float
+        The sampling rate of the LFP.
+    """
+    iterator = LFPChunkIterator(recording, **lfp_options)
+    lfp = np.empty(iterator.maxshape, dtype=iterator.dtype)
+    for chunk in iterator:
+        lfp[chunk.selection] = chunk.data
+    return lfp, iterator.sampling_frequency
+
+
+def add_lfp_electrical_series(
+    recording: se.RecordingExtractor,
+    nwbfile: NWBFile,
+    name: str = "ElectricalSeries_lfp",
+    use_times: bool = False,
+    compression: Optional[str] = "gzip",
+    **lfp_options,
+):
+    """
+    Compute the LFP of a recording and add it to the ecephys processing module of the NWBFile.
+
+    The LFP is computed while the NWBFile is written, chunk by chunk on a process pool (see LFPChunkIterator), and
+    stored in uV as float32 with a conversion factor to Volts. The electrodes of the recording must already be in
+    the NWBFile.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The raw recording.
+    nwbfile: NWBFile
+    name: str (optional, defaults to "ElectricalSeries_lfp")
+        Name of the ElectricalSeries in the LFP container.
+    use_times: bool (optional, defaults to False)
+        If True, the times of the decimated frames (from recording.frame_to_time) are written as timestamps.
+        Otherwise, the sampling rate of the LFP is used.
+    compression: str (optional, defaults to "gzip")
+        Compression filter of the LFP ("gzip", "lzf" or None).
+    lfp_options: dict
+        Options of LFPChunkIterator (freq_min, freq_max, lfp_rate, order, chunk_frames, margin_frames, num_workers).
+    """
+    iterator = LFPChunkIterator(recording, **lfp_options)
+    table_ids = [
+        list(nwbfile.electrodes.id[:]).index(id) for id in recording.get_channel_ids()
+    ]
+    eseries_kwargs = dict(
+        name=name,
+        description=f"LFP filtered and decimated to {iterator.sampling_frequency} Hz",
+        electrodes=nwbfile.create_electrode_table_region(
+            region=table_ids, description="electrode_table_region"
+        ),
+        data=H5DataIO(iterator, compression=compression),
+        conversion=1e-6,
+    )
+    if use_times:
+        eseries_kwargs.update(
+            timestamps=H5DataIO(
+                FrameTimesChunkIterator(
+                    recording=recording,
+                    frame_step=iterator.decimation,
+                    num_times=iterator.maxshape[0],
+                ),
+                compression=compression,
+            )
+        )
+    else:
+        eseries_kwargs.update(
+            starting_time=recording.frame_to_time(0),
+            rate=float(iterator.sampling_frequency),
+        )
+    electrical_series = ElectricalSeries(**eseries_kwargs)
+
+    if "ecephys" not in nwbfile.processing:
+        nwbfile.create_processing_module(
+            name="ecephys",
+            description="Processed extracellular electrophysiology data.",
+        )
+    ecephys_module = nwbfile.processing["ecephys"]
+    if "LFP" in ecephys_module.data_interfaces:
+        ecephys_module.data_interfaces["LFP"].add_electrical_series(electrical_series)
+    else:
+        ecephys_module.add(LFP(electrical_series=electrical_series))
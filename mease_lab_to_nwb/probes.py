@@ -0,0 +1,206 @@
+"""Probe files and channel groups: electrode geometry at conversion and one ElectricalSeries per channel group."""
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile
+from spikeextractors.extraction_tools import check_get_traces_args
+
+from .tracecache import cache_recording
+from .utils import add_electrical_series
+
+PROBE_FILES_PATH = Path(__file__).parent / "probe_files"
+
+
+def get_probe_file_path(probe_file: str):
+    """
+    Resolve a probe file.
+
+    Parameters
+    ----------
+    probe_file: str or Path
+        Path to a .prb or .csv file, or the name of one of the probe files of the probe_files folder of the
+        package (e.g. "tetrode_32" or "cambridge_neurotech_H3").
+    """
+    probe_file_path = Path(probe_file)
+    if not probe_file_path.is_file() and probe_file_path.suffix == "":
+        probe_file_path = PROBE_FILES_PATH / f"{probe_file_path.name}.prb"
+    assert probe_file_path.is_file(), f"The probe file {probe_file} does not exist!"
+    return probe_file_path
+
+
+def apply_probe_file(recording: se.RecordingExtractor, probe_file: str):
+    """
+    Load a probe file onto a recording, as se.load_probe_file.
+
+    The channels are reordered as in the probe file, and the channels of the recording missing from it are
+    dropped with a message; the channel groups and locations of the probe are set on the returned
+    SubRecordingExtractor.
+    """
+    probe_file_path = get_probe_file_path(probe_file)
+    recording_probe = se.load_probe_file(recording, probe_file_path)
+    missing_channels = sorted(
+        set(recording.get_channel_ids()) - set(recording_probe.get_channel_ids())
+    )
+    if missing_channels:
+        print(
+            f"The channels {missing_channels} are not in the probe file {probe_file_path.name} and are not converted."
+        )
+    return recording_probe
+
+
+def get_channel_groups(recording: se.RecordingExtractor):
+    """Return the channel ids of each channel group of a recording, by group, in the order of the recording."""
+    channel_groups = dict()
+    for channel_id, group in zip(
+        recording.get_channel_ids(), recording.get_channel_groups()
+    ):
+        channel_groups.setdefault(int(group), []).append(channel_id)
+    return channel_groups
+
+
+def update_electrode_group_metadata(
+    metadata: dict, recording: se.RecordingExtractor, probe_file: str
+):
+    """
+    Describe one electrode group per channel group of a probe in metadata["Ecephys"]["ElectrodeGroup"].
+
+    The groups are named after the channel groups, as expected by NwbRecordingExtractor.add_electrodes, and keep the
+    device and location of the first electrode group of the metadata, if any. Electrode group names set per
+    electrode in metadata["Ecephys"]["Electrodes"] are dropped.
+    """
+    ecephys_metadata = metadata.setdefault("Ecephys", dict())
+    template = (ecephys_metadata.get("ElectrodeGroup") or [dict()])[0]
+    probe_name = Path(probe_file).stem
+    ecephys_metadata["ElectrodeGroup"] = [
+        dict(
+            template,
+            name=str(group),
+            description=f"Channel group {group} of the probe {probe_name}.",
+        )
+        for group in get_channel_groups(recording)
+    ]
+    if "Electrodes" in ecephys_metadata:
+        ecephys_metadata["Electrodes"] = [
+            column
+            for column in ecephys_metadata["Electrodes"]
+            if column.get("name") != "group_name"
+        ]
+    return metadata
+
+
+def get_group_series_name(group: int):
+    """Name of the ElectricalSeries of a channel group."""
+    return f"ElectricalSeries_raw_group{group}"
+
+
+class ChannelGroupRecordingExtractor(se.RecordingExtractor):
+    """
+    Recording extractor of the channels of a channel group of a recording.
+
+    Unlike a SubRecordingExtractor, whose times start at 0, it keeps the frame times of the recording.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    channel_ids: list
+        The channels of the group.
+    """
+
+    def __init__(self, recording: se.RecordingExtractor, channel_ids: list):
+        se.RecordingExtractor.__init__(self)
+        self._recording = recording
+        self._channel_ids = list(channel_ids)
+        self.copy_channel_properties(recording, channel_ids=self._channel_ids)
+        self.has_unscaled = recording.has_unscaled
+        self.is_filtered = recording.is_filtered
+
+    def get_channel_ids(self):
+        return list(self._channel_ids)
+
+    def get_num_frames(self):
+        return self._recording.get_num_frames()
+
+    def get_sampling_frequency(self):
+        return self._recording.get_sampling_frequency()
+
+    def frame_to_time(self, frames):
+        return self._recording.frame_to_time(frames)
+
+    def time_to_frame(self, times):
+        return self._recording.time_to_frame(times)
+
+    @check_get_traces_args
+    def get_traces(
+        self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+    ):
+        # Scaling, if any, is applied once by check_get_traces_args with the copied gains and offsets
+        return self._recording.get_traces(
+            channel_ids=channel_ids,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            return_scaled=not self.has_unscaled,
+        )
+
+
+def add_group_electrical_series(
+    recording: se.RecordingExtractor,
+    nwbfile: NWBFile,
+    groups: Optional[list] = None,
+    use_times: bool = False,
+    num_workers: int = 2,
+    cache_folder: Optional[str] = None,
+    **write_options,
+):
+    """
+    Add the raw traces of each channel group of a recording to the NWBFile as its own ElectricalSeries.
+
+    Each group is written as a separate dataset (see get_group_series_name), so that reading one group, e.g. to
+    sort one tetrode, only reads the data of its channels. The series are written one after the other, and the
+    blocks of each group are read ahead in a thread pool while the previous ones are compressed and written. The
+    electrodes must already be in the NWBFile.
+
+    Each group is read from the recording, i.e. the recording is read once per group. With a cache_folder, the
+    recording is instead read once into the TraceCache of that folder, which takes as much disk space as the raw
+    traces (see tracecache.TraceCache), and the channels of each group are read from there; a recording that is
+    already cached, e.g. through the cache_folder source option of the recording interfaces, is read from its
+    cache.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    nwbfile: NWBFile
+    groups: list (optional)
+        The channel groups to write. Defaults to all groups.
+    use_times: bool (optional, defaults to False)
+        If True, the times of recording.frame_to_time are written as timestamps of each series.
+    num_workers: int (optional, defaults to 2)
+        Number of threads reading the blocks of a group; as many blocks are held in memory ahead of the write.
+    cache_folder: str (optional)
+        Folder of a TraceCache the recording is read into before the groups are written.
+    write_options: dict
+        Layout options of add_electrical_series (chunk_frames, chunk_channels, compression, compression_opts,
+        shuffle, buffer_frames, buffer_mb).
+    """
+    channel_groups = get_channel_groups(recording)
+    if groups is None:
+        groups = list(channel_groups)
+    missing_groups = [group for group in groups if group not in channel_groups]
+    assert (
+        len(missing_groups) == 0
+    ), f"The channel groups {missing_groups} are not in the recording! Options: {list(channel_groups)}"
+    if cache_folder is not None:
+        recording = cache_recording(recording, cache_folder)
+    for group in groups:
+        add_electrical_series(
+            recording=ChannelGroupRecordingExtractor(
+                recording=recording, channel_ids=channel_groups[group]
+            ),
+            nwbfile=nwbfile,
+            use_times=use_times,
+            name=get_group_series_name(group),
+            description=f"Raw acquired data of channel group {group}",
+            num_workers=num_workers,
+            **write_options,
+        )
@@ -0,0 +1,234 @@
+"""Resumable writing of NWBFiles whose large datasets are streamed through seekable chunk iterators."""
+import hashlib
+import json
+import os
+from inspect import signature
+from pathlib import Path
+from typing import Optional
+
+import h5py
+from hdmf.data_utils import DataIO
+from pynwb import NWBFile, NWBHDF5IO
+
+from .tracecache import fingerprint_paths
+
+JOURNAL_SUFFIX = ".journal.json"
+# Source options that do not change the content of the NWBFile, left out of the conversion fingerprint
+CACHE_SOURCE_OPTIONS = ["cache_folder", "cache_gb"]
+
+
+def get_journal_path(nwbfile_path: str):
+    """Path of the journal of a resumable write, next to the NWBFile."""
+    return Path(f"{nwbfile_path}{JOURNAL_SUFFIX}")
+
+
+def get_conversion_fingerprint(source_data: dict, options: Optional[dict] = None):
+    """
+    Hash identifying the inputs of a conversion: its source files and source data, and its options.
+
+    The paths in source_data are replaced by the fingerprint of the files they point to (see
+    tracecache.fingerprint_paths), so that a source file that changed since an interrupted write is detected. The
+    trace cache options (CACHE_SOURCE_OPTIONS) are left out, since the cache folder changes as it is used.
+
+    Parameters
+    ----------
+    source_data: dict
+        The source data of each interface, by name.
+    options: dict (optional)
+        The metadata, conversion options and any other option the content of the NWBFile depends on.
+    """
+    source_data = {
+        name: {
+            key: value
+            for key, value in interface_source_data.items()
+            if key not in CACHE_SOURCE_OPTIONS
+        }
+        for name, interface_source_data in source_data.items()
+    }
+    content = dict(source_data=fingerprint_paths(source_data), options=options)
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def load_journal(nwbfile_path: str, fingerprint: Optional[str] = None):
+    """
+    Load the journal of an interrupted resumable write to nwbfile_path.
+
+    Returns
+    -------
+    journal: dict or None
+        The journal, or None if there is no partial NWBFile with a journal, or if the journal was written for a
+        conversion with another fingerprint (see get_conversion_fingerprint).
+    """
+    journal_path = get_journal_path(nwbfile_path)
+    if not journal_path.is_file() or not Path(nwbfile_path).is_file():
+        return None
+    with open(journal_path, "r") as f:
+        journal = json.load(f)
+    if journal.get("fingerprint") != fingerprint:
+        return None
+    return journal
+
+
+def get_resume_conversion_options(
+    data_interface_objects: dict, conversion_options: Optional[dict] = None
+):
+    """
+    Conversion options of the interfaces to resume an interrupted resumable write.
+
+    resume=True is added to the options of the interfaces whose run_conversion accepts it. These then skip the
+    work whose results are already in the partial NWBFile (e.g. CEDStimulusInterface, which does not detect the
+    TTL intervals again and reads its series from the first frame not yet written, without decoding the whole
+    channels).
+    """
+    conversion_options = {
+        name: dict(options) for name, options in (conversion_options or dict()).items()
+    }
+    for name, interface in data_interface_objects.items():
+        if "resume" in signature(interface.run_conversion).parameters:
+            conversion_options.setdefault(name, dict()).update(resume=True)
+    return conversion_options
+
+
+def find_resumable_datasets(nwbfile: NWBFile):
+    """
+    Find the datasets of an NWBFile that can be written in resumable mode.
+
+    These are the data and timestamps fields wrapped in a DataIO around a chunk iterator with a seek method, like
+    those of mease_lab_to_nwb.utils.
+
+    Returns
+    -------
+    datasets: dict
+        The chunk iterator of each dataset, by key "<container names from the root>/<field>".
+    """
+    datasets = dict()
+    for container in nwbfile.objects.values():
+        for field in ["data", "timestamps"]:
+            value = getattr(container, field, None)
+            if isinstance(value, DataIO) and hasattr(value.data, "seek"):
+                names = [field]
+                parent = container
+                while parent is not None:
+                    names.append(parent.name)
+                    parent = parent.parent
+                datasets["/".join(reversed(names))] = (container, field, value.data)
+    return datasets
+
+
+def check_resumable_write(nwbfile_path: str, overwrite: bool = False):
+    """
+    Check that a resumable write to nwbfile_path is possible.
+
+    Resumable writes always create a new file, so an existing NWBFile is only replaced if overwrite is True or if
+    it is the partial output of an interrupted resumable write (i.e. it has a journal).
+    """
+    if (
+        Path(nwbfile_path).is_file()
+        and not get_journal_path(nwbfile_path).is_file()
+        and not overwrite
+    ):
+        raise ValueError(
+            f"The NWBFile {nwbfile_path} already exists! Appending is not supported in resumable mode; "
+            "use overwrite=True to replace it."
+        )
+
+
+def _save_journal(journal_path: Path, journal: dict):
+    tmp_path = journal_path.with_name(f"{journal_path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
+
+
+def _get_end_frame(selection):
+    if isinstance(selection, tuple):
+        selection = selection[0]
+    return selection.stop
+
+
+def write_nwbfile_resumable(
+    nwbfile: NWBFile,
+    nwbfile_path: str,
+    fingerprint: Optional[str] = None,
+    resume: bool = False,
+):
+    """
+    Write an NWBFile so that an interrupted write can be resumed.
+
+    The file is written in two steps. First, everything except the resumable datasets (see find_resumable_datasets)
+    is written, and those datasets are only allocated. Then they are filled chunk by chunk; after each chunk the
+    file is flushed and the number of frames written so far is committed to a journal (<nwbfile_path>.journal.json),
+    together with the fingerprint of the conversion.
+
+    If a journal with the same fingerprint and the same datasets exists, the first step is skipped and each dataset
+    is filled from its last committed frame, so that the earlier frames of the datasets are neither read nor
+    written again. The journal is removed once all datasets are complete.
+
+    Parameters
+    ----------
+    nwbfile: NWBFile
+        The NWBFile to write, built in the same way as for the interrupted write when resuming.
+    nwbfile_path: str
+    fingerprint: str (optional)
+        Identifies the source files and options of the conversion (see get_conversion_fingerprint), so that a
+        write is only resumed with the same inputs.
+    resume: bool (optional, defaults to False)
+        If True, the NWBFile was built to resume the write (see get_resume_conversion_options) and may lack the
+        objects already written, so that the write cannot start from scratch; a missing or mismatched journal is
+        then an error.
+    """
+    journal_path = get_journal_path(nwbfile_path)
+    datasets = find_resumable_datasets(nwbfile)
+
+    journal = load_journal(nwbfile_path, fingerprint=fingerprint)
+    if journal is not None and set(journal["datasets"]) != set(datasets):
+        journal = None
+    if journal is None and journal_path.is_file():
+        print(
+            f"The journal at {journal_path} does not match the source files, options or datasets of the "
+            "NWBFile; starting the write from scratch."
+        )
+    if journal is None and resume:
+        raise ValueError(
+            f"The write of {nwbfile_path} cannot be resumed from {journal_path}! Remove the journal and the "
+            "NWBFile to convert the session from scratch."
+        )
+
+    if journal is None:
+        # Exhausted iterators make hdmf allocate the datasets without writing any chunk
+        for container, field, iterator in datasets.values():
+            iterator.seek(iterator.maxshape[0])
+        with NWBHDF5IO(str(nwbfile_path), mode="w") as io:
+            io.write(nwbfile)
+            journal = dict(
+                fingerprint=fingerprint,
+                datasets={
+                    key: dict(
+                        path="/".join(
+                            io.manager.get_builder(container).path.split("/")[1:]
+                            + [field]
+                        ),
+                        frames_written=0,
+                    )
+                    for key, (container, field, iterator) in datasets.items()
+                },
+            )
+        _save_journal(journal_path, journal)
+    else:
+        print(f"Resuming the write of {nwbfile_path} from {journal_path}.")
+
+    with h5py.File(nwbfile_path, mode="r+") as file:
+        for key, (container, field, iterator) in datasets.items():
+            entry = journal["datasets"][key]
+            dataset = file[entry["path"]]
+            iterator.seek(entry["frames_written"])
+            for chunk in iterator:
+                dataset[chunk.selection] = chunk.data
+                file.flush()
+                entry["frames_written"] = _get_end_frame(chunk.selection)
+                _save_journal(journal_path, journal)
+    journal_path.unlink()
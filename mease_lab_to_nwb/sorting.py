@@ -0,0 +1,442 @@
+"""Spike sorting stage: preprocessing, sorting of channel groups or time shards in a process pool, and NWB units."""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import spikeextractors as se
+import spikesorters as ss
+import spiketoolkit as st
+
+from .lfp import get_margin_frames
+from .probes import get_channel_groups
+from .tracecache import TraceCache
+from .utils import copy_frame_times
+
+
+def make_shards(
+    recording: se.RecordingExtractor,
+    by_group: bool = True,
+    shard_duration: Optional[float] = None,
+):
+    """
+    Split a recording into shards that are sorted independently.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    by_group: bool (optional, defaults to True)
+        If True, each channel group (e.g. each tetrode of a probe file) is a separate shard. Otherwise, all channels
+        are sorted together.
+    shard_duration: float (optional)
+        If given, the recording is also split in time into shards of this duration, in seconds. The units of
+        different time shards are not matched.
+
+    Returns
+    -------
+    shards: list
+        One dict per shard with its name, channel group (None if by_group is False), channel_ids, start_frame and
+        end_frame.
+    """
+    if by_group:
+        channel_groups = get_channel_groups(recording)
+    else:
+        channel_groups = {None: recording.get_channel_ids()}
+    num_frames = recording.get_num_frames()
+    if shard_duration is None:
+        shard_frames = num_frames
+    else:
+        shard_frames = int(shard_duration * recording.get_sampling_frequency())
+    assert shard_frames > 0, "shard_duration must be positive!"
+
+    shards = []
+    for group, channel_ids in channel_groups.items():
+        for start_frame in range(0, num_frames, shard_frames):
+            end_frame = min(start_frame + shard_frames, num_frames)
+            name = "all" if group is None else f"group{group}"
+            if shard_frames < num_frames:
+                name = f"{name}_frames{start_frame}-{end_frame}"
+            shards.append(
+                dict(
+                    name=name,
+                    group=group,
+                    channel_ids=list(channel_ids),
+                    start_frame=start_frame,
+                    end_frame=end_frame,
+                )
+            )
+    return shards
+
+
+def get_shard_recording(recording: se.RecordingExtractor, shard: dict):
+    """The channels and frames of a shard of the recording."""
+    return se.SubRecordingExtractor(
+        recording,
+        channel_ids=shard["channel_ids"],
+        start_frame=shard["start_frame"],
+        end_frame=shard["end_frame"],
+    )
+
+
+def preprocess_recording(
+    recording: se.RecordingExtractor,
+    freq_min: float = 300.0,
+    freq_max: float = 6000.0,
+    reference: Optional[str] = "median",
+):
+    """
+    Preprocessing chain of the spike sorting: band-pass filter, then common reference.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    freq_min: float (optional, defaults to 300.)
+        Low cutoff of the band-pass filter, in Hz.
+    freq_max: float (optional, defaults to 6000.)
+        High cutoff of the band-pass filter, in Hz.
+    reference: str (optional, defaults to "median")
+        Common reference of st.preprocessing.common_reference ("median" for CMR, or "average"). If None, the
+        filtered recording is not re-referenced.
+    """
+    recording = st.preprocessing.bandpass_filter(
+        recording, freq_min=freq_min, freq_max=freq_max
+    )
+    if reference is not None:
+        recording = st.preprocessing.common_reference(recording, reference=reference)
+    return recording
+
+
+def preprocess_shard(
+    recording: se.RecordingExtractor,
+    shard: dict,
+    freq_min: float = 300.0,
+    freq_max: float = 6000.0,
+    reference: Optional[str] = "median",
+    reference_by_group: bool = False,
+):
+    """
+    Preprocess a shard of a recording with preprocess_recording.
+
+    All the channels of the recording are preprocessed and the channels of the shard are selected afterwards, so
+    that the common reference is taken over the whole probe as in the notebooks, rather than over the few channels
+    of a group (e.g. a tetrode), where it would remove a large part of the spikes. The frames of the shard are
+    preprocessed together with a margin of frames of the recording on either side (see lfp.get_margin_frames),
+    which is cropped afterwards, so that the transients of the filter at the edges of time shards fall outside of
+    them instead of producing false spikes.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The raw recording (not the shard).
+    shard: dict
+        As returned by make_shards.
+    freq_min, freq_max, reference: optional
+        Options of preprocess_recording.
+    reference_by_group: bool (optional, defaults to False)
+        If True, only the channels of the shard are preprocessed, and the common reference is taken over them.
+    """
+    margin_frames = get_margin_frames(
+        recording.get_sampling_frequency(), freq_min=freq_min, freq_max=freq_max
+    )
+    start_frame = max(shard["start_frame"] - margin_frames, 0)
+    end_frame = min(shard["end_frame"] + margin_frames, recording.get_num_frames())
+    padded_recording = preprocess_recording(
+        se.SubRecordingExtractor(
+            recording,
+            channel_ids=shard["channel_ids"] if reference_by_group else None,
+            start_frame=start_frame,
+            end_frame=end_frame,
+        ),
+        freq_min=freq_min,
+        freq_max=freq_max,
+        reference=reference,
+    )
+    return se.SubRecordingExtractor(
+        padded_recording,
+        channel_ids=shard["channel_ids"],
+        start_frame=shard["start_frame"] - start_frame,
+        end_frame=shard["end_frame"] - start_frame,
+    )
+
+
+def cache_preprocessed_shard(
+    recording: se.RecordingExtractor,
+    shard: dict,
+    cache: TraceCache,
+    freq_min: float = 300.0,
+    freq_max: float = 6000.0,
+    reference: Optional[str] = "median",
+    reference_by_group: bool = False,
+):
+    """
+    Return the preprocessed traces of a shard from the trace cache, after computing them if needed.
+
+    The shard of the recording (e.g. of its cached raw traces) is preprocessed with preprocess_shard and cached
+    as float32, keyed on the shard and the preprocessing parameters (see tracecache.TraceCache).
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The raw recording (not the shard).
+    shard: dict
+        As returned by make_shards.
+    cache: TraceCache
+    freq_min, freq_max, reference, reference_by_group: optional
+        Options of preprocess_shard.
+
+    Returns
+    -------
+    recording: CachedRecordingExtractor
+    """
+    preprocessing = dict(
+        freq_min=freq_min,
+        freq_max=freq_max,
+        reference=reference,
+        reference_by_group=reference_by_group,
+    )
+    margin_frames = get_margin_frames(
+        recording.get_sampling_frequency(), freq_min=freq_min, freq_max=freq_max
+    )
+    return cache.cache_recording(
+        get_shard_recording(recording, shard),
+        params=dict(stage="preprocessed", margin_frames=margin_frames, **preprocessing),
+        preprocess=lambda shard_recording: preprocess_shard(
+            recording, shard, **preprocessing
+        ),
+        store_times=False,
+    )
+
+
+def sort_shard(
+    recording_dict: dict,
+    shard: dict,
+    sorter_names: list,
+    working_folder: str,
+    sorter_params: Optional[dict] = None,
+    preprocessing: Optional[dict] = None,
+    cache_folder: Optional[str] = None,
+):
+    """
+    Preprocess a shard (or reuse its cached traces) and run each sorter on it.
+
+    Run in the worker processes of sort_recording. The preprocessed traces are cached in the TraceCache of
+    cache_folder (defaults to <working_folder>/cache), and each sorting is saved to
+    <working_folder>/sorters/<sorter>/<shard name>/sorting.npz. No entry is evicted here, as the other workers may
+    be using them; sort_recording evicts entries once all shards are sorted.
+
+    Returns
+    -------
+    sorting_paths: dict
+        The path to the saved sorting of the shard, by sorter name.
+    """
+    recording = se.load_extractor_from_dict(recording_dict)
+    working_folder = Path(working_folder)
+    sorter_params = sorter_params or dict()
+    cache = TraceCache(cache_folder or working_folder / "cache")
+    shard_recording = cache_preprocessed_shard(
+        recording, shard, cache, **(preprocessing or dict())
+    )
+    sorting_paths = dict()
+    for sorter_name in sorter_names:
+        output_folder = working_folder / "sorters" / sorter_name / shard["name"]
+        sorting = ss.run_sorter(
+            sorter_name,
+            shard_recording,
+            output_folder=output_folder,
+            **sorter_params.get(sorter_name, dict()),
+        )
+        sorting_path = output_folder / "sorting.npz"
+        se.NpzSortingExtractor.write_sorting(sorting, sorting_path)
+        sorting_paths[sorter_name] = str(sorting_path)
+    return sorting_paths
+
+
+def merge_shard_sortings(
+    sortings: list, shards: list, recording: se.RecordingExtractor
+):
+    """
+    Merge the sortings of the shards of a recording into a single sorting.
+
+    The spike frames are shifted to frames of the recording, and the units without spikes are dropped. The units are
+    renumbered from 0 and keep the channel group and the name of their shard as the unit properties "group" and
+    "shard", and the sorting uses the frame times of the recording.
+    """
+    times = []
+    labels = []
+    unit_properties = []
+    for sorting, shard in zip(sortings, shards):
+        for unit_id in sorting.get_unit_ids():
+            spike_train = sorting.get_unit_spike_train(unit_id)
+            if len(spike_train) == 0:
+                continue
+            times.append(spike_train + shard["start_frame"])
+            labels.append(np.full(len(spike_train), len(unit_properties)))
+            unit_properties.append(
+                dict(
+                    group=-1 if shard["group"] is None else shard["group"],
+                    shard=shard["name"],
+                )
+            )
+
+    merged_sorting = se.NumpySortingExtractor()
+    merged_sorting.set_sampling_frequency(recording.get_sampling_frequency())
+    if times:
+        times = np.concatenate(times)
+        order = np.argsort(times, kind="stable")
+        merged_sorting.set_times_labels(times[order], np.concatenate(labels)[order])
+    for unit_id, properties in enumerate(unit_properties):
+        for name, value in properties.items():
+            merged_sorting.set_unit_property(unit_id, name, value)
+    copy_frame_times(merged_sorting, recording)
+    return merged_sorting
+
+
+def sort_recording(
+    recording: se.RecordingExtractor,
+    sorter_names: list,
+    working_folder: str,
+    sorter_params: Optional[dict] = None,
+    by_group: bool = True,
+    shard_duration: Optional[float] = None,
+    freq_min: float = 300.0,
+    freq_max: float = 6000.0,
+    reference: Optional[str] = "median",
+    reference_by_group: bool = False,
+    num_workers: Optional[int] = None,
+    cache_folder: Optional[str] = None,
+    cache_gb: Optional[float] = None,
+):
+    """
+    Preprocess and spike sort a recording, one shard per process.
+
+    The raw traces of the recording are read once into a TraceCache (see tracecache), unless they are already
+    cached, e.g. by the conversion. The recording is split into shards (see make_shards), which are preprocessed
+    (see preprocess_shard) from the cached raw traces and sorted by each sorter in a process pool. The
+    preprocessed traces of each shard are cached too (see cache_preprocessed_shard), so that running other sorters
+    later with the same cache reuses them instead of reading and filtering the raw recording again.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The raw recording, with its channel groups (e.g. from a probe file). It must be dumpable, to be rebuilt in the
+        worker processes.
+    sorter_names: list
+        Names of the sorters of spikesorters (e.g. ["herdingspikes", "klusta"]).
+    working_folder: str
+        Folder of the sorter outputs, and of the trace cache by default.
+    sorter_params: dict (optional)
+        Parameters of each sorter, by sorter name.
+    by_group: bool (optional, defaults to True)
+        If True, each channel group is sorted separately.
+    shard_duration: float (optional)
+        If given, the recording is also sorted in time shards of this duration, in seconds.
+    freq_min, freq_max, reference, reference_by_group: optional
+        Options of preprocess_shard. By default, the common reference is taken over all the channels, even when
+        each channel group is sorted separately.
+    num_workers: int (optional)
+        Number of worker processes. The default is the number of CPUs.
+    cache_folder: str (optional)
+        Folder of the TraceCache. Defaults to <working_folder>/cache.
+    cache_gb: float (optional)
+        Size budget of the TraceCache in GB. The default is no limit. The entries in use by the workers are never
+        evicted, so the budget is only enforced before and after the shards are sorted.
+
+    Returns
+    -------
+    sortings: dict
+        The sorting of the recording by each sorter (see merge_shard_sortings), by sorter name.
+    """
+    if isinstance(sorter_names, str):
+        sorter_names = [sorter_names]
+    shards = make_shards(recording, by_group=by_group, shard_duration=shard_duration)
+    preprocessing = dict(
+        freq_min=freq_min,
+        freq_max=freq_max,
+        reference=reference,
+        reference_by_group=reference_by_group,
+    )
+    if cache_folder is None:
+        cache_folder = Path(working_folder) / "cache"
+    cache = TraceCache(cache_folder, max_gb=cache_gb)
+    raw_recording = cache.cache_recording(recording)
+    recording_dict = raw_recording.make_serialized_dict()
+    print(
+        f"Sorting {len(shards)} shards with {', '.join(sorter_names)} in {working_folder}."
+    )
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                sort_shard,
+                recording_dict,
+                shard,
+                sorter_names,
+                str(working_folder),
+                sorter_params,
+                preprocessing,
+                str(cache_folder),
+            )
+            for shard in shards
+        ]
+        shard_sorting_paths = [future.result() for future in futures]
+    cache.evict()
+
+    return {
+        sorter_name: merge_shard_sortings(
+            [
+                se.NpzSortingExtractor(sorting_paths[sorter_name])
+                for sorting_paths in shard_sorting_paths
+            ],
+            shards,
+            recording,
+        )
+        for sorter_name in sorter_names
+    }
+
+
+def sort_and_quick_write(
+    quick_write: Callable,
+    recording: se.RecordingExtractor,
+    sorter_names: list,
+    working_folder: str,
+    write_sorter: Optional[str] = None,
+    sorting_options: Optional[dict] = None,
+    **quick_write_kwargs,
+):
+    """
+    Sort a recording with sort_recording and write the units of one sorter with a quick_write function.
+
+    Parameters
+    ----------
+    quick_write: function
+        The quick_write function of convert_ced.cednwbconverter or convert_syntalos.syntalosnwbconverter.
+    recording: RecordingExtractor
+    sorter_names: list
+    working_folder: str
+    write_sorter: str (optional)
+        The sorter whose units are written. Defaults to the first of sorter_names.
+    sorting_options: dict (optional)
+        Other options of sort_recording.
+    quick_write_kwargs: dict
+        Arguments of quick_write, other than the sorting.
+
+    Returns
+    -------
+    sortings: dict
+        The sorting of the recording by each sorter, by sorter name.
+    """
+    if isinstance(sorter_names, str):
+        sorter_names = [sorter_names]
+    if write_sorter is None:
+        write_sorter = sorter_names[0]
+    assert (
+        write_sorter in sorter_names
+    ), f"write_sorter must be one of the sorters! Options: {sorter_names}"
+    sortings = sort_recording(
+        recording=recording,
+        sorter_names=sorter_names,
+        working_folder=working_folder,
+        **(sorting_options or dict()),
+    )
+    quick_write(sorting=sortings[write_sorter], **quick_write_kwargs)
+    return sortings
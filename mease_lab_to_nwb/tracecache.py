@@ -0,0 +1,449 @@
+"""Content-addressed cache of raw and preprocessed traces as memory-mapped binaries, with LRU eviction."""
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import spikeextractors as se
+from spikeextractors.extraction_tools import check_get_traces_args
+
+from .convert_syntalos.syntalosfolderindex import to_json_compatible
+
+TRACES_FILE_NAME = "traces.dat"
+TIMES_FILE_NAME = "times.dat"
+HEADER_FILE_NAME = "header.json"
+FINGERPRINT_BYTES = 1 << 20
+
+
+def file_fingerprint(file_path):
+    """
+    Size, modification time and SHA-1 of the first and last MB of a file, identifying its content.
+
+    Only the ends of the file are hashed, so that large recordings are not read in full to look up their entries;
+    the modification time catches the files that are rewritten in place, e.g. re-exported with the same size.
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    size = stat.st_size
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        sha1.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            sha1.update(f.read(FINGERPRINT_BYTES))
+    return dict(size=size, mtime_ns=stat.st_mtime_ns, sha1=sha1.hexdigest())
+
+
+def path_fingerprint(path):
+    """Fingerprint of a file, or of all the (non-hidden) files below a folder."""
+    path = Path(path)
+    if path.is_file():
+        return file_fingerprint(path)
+    return [
+        dict(file_fingerprint(file_path), name=str(file_path.relative_to(path)))
+        for file_path in sorted(path.rglob("*"))
+        if file_path.is_file()
+        and not any(part.startswith(".") for part in file_path.relative_to(path).parts)
+    ]
+
+
+def fingerprint_paths(value):
+    """
+    Replace the paths of existing files or folders in value, and in the dicts and lists it holds, by their
+    fingerprint (see path_fingerprint), and the serialized extractors by theirs (see get_source_fingerprint).
+    """
+    if isinstance(value, dict):
+        if "class" in value and "kwargs" in value:
+            return get_source_fingerprint(value)
+        return {key: fingerprint_paths(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [fingerprint_paths(item) for item in value]
+    if isinstance(value, (str, Path)) and len(str(value)) > 0:
+        try:
+            if Path(value).exists():
+                return path_fingerprint(value)
+        except OSError:
+            pass
+    return value
+
+
+def get_source_fingerprint(extractor_dict: dict):
+    """
+    Class and arguments of a serialized extractor and of the extractors it wraps, with the files they read.
+
+    Every argument that is the path of an existing file or folder is replaced by its fingerprint, so that the
+    description identifies the content of the source files rather than their location; cached recordings are
+    identified by their key. The properties, which are in part only set when the traces are first read (e.g. the
+    default gains), are left out.
+    """
+    if extractor_dict["class"].endswith(CachedRecordingExtractor.__name__):
+        return dict(cache_key=Path(extractor_dict["kwargs"]["folder_path"]).name)
+    return dict(
+        extractor=extractor_dict["class"],
+        kwargs={
+            key: fingerprint_paths(value)
+            for key, value in extractor_dict["kwargs"].items()
+        },
+    )
+
+
+def has_consistent_scaling(recording: se.RecordingExtractor, num_frames: int = 1000):
+    """
+    Whether the unscaled traces of a recording, scaled with its channel gains and offsets, match its scaled traces.
+
+    This is not the case for extractors that scale the traces of the recordings they wrap themselves (e.g. the
+    MultiRecordingTimeExtractor of SyntalosRecordingExtractor, which clears its own gains); only the first frames
+    are compared.
+    """
+    if not recording.has_unscaled:
+        return False
+    end_frame = min(num_frames, recording.get_num_frames())
+    unscaled = recording.get_traces(end_frame=end_frame, return_scaled=False)
+    scaled = recording.get_traces(end_frame=end_frame, return_scaled=True)
+    gains = recording.get_channel_gains()[:, None]
+    offsets = recording.get_channel_offsets()[:, None]
+    return np.allclose(unscaled * gains + offsets, scaled, rtol=1e-5, atol=1e-3)
+
+
+def get_channel_locations(recording: se.RecordingExtractor):
+    """The channel locations of a recording, or None if they are not set."""
+    if "location" in recording.get_shared_channel_property_names():
+        return recording.get_channel_locations()
+    return None
+
+
+class CachedRecordingExtractor(se.RecordingExtractor):
+    """
+    Recording extractor over an entry of a TraceCache.
+
+    The traces (channels x frames) and, if cached, the frame times are memory-mapped, so that only the frames that
+    are read are loaded. The extractor is dumpable, and can be rebuilt in worker processes from its folder.
+
+    Parameters
+    ----------
+    folder_path: str or Path
+        The folder of the cache entry.
+    """
+
+    extractor_name = "CachedRecording"
+    has_default_locations = False
+    installed = True
+    is_writable = False
+    mode = "folder"
+    installation_mesg = ""
+
+    def __init__(self, folder_path: str):
+        super().__init__()
+        folder_path = Path(folder_path)
+        with open(folder_path / HEADER_FILE_NAME, "r") as f:
+            self.header = json.load(f)
+        self._channel_ids = self.header["channel_ids"]
+        self._sampling_frequency = self.header["sampling_frequency"]
+        self._traces = np.memmap(
+            folder_path / TRACES_FILE_NAME,
+            dtype=self.header["dtype"],
+            mode="r",
+            shape=(len(self._channel_ids), self.header["num_frames"]),
+        )
+        if self.header["has_times"]:
+            # Bypasses set_times, which would load the times in memory
+            self._times = np.memmap(
+                folder_path / TIMES_FILE_NAME,
+                dtype="float64",
+                mode="r",
+                shape=(self.header["num_frames"],),
+            )
+        self.set_channel_gains(self.header["channel_gains"])
+        self.set_channel_offsets(self.header["channel_offsets"])
+        self.has_unscaled = self.header["has_unscaled"]
+        self.is_filtered = self.header["is_filtered"]
+        self.set_channel_groups(self.header["channel_groups"])
+        if self.header["channel_locations"] is not None:
+            self.set_channel_locations(self.header["channel_locations"])
+        self._kwargs = {"folder_path": str(folder_path.absolute())}
+
+    def get_channel_ids(self):
+        return list(self._channel_ids)
+
+    def get_num_frames(self):
+        return self._traces.shape[1]
+
+    def get_sampling_frequency(self):
+        return self._sampling_frequency
+
+    @check_get_traces_args
+    def get_traces(
+        self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+    ):
+        # The decorator applies the gains and offsets of unscaled traces
+        if channel_ids == self._channel_ids:
+            return np.array(self._traces[:, start_frame:end_frame])
+        channel_indices = [self._channel_ids.index(ch) for ch in channel_ids]
+        return self._traces[channel_indices, start_frame:end_frame]
+
+
+class TraceCache:
+    """
+    Content-addressed cache of the traces of recordings, shared by the conversion, LFP and sorting stages.
+
+    Each entry is a folder <folder_path>/<key> holding the traces as a memory-mapped binary (channels x frames),
+    optionally the frame times, and a JSON header with the channels, their scaling, groups and locations. The key
+    is a hash of the fingerprint of the source files of the recording (see get_source_fingerprint), of its
+    channels, frames and scaling, and of the parameters of the stage that produced the traces (e.g. the
+    preprocessing), so that a recording is decoded once and each preprocessing is computed once, whoever asks
+    for it.
+
+    Entries are written to a temporary folder and renamed when complete. When the total size of the cache exceeds
+    max_gb, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    folder_path: str or Path
+    max_gb: float (optional)
+        Size budget of the cache in GB. The default is no limit.
+    """
+
+    def __init__(self, folder_path: str, max_gb: Optional[float] = None):
+        self.folder_path = Path(folder_path)
+        self.folder_path.mkdir(parents=True, exist_ok=True)
+        self.max_gb = max_gb
+
+    def get_key(self, recording: se.RecordingExtractor, params: Optional[dict] = None):
+        """
+        Hash of the source of a recording, its channels (with their groups and locations), frames and scaling, and
+        the params of the stage.
+        """
+        assert recording.check_if_dumpable(), (
+            "The recording must be dumpable to be cached "
+            "(e.g. write it first with se.CacheRecordingExtractor)!"
+        )
+        content = to_json_compatible(
+            dict(
+                source=get_source_fingerprint(recording.make_serialized_dict()),
+                channel_ids=recording.get_channel_ids(),
+                num_frames=recording.get_num_frames(),
+                gains=recording.get_channel_gains(),
+                offsets=recording.get_channel_offsets(),
+                groups=recording.get_channel_groups(),
+                locations=get_channel_locations(recording),
+                params=params or dict(),
+            )
+        )
+        return hashlib.sha1(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, key: str):
+        """The cached recording of a key, or None if it is not cached. Marks the entry as recently used."""
+        header_path = self.folder_path / key / HEADER_FILE_NAME
+        try:
+            # The precise clock, as file times may lag behind it by a clock tick
+            now = time.time()
+            os.utime(header_path, (now, now))
+        except FileNotFoundError:
+            return None
+        return CachedRecordingExtractor(self.folder_path / key)
+
+    def add(
+        self,
+        recording: se.RecordingExtractor,
+        key: str,
+        params: Optional[dict] = None,
+        store_times: bool = True,
+        chunk_mb: float = 100.0,
+    ):
+        """
+        Write the traces of a recording to the cache entry of key.
+
+        Unscaled traces (e.g. int16 samples) are stored as they are with the channel gains and offsets, if these
+        scale them (see has_consistent_scaling); otherwise the scaled traces are stored as float32.
+
+        Parameters
+        ----------
+        recording: RecordingExtractor
+        key: str
+        params: dict (optional)
+            Parameters of the stage, saved in the header.
+        store_times: bool (optional, defaults to True)
+            If True, the times of recording.frame_to_time are cached as float64 next to the traces.
+        chunk_mb: float (optional, defaults to 100.)
+            Size in MB of the blocks of traces read at a time.
+
+        Returns
+        -------
+        recording: CachedRecordingExtractor
+        """
+        return_scaled = not has_consistent_scaling(recording)
+        dtype = np.dtype(
+            "float32" if return_scaled else recording.get_dtype(return_scaled=False)
+        )
+        num_frames = recording.get_num_frames()
+        num_channels = recording.get_num_channels()
+        folder_path = self.folder_path / key
+        tmp_folder_path = self.folder_path / f".{key}.{os.getpid()}.tmp"
+        tmp_folder_path.mkdir(parents=True, exist_ok=True)
+
+        traces = np.memmap(
+            tmp_folder_path / TRACES_FILE_NAME,
+            dtype=dtype,
+            mode="w+",
+            shape=(num_channels, num_frames),
+        )
+        if store_times:
+            times = np.memmap(
+                tmp_folder_path / TIMES_FILE_NAME,
+                dtype="float64",
+                mode="w+",
+                shape=(num_frames,),
+            )
+        block_frames = max(int(chunk_mb * 1e6 / (dtype.itemsize * num_channels)), 1)
+        for start in range(0, num_frames, block_frames):
+            end = min(start + block_frames, num_frames)
+            traces[:, start:end] = recording.get_traces(
+                start_frame=start, end_frame=end, return_scaled=return_scaled
+            )
+            if store_times:
+                times[start:end] = recording.frame_to_time(np.arange(start, end))
+        traces.flush()
+        del traces
+        if store_times:
+            times.flush()
+            del times
+
+        header = dict(
+            key=key,
+            params=params or dict(),
+            sampling_frequency=recording.get_sampling_frequency(),
+            num_frames=num_frames,
+            dtype=dtype.name,
+            has_unscaled=not return_scaled,
+            has_times=store_times,
+            is_filtered=bool(getattr(recording, "is_filtered", False)),
+            channel_ids=recording.get_channel_ids(),
+            channel_gains=(
+                recording.get_channel_gains()
+                if not return_scaled
+                else np.ones(num_channels)
+            ),
+            channel_offsets=(
+                recording.get_channel_offsets()
+                if not return_scaled
+                else np.zeros(num_channels)
+            ),
+            channel_groups=recording.get_channel_groups(),
+            channel_locations=get_channel_locations(recording),
+        )
+        with open(tmp_folder_path / HEADER_FILE_NAME, "w") as f:
+            json.dump(to_json_compatible(header), f)
+        try:
+            os.rename(tmp_folder_path, folder_path)
+        except OSError:
+            # Written concurrently by another process
+            shutil.rmtree(tmp_folder_path, ignore_errors=True)
+        self.evict(keep=[key])
+        return self.get(key)
+
+    def cache_recording(
+        self,
+        recording: se.RecordingExtractor,
+        params: Optional[dict] = None,
+        preprocess: Optional[Callable] = None,
+        store_times: bool = True,
+    ):
+        """
+        Return the cached traces of a recording, after computing and caching them if needed.
+
+        Parameters
+        ----------
+        recording: RecordingExtractor
+            The source recording, which identifies the entry together with params.
+        params: dict (optional)
+            Parameters of the stage, e.g. those of preprocess. They must identify the traces computed by preprocess.
+        preprocess: function (optional)
+            Function of the source recording returning the recording to cache. The default caches the source
+            recording itself.
+        store_times: bool (optional, defaults to True)
+            If True, the frame times are cached too.
+
+        Returns
+        -------
+        recording: CachedRecordingExtractor
+        """
+        if isinstance(recording, CachedRecordingExtractor) and preprocess is None:
+            return recording
+        key = self.get_key(recording, params)
+        cached_recording = self.get(key)
+        if cached_recording is not None:
+            return cached_recording
+        print(f"Caching the traces of {key} in {self.folder_path}.")
+        if preprocess is not None:
+            recording = preprocess(recording)
+        return self.add(recording, key, params=params, store_times=store_times)
+
+    def list_entries(self):
+        """Folder, size in bytes and time of last use of each entry, from the least to the most recently used."""
+        entries = []
+        for folder_path in self.folder_path.iterdir():
+            header_path = folder_path / HEADER_FILE_NAME
+            if folder_path.name.startswith(".") or not header_path.is_file():
+                continue
+            try:
+                last_used = header_path.stat().st_mtime
+                size = sum(
+                    file_path.stat().st_size for file_path in folder_path.iterdir()
+                )
+            except FileNotFoundError:
+                continue
+            entries.append((folder_path, size, last_used))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def get_size(self):
+        """Total size of the entries in bytes."""
+        return sum(size for _, size, _ in self.list_entries())
+
+    def evict(self, max_gb: Optional[float] = None, keep: Optional[list] = None):
+        """
+        Remove the least recently used entries until the cache fits in max_gb (defaults to the budget of the cache).
+
+        Parameters
+        ----------
+        max_gb: float (optional)
+        keep: list (optional)
+            Keys of entries that are never removed, e.g. the one being used.
+        """
+        if max_gb is None:
+            max_gb = self.max_gb
+        if max_gb is None:
+            return
+        keep = keep or []
+        entries = self.list_entries()
+        total_size = sum(size for _, size, _ in entries)
+        for folder_path, size, _ in entries:
+            if total_size <= max_gb * 1e9:
+                break
+            if folder_path.name in keep:
+                continue
+            print(f"Evicting {folder_path.name} from the trace cache.")
+            shutil.rmtree(folder_path, ignore_errors=True)
+            total_size -= size
+        if total_size > max_gb * 1e9:
+            print(
+                f"The trace cache ({total_size / 1e9:.3f} GB) exceeds its budget of {max_gb} GB "
+                "with the entries in use."
+            )
+
+
+def cache_recording(
+    recording: se.RecordingExtractor,
+    cache_folder: str,
+    max_gb: Optional[float] = None,
+    store_times: bool = True,
+):
+    """Return the raw traces of a recording from the TraceCache in cache_folder, caching them if needed."""
+    return TraceCache(cache_folder, max_gb=max_gb).cache_recording(
+        recording, store_times=store_times
+    )
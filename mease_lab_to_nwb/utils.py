@@ -0,0 +1,632 @@
+"""Helper extractors and functions shared by the CED and Syntalos converters."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from inspect import signature
+from time import perf_counter
+from typing import Optional, Union
+
+import numpy as np
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+from pynwb import NWBFile
+from pynwb.ecephys import ElectricalSeries
+from spikeextractors import RecordingExtractor
+from spikeextractors.extraction_tools import check_get_traces_args
+
+
+class ReadCountingRecordingExtractor(RecordingExtractor):
+    """
+    Pass-through recording extractor that counts the frames and bytes read from each channel of its parent.
+
+    Wrapping the source recording makes it easy to check how often a file format is actually decoded.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The recording extractor to read from.
+    """
+
+    def __init__(self, recording: RecordingExtractor):
+        RecordingExtractor.__init__(self)
+        self._recording = recording
+        self.copy_channel_properties(recording)
+        self.copy_times(recording)
+        self.has_unscaled = recording.has_unscaled
+        self.is_filtered = recording.is_filtered
+        self.frames_read = {ch: 0 for ch in recording.get_channel_ids()}
+        self.bytes_read = {ch: 0 for ch in recording.get_channel_ids()}
+        self._kwargs = {"recording": recording}
+
+    def get_channel_ids(self):
+        return self._recording.get_channel_ids()
+
+    def get_num_frames(self):
+        return self._recording.get_num_frames()
+
+    def get_sampling_frequency(self):
+        return self._recording.get_sampling_frequency()
+
+    @check_get_traces_args
+    def get_traces(
+        self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+    ):
+        # Scaling, if any, is applied once by check_get_traces_args with the copied gains and offsets
+        traces = self._recording.get_traces(
+            channel_ids=channel_ids,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            return_scaled=not self.has_unscaled,
+        )
+        for ch, trace in zip(channel_ids, traces):
+            self.frames_read[ch] += trace.shape[0]
+            self.bytes_read[ch] += trace.nbytes
+        return traces
+
+    def get_read_report(self):
+        """Return a summary line of the frames and bytes read for each channel."""
+        return [
+            f"Channel {ch}: read {self.frames_read[ch]} frames ({self.bytes_read[ch] / 1e6:.2f} MB)"
+            for ch in self.get_channel_ids()
+        ]
+
+
+class RecordingTracesChunkIterator(AbstractDataChunkIterator):
+    """
+    Data chunk iterator that pulls blocks of frames from a recording extractor on demand.
+
+    The traces are yielded with time as the first axis, as expected by NWB, so that a TimeSeries can be written
+    without ever holding the full array in memory.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The recording extractor to read from.
+    channel_ids: int or list (optional)
+        Channels to iterate over. If a single int is given, the data is one-dimensional.
+        Defaults to all channels.
+    buffer_frames: int (optional, defaults to 1000000)
+        Number of frames read from the recording at a time.
+    chunk_shape: tuple (optional)
+        Recommended HDF5 chunk shape. If None, the chunking is left to the backend.
+    return_scaled: bool (optional, defaults to True)
+        Whether to return scaled traces.
+    unsigned_coercion: np.ndarray (optional)
+        Integer added to the unscaled traces of each channel, which are then cast to the signed type of the same
+        size, as done by NwbRecordingExtractor for unsigned data with offsets.
+    num_workers: int (optional)
+        If given, the next num_workers blocks are read ahead in a thread pool of that size while the current one
+        is written. By default, each block is read when it is requested.
+    """
+
+    def __init__(
+        self,
+        recording: RecordingExtractor,
+        channel_ids: Optional[Union[int, list]] = None,
+        buffer_frames: int = 1000000,
+        chunk_shape: Optional[tuple] = None,
+        return_scaled: bool = True,
+        unsigned_coercion: Optional[np.ndarray] = None,
+        num_workers: Optional[int] = None,
+    ):
+        if channel_ids is None:
+            channel_ids = recording.get_channel_ids()
+        self._squeeze = isinstance(channel_ids, (int, np.integer))
+        self.recording = recording
+        self.channel_ids = [channel_ids] if self._squeeze else list(channel_ids)
+        self.buffer_frames = int(buffer_frames)
+        self.return_scaled = return_scaled
+        self.unsigned_coercion = unsigned_coercion
+        self._num_frames = recording.get_num_frames()
+        if chunk_shape is not None:
+            chunk_shape = tuple(
+                min(size, max_size)
+                for size, max_size in zip(chunk_shape, self.maxshape)
+            )
+        self._chunk_shape = chunk_shape
+        self._dtype = recording.get_traces(
+            channel_ids=self.channel_ids[:1],
+            start_frame=0,
+            end_frame=1,
+            return_scaled=return_scaled,
+        ).dtype
+        if unsigned_coercion is not None:
+            self._dtype = np.dtype(self._dtype.name.lstrip("u"))
+        self.num_workers = num_workers
+        self._executor = None
+        self._pending = deque()
+        self._start_frame = 0
+
+    def __iter__(self):
+        return self
+
+    def _cancel_pending(self):
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def close(self):
+        """Shut down the read-ahead thread pool, if any."""
+        self._cancel_pending()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def seek(self, start_frame: int):
+        """Set the first frame of the next chunk, e.g. to resume an interrupted write."""
+        self._cancel_pending()
+        self._start_frame = start_frame
+
+    def _read_block(self, start_frame: int, end_frame: int):
+        traces = self.recording.get_traces(
+            channel_ids=self.channel_ids,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            return_scaled=self.return_scaled,
+        )
+        if self.unsigned_coercion is not None:
+            traces = traces + self.unsigned_coercion[:, np.newaxis]
+            traces = traces.astype(self._dtype)
+        return traces.T
+
+    def __next__(self):
+        if self._start_frame >= self._num_frames:
+            self.close()
+            raise StopIteration
+        start_frame = self._start_frame
+        end_frame = min(start_frame + self.buffer_frames, self._num_frames)
+        if self.num_workers is None:
+            traces = self._read_block(start_frame, end_frame)
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+            next_start_frame = start_frame
+            if self._pending:
+                next_start_frame = self._pending[-1][0] + self.buffer_frames
+            while (
+                next_start_frame < self._num_frames
+                and len(self._pending) <= self.num_workers
+            ):
+                next_end_frame = min(
+                    next_start_frame + self.buffer_frames, self._num_frames
+                )
+                future = self._executor.submit(
+                    self._read_block, next_start_frame, next_end_frame
+                )
+                self._pending.append((next_start_frame, future))
+                next_start_frame = next_end_frame
+            _, future = self._pending.popleft()
+            traces = future.result()
+        self._start_frame = end_frame
+        if self._squeeze:
+            return DataChunk(data=traces[:, 0], selection=np.s_[start_frame:end_frame])
+        return DataChunk(data=traces, selection=np.s_[start_frame:end_frame, :])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return self._chunk_shape
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        if self._squeeze:
+            return (self._num_frames,)
+        return self._num_frames, len(self.channel_ids)
+
+
+class FrameTimesChunkIterator(AbstractDataChunkIterator):
+    """
+    Data chunk iterator over the times of a range of frames of a recording extractor.
+
+    The times are obtained block by block from recording.frame_to_time, so that a dense timestamps dataset can be
+    written without holding the full array in memory.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The recording extractor providing frame_to_time.
+    num_frames: int (optional)
+        Number of frames of the recording to cover. Defaults to all frames.
+    frame_step: float (optional, defaults to 1.)
+        Step between consecutive frames, e.g. the decimation factor of a lower rate signal.
+        The frames are np.arange(0, num_frames, frame_step).astype(int).
+    buffer_size: int (optional, defaults to 1000000)
+        Number of timestamps computed at a time.
+    chunk_shape: tuple (optional)
+        Recommended HDF5 chunk shape. If None, the chunking is left to the backend.
+    num_times: int (optional)
+        Number of timestamps, e.g. to match the length of a truncated data array.
+        Defaults to the length of np.arange(0, num_frames, frame_step).
+    """
+
+    def __init__(
+        self,
+        recording: RecordingExtractor,
+        num_frames: Optional[int] = None,
+        frame_step: float = 1.0,
+        buffer_size: int = 1000000,
+        chunk_shape: Optional[tuple] = None,
+        num_times: Optional[int] = None,
+    ):
+        self.recording = recording
+        if num_frames is None:
+            num_frames = recording.get_num_frames()
+        self.frame_step = frame_step
+        self.buffer_size = int(buffer_size)
+        if num_times is None:
+            num_times = int(np.ceil(num_frames / frame_step))
+        self._num_times = num_times
+        if chunk_shape is not None:
+            chunk_shape = (min(chunk_shape[0], self._num_times),)
+        self._chunk_shape = chunk_shape
+        self._start = 0
+
+    def __iter__(self):
+        return self
+
+    def seek(self, start: int):
+        """Set the index of the first timestamp of the next chunk, e.g. to resume an interrupted write."""
+        self._start = start
+
+    def __next__(self):
+        if self._start >= self._num_times:
+            raise StopIteration
+        start = self._start
+        end = min(start + self.buffer_size, self._num_times)
+        frames = (np.arange(start, end, dtype=np.float64) * self.frame_step).astype(int)
+        self._start = end
+        return DataChunk(
+            data=np.asarray(self.recording.frame_to_time(frames), dtype=np.float64),
+            selection=np.s_[start:end],
+        )
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return self._chunk_shape
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return np.dtype("float64")
+
+    @property
+    def maxshape(self):
+        return (self._num_times,)
+
+
+class MultiMemmapChunkIterator(AbstractDataChunkIterator):
+    """
+    Data chunk iterator over channels stored as separate memmaps in consecutive files.
+
+    The files are concatenated along time and the channels are stacked as columns, without copying the memmaps:
+    each block is read directly from the rows of the memmaps that contain it.
+
+    Parameters
+    ----------
+    memmaps: list
+        For each file, the list of arrays (e.g. np.memmap) of each channel. Multi-dimensional arrays are read in
+        flattened (C) order, as in the pyintan raw data of the auxiliary channels.
+    num_frames: int (optional)
+        Number of frames to iterate over, e.g. for stub tests. Defaults to all frames of all files.
+    buffer_frames: int (optional, defaults to 1000000)
+        Number of frames read at a time.
+    chunk_shape: tuple (optional)
+        Recommended HDF5 chunk shape. If None, the chunking is left to the backend.
+    """
+
+    def __init__(
+        self,
+        memmaps: list,
+        num_frames: Optional[int] = None,
+        buffer_frames: int = 1000000,
+        chunk_shape: Optional[tuple] = None,
+    ):
+        self.memmaps = memmaps
+        self._num_channels = len(memmaps[0])
+        file_num_frames = [channel_memmaps[0].size for channel_memmaps in memmaps]
+        for channel_memmaps in memmaps:
+            assert len(channel_memmaps) == self._num_channels and all(
+                x.size == channel_memmaps[0].size for x in channel_memmaps
+            ), "All channels of a file must have the same number of frames!"
+        self._file_start_frames = np.cumsum([0] + file_num_frames)
+        total_frames = int(self._file_start_frames[-1])
+        self._num_frames = (
+            total_frames if num_frames is None else min(num_frames, total_frames)
+        )
+        self.buffer_frames = int(buffer_frames)
+        self._dtype = memmaps[0][0].dtype
+        if chunk_shape is not None:
+            chunk_shape = tuple(
+                min(size, max_size)
+                for size, max_size in zip(chunk_shape, self.maxshape)
+            )
+        self._chunk_shape = chunk_shape
+        self._start_frame = 0
+
+    @staticmethod
+    def _read_flat(array, start: int, end: int):
+        """Return array.reshape(-1)[start:end], reading only the rows that contain it."""
+        if array.ndim == 1:
+            return array[start:end]
+        row_size = int(np.prod(array.shape[1:]))
+        first_row = start // row_size
+        rows = np.asarray(array[first_row : -(-end // row_size)]).reshape(-1)
+        return rows[start - first_row * row_size : end - first_row * row_size]
+
+    def __iter__(self):
+        return self
+
+    def seek(self, start_frame: int):
+        """Set the first frame of the next chunk, e.g. to resume an interrupted write."""
+        self._start_frame = start_frame
+
+    def __next__(self):
+        if self._start_frame >= self._num_frames:
+            raise StopIteration
+        start_frame = self._start_frame
+        end_frame = min(start_frame + self.buffer_frames, self._num_frames)
+        data = np.empty((end_frame - start_frame, self._num_channels), self._dtype)
+        first_file = np.searchsorted(self._file_start_frames, start_frame, "right") - 1
+        last_file = np.searchsorted(self._file_start_frames, end_frame, "left") - 1
+        for file_index in range(first_file, last_file + 1):
+            file_start = self._file_start_frames[file_index]
+            start = max(start_frame, file_start)
+            end = min(end_frame, self._file_start_frames[file_index + 1])
+            for channel_index, array in enumerate(self.memmaps[file_index]):
+                data[
+                    start - start_frame : end - start_frame, channel_index
+                ] = self._read_flat(array, start - file_start, end - file_start)
+        self._start_frame = end_frame
+        return DataChunk(data=data, selection=np.s_[start_frame:end_frame, :])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return self._chunk_shape
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return self._num_frames, self._num_channels
+
+
+def add_electrical_series(
+    recording: RecordingExtractor,
+    nwbfile: NWBFile,
+    use_times: bool = False,
+    buffer_frames: int = 1000000,
+    chunk_frames: Optional[int] = None,
+    chunk_channels: Optional[int] = None,
+    compression: Optional[str] = "gzip",
+    compression_opts: Optional[int] = None,
+    shuffle: bool = False,
+    buffer_mb: Optional[float] = None,
+    name: str = "ElectricalSeries_raw",
+    description: str = "Raw acquired data",
+    num_workers: Optional[int] = None,
+):
+    """
+    Add the raw traces of a recording to the NWBFile as an ElectricalSeries written block by block.
+
+    The series is the same as the one of NwbRecordingExtractor.add_electrical_series with write_as="raw" (unscaled
+    data, with unsigned data coerced to signed, and the gains as conversion factors), but the traces and timestamps
+    are read through chunk iterators, buffer_frames frames at a time for all channels, instead of one full channel
+    and the full timestamps array at a time. The electrodes must already be in the NWBFile.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+    nwbfile: NWBFile
+    use_times: bool (optional, defaults to False)
+        If True, the times of recording.frame_to_time are written as timestamps. Otherwise, the sampling rate is used.
+    buffer_frames: int (optional, defaults to 1000000)
+        Number of frames read at a time.
+    chunk_frames: int (optional)
+        Number of frames per HDF5 chunk. If None, the chunking is left to the backend.
+    chunk_channels: int (optional)
+        Number of channels per HDF5 chunk, used with chunk_frames. Defaults to all channels. Small values make
+        reading a few channels over long periods cheaper, at the cost of more chunks per time window.
+    compression: str (optional, defaults to "gzip")
+        Compression filter of the traces and timestamps: "gzip", "lzf" (faster, larger files) or None.
+    compression_opts: int (optional)
+        Level of the gzip compression (0-9). Defaults to the h5py default (4).
+    shuffle: bool (optional, defaults to False)
+        Whether to apply the HDF5 byte shuffle filter before compression, which usually compresses the traces
+        and timestamps better.
+    buffer_mb: float (optional)
+        Size of the blocks read at a time in MB, for all channels. If given, it replaces buffer_frames.
+    name: str (optional, defaults to "ElectricalSeries_raw")
+    description: str (optional, defaults to "Raw acquired data")
+    num_workers: int (optional)
+        Number of threads reading blocks ahead of the write (see RecordingTracesChunkIterator). By default, the
+        blocks are read serially.
+    """
+    if compression not in ["gzip", "lzf", None]:
+        raise ValueError(
+            f"Unknown compression '{compression}'! Options: 'gzip', 'lzf' or None."
+        )
+    if chunk_channels is not None and chunk_frames is None:
+        raise ValueError("chunk_channels can only be used together with chunk_frames!")
+    eseries_kwargs = dict(
+        name=name,
+        description=description,
+        comments="Generated from SpikeInterface::NwbRecordingExtractor",
+    )
+    channel_ids = recording.get_channel_ids()
+    table_ids = [list(nwbfile.electrodes.id[:]).index(id) for id in channel_ids]
+    eseries_kwargs.update(
+        electrodes=nwbfile.create_electrode_table_region(
+            region=table_ids, description="electrode_table_region"
+        )
+    )
+
+    # For NWB, the conversions cast the data to Volts, while the recording gains cast it to uV
+    channel_conversion = recording.get_channel_gains()
+    unsigned_coercion = recording.get_channel_offsets() / channel_conversion
+    if not np.all([x.is_integer() for x in unsigned_coercion]):
+        raise NotImplementedError(
+            "Unable to coerce underlying unsigned data type to signed type, which is currently required for NWB "
+            "Schema v2.2.5!"
+        )
+    unsigned_coercion = unsigned_coercion.astype(int)
+    if np.all(unsigned_coercion == 0):
+        unsigned_coercion = None
+    if len(np.unique(channel_conversion)) == 1:
+        eseries_kwargs.update(conversion=channel_conversion[0] * 1e-6)
+    else:
+        eseries_kwargs.update(conversion=1e-6, channel_conversion=channel_conversion)
+
+    chunk_shape = None
+    if chunk_frames is not None:
+        chunk_shape = (chunk_frames, chunk_channels or len(channel_ids))
+    traces = RecordingTracesChunkIterator(
+        recording=recording,
+        buffer_frames=buffer_frames,
+        chunk_shape=chunk_shape,
+        return_scaled=False,
+        unsigned_coercion=unsigned_coercion,
+        num_workers=num_workers,
+    )
+    if buffer_mb is not None:
+        frame_size = len(channel_ids) * traces.dtype.itemsize
+        traces.buffer_frames = max(int(buffer_mb * 1e6 // frame_size), 1)
+    # h5py rejects compression_opts with lzf or without compression
+    filter_kwargs = dict(compression=compression, shuffle=shuffle)
+    if compression == "gzip" and compression_opts is not None:
+        filter_kwargs.update(compression_opts=compression_opts)
+    eseries_kwargs.update(data=H5DataIO(traces, **filter_kwargs))
+    if use_times:
+        eseries_kwargs.update(
+            timestamps=H5DataIO(
+                FrameTimesChunkIterator(
+                    recording=recording,
+                    buffer_size=traces.buffer_frames,
+                    chunk_shape=None if chunk_frames is None else (chunk_frames,),
+                ),
+                **filter_kwargs,
+            )
+        )
+    else:
+        eseries_kwargs.update(
+            starting_time=recording.frame_to_time(0),
+            rate=float(recording.get_sampling_frequency()),
+        )
+    nwbfile.add_acquisition(ElectricalSeries(**eseries_kwargs))
+
+
+def copy_frame_times(extractor, recording: RecordingExtractor):
+    """
+    Make an extractor (e.g. a sorting of the recording) convert frames to times as the recording does.
+
+    copy_times deep-copies the dense _times array of the recording, and only that array: the times that a recording
+    computes in frame_to_time (e.g. the tsync-synchronized times of a SyntalosRecordingExtractor, also through the
+    SubRecordingExtractor returned by apply_probe_file) are lost. Here the extractor uses the frame_to_time and
+    time_to_frame of the recording instead, so that only the frames that are converted (e.g. the spike frames, when
+    the sorting is written) are, without an array of the times of all frames.
+    """
+    extractor.frame_to_time = recording.frame_to_time
+    extractor.time_to_frame = recording.time_to_frame
+
+
+def prepare_interfaces(
+    data_interface_objects: dict,
+    conversion_options: Optional[dict] = None,
+    num_workers: Optional[int] = None,
+):
+    """
+    Run the prepare_conversion method of the data interfaces that define one, concurrently.
+
+    prepare_conversion does the reading and processing of an interface (CSV parsing, timestamp assembly,
+    TTL detection, ...) ahead of its run_conversion, which then only adds the prepared objects to the NWBFile.
+    Each interface receives the subset of its conversion options that appear in the signature of its
+    prepare_conversion.
+
+    Parameters
+    ----------
+    data_interface_objects: dict
+        The data interfaces of a converter, by name.
+    conversion_options: dict (optional)
+        The conversion options of each interface, by name.
+    num_workers: int (optional)
+        Number of threads. If None, the thread pool default is used.
+
+    Returns
+    -------
+    timings: dict
+        For each interface, a dict with the time (in seconds) spent in prepare_conversion.
+    """
+    conversion_options = conversion_options or dict()
+    timings = {name: dict() for name in data_interface_objects}
+
+    def prepare(name, interface):
+        parameters = signature(interface.prepare_conversion).parameters
+        options = {
+            key: value
+            for key, value in conversion_options.get(name, dict()).items()
+            if key in parameters
+        }
+        t0 = perf_counter()
+        interface.prepare_conversion(**options)
+        timings[name]["prepare"] = perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(prepare, name, interface)
+            for name, interface in data_interface_objects.items()
+            if hasattr(interface, "prepare_conversion")
+        ]
+        for future in futures:
+            future.result()
+    return timings
+
+
+@contextmanager
+def record_conversion_times(data_interface_objects: dict, timings: dict):
+    """Within the context, record the time spent in the run_conversion of each data interface in timings."""
+
+    def timed(name, run_conversion):
+        def timed_run_conversion(*args, **kwargs):
+            t0 = perf_counter()
+            result = run_conversion(*args, **kwargs)
+            timings.setdefault(name, dict())["add"] = perf_counter() - t0
+            return result
+
+        return timed_run_conversion
+
+    for name, interface in data_interface_objects.items():
+        interface.run_conversion = timed(name, interface.run_conversion)
+    try:
+        yield timings
+    finally:
+        for interface in data_interface_objects.values():
+            del interface.run_conversion
+
+
+def get_timing_report(timings: dict, total_time: Optional[float] = None):
+    """Return the lines of a table of the prepare and add times of each interface, and of the total time."""
+    lines = [f"{'interface':<24} {'prepare (s)':>12} {'add (s)':>10}"]
+    for name, interface_timings in timings.items():
+        prepare_time = interface_timings.get("prepare")
+        add_time = interface_timings.get("add")
+        prepare_text = "-" if prepare_time is None else f"{prepare_time:.2f}"
+        add_text = "-" if add_time is None else f"{add_time:.2f}"
+        lines.append(f"{name:<24} {prepare_text:>12} {add_text:>10}")
+    if total_time is not None:
+        lines.append(f"Total conversion time: {total_time:.2f} s")
+    return lines
@@ -19,9 +19,12 @@ setup(
     email="ben.dichter@gmail.com",
     packages=find_packages(),
     include_package_data=True,
-    package_data={"": ["*.yml", "*.json"]},
+    package_data={"": ["*.yml", "*.json", "probe_files/*.prb"]},
     install_requires=install_requires,
     entry_points={
-        "console_scripts": ["nwbgui-mease=mease_lab_to_nwb.cmd_line:cmd_line_shortcut"],
+        "console_scripts": [
+            "nwbgui-mease=mease_lab_to_nwb.cmd_line:cmd_line_shortcut",
+            "mease-batch-convert=mease_lab_to_nwb.batch_convert:batch_convert_shortcut",
+        ],
     },
 )
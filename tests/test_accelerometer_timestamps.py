@@ -0,0 +1,102 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile
+
+from mease_lab_to_nwb.convert_syntalos.syntalosrecordingextractor import (
+    TSyncTimestamps,
+)
+from mease_lab_to_nwb.convert_syntalos.syntalosrecordinginterface import (
+    write_accelerometer_data,
+)
+
+
+class TSyncMultiRecordingExtractor(se.MultiRecordingTimeExtractor):
+    """Multi-file recording with tsync times, mimicking the SyntalosRecordingExtractor without rhd files."""
+
+    def __init__(self, recordings, sync_map):
+        super().__init__(recordings)
+        self._tsync_timestamps = TSyncTimestamps(
+            sync_map=sync_map,
+            num_frames=self.get_num_frames(),
+            sampling_frequency=self.get_sampling_frequency(),
+        )
+
+    def frame_to_time(self, frames):
+        return self._tsync_timestamps.frame_to_time(frames)
+
+
+def make_recording(num_files=3, num_blocks=50, accel_decimation=4):
+    sampling_frequency = 20000.0
+    rng = np.random.default_rng(0)
+    recordings = []
+    for _ in range(num_files):
+        recording = se.NumpyRecordingExtractor(
+            timeseries=np.zeros((2, num_blocks * 60 * accel_decimation)),
+            sampling_frequency=sampling_frequency,
+        )
+        aux_channels = [
+            dict(
+                name=f"AUX{i}",
+                gain=3.74e-5,
+                units="V",
+                offset=0,
+                sampling_rate=sampling_frequency / accel_decimation,
+            )
+            for i in range(1, 4)
+        ]
+        raw_data = {
+            ch["name"]: rng.integers(0, 2 ** 16, (num_blocks, 60)).astype("uint16")
+            for ch in aux_channels
+        }
+        recording._recording = SimpleNamespace(
+            _anas_chan=aux_channels, _raw_data=raw_data
+        )
+        recordings.append(recording)
+    master_times = np.array([0, 150000, 150051, 420000, 600000])
+    sync_map = np.stack([master_times, master_times - [10, 30, 25, 60, 80]], axis=1)
+    return TSyncMultiRecordingExtractor(recordings, sync_map=sync_map)
+
+
+def test_accelerometer_timestamps_match_full_array():
+    recording = make_recording()
+    accel_sampling_rate = recording._recordings[0]._recording._anas_chan[0][
+        "sampling_rate"
+    ]
+    # Original full-array computation
+    expected = recording.frame_to_time(
+        np.arange(
+            0,
+            recording.get_num_frames(),
+            recording.get_sampling_frequency() / accel_sampling_rate,
+        ).astype(int)
+    )
+
+    for buffer_frames in [7, 1000, 1000000]:
+        nwbfile = NWBFile("description", "id", datetime.now().astimezone())
+        write_accelerometer_data(
+            nwbfile=nwbfile,
+            recording=recording,
+            use_times=True,
+            buffer_frames=buffer_frames,
+        )
+        accelerometer = nwbfile.acquisition["Accelerometer"]
+        timestamps = np.concatenate(
+            [chunk.data for chunk in accelerometer.timestamps.data]
+        )
+        assert np.array_equal(timestamps, expected)
+        data = np.concatenate([chunk.data for chunk in accelerometer.data.data])
+        assert data.shape == (len(expected), 3)
+
+
+def test_stub_accelerometer_timestamps():
+    recording = make_recording()
+    nwbfile = NWBFile("description", "id", datetime.now().astimezone())
+    write_accelerometer_data(
+        nwbfile=nwbfile, recording=recording, stub_test=True, use_times=True
+    )
+    accelerometer = nwbfile.acquisition["Accelerometer"]
+    timestamps = np.concatenate([chunk.data for chunk in accelerometer.timestamps.data])
+    assert np.array_equal(timestamps, recording.frame_to_time(np.arange(100) * 4))
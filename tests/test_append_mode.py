@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile, NWBHDF5IO, TimeSeries
+
+from mease_lab_to_nwb.convert_syntalos.syntalosnwbconverter import (
+    SyntalosNWBConverter,
+)
+
+
+class FakeInterface:
+    def __init__(self, name):
+        self.name = name
+        self.converted = False
+
+    def run_conversion(self, nwbfile, metadata):
+        self.converted = True
+        nwbfile.add_acquisition(
+            TimeSeries(name=self.name, data=np.arange(10), unit="n.a.", rate=1.0)
+        )
+
+
+def test_append_writes_only_new_containers(tmp_path):
+    nwbfile_path = tmp_path / "session.nwb"
+    raw_data = np.random.default_rng(0).integers(-100, 100, (1000, 4), dtype="int16")
+    nwbfile = NWBFile(
+        session_description="test",
+        identifier="test",
+        session_start_time=datetime(1970, 1, 1).astimezone(),
+    )
+    nwbfile.add_acquisition(
+        TimeSeries(name="ElectricalSeries_raw", data=raw_data, unit="V", rate=30.0)
+    )
+    with NWBHDF5IO(str(nwbfile_path), mode="w") as io:
+        io.write(nwbfile)
+
+    converter = SyntalosNWBConverter.__new__(SyntalosNWBConverter)
+    converter.data_interface_objects = dict(
+        SyntalosRecording=FakeInterface("ElectricalSeries_raw"),
+        SyntalosEvent=FakeInterface("LabeledEvents"),
+    )
+    sorting = se.NumpySortingExtractor()
+    sorting.set_sampling_frequency(30.0)
+    sorting.add_unit(unit_id=1, times=np.array([10, 20, 30]))
+    converter.run_conversion(
+        metadata=dict(), nwbfile_path=str(nwbfile_path), sorting=sorting
+    )
+
+    assert not converter.data_interface_objects["SyntalosRecording"].converted
+    assert converter.data_interface_objects["SyntalosEvent"].converted
+    with NWBHDF5IO(str(nwbfile_path), mode="r") as io:
+        nwbfile = io.read()
+        np.testing.assert_array_equal(
+            nwbfile.acquisition["ElectricalSeries_raw"].data[:], raw_data
+        )
+        assert "LabeledEvents" in nwbfile.acquisition
+        assert len(nwbfile.units) == 1
+
+    # Appending the same results again leaves the file unchanged
+    converter.run_conversion(
+        metadata=dict(), nwbfile_path=str(nwbfile_path), sorting=sorting
+    )
+    with NWBHDF5IO(str(nwbfile_path), mode="r") as io:
+        assert len(io.read().units) == 1
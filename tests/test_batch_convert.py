@@ -0,0 +1,123 @@
+import os
+
+from mease_lab_to_nwb.batch_convert import (
+    convert_session,
+    find_sessions,
+    get_num_workers,
+    get_partial_path,
+    get_status_path,
+    is_up_to_date,
+    read_manifest,
+    write_status,
+)
+
+
+def make_tree(root_path):
+    (root_path / "ced").mkdir()
+    (root_path / "ced" / "m365.smrx").write_bytes(b"\x00" * 10)
+    intan_folder_path = root_path / "syntalos" / "session1" / "intan-signals"
+    intan_folder_path.mkdir(parents=True)
+    (intan_folder_path / "intan_200730_120000.rhd").write_bytes(b"\x00" * 10)
+    (intan_folder_path / "intan-signals.tsync").write_bytes(b"\x00" * 10)
+
+
+def test_find_sessions(tmp_path):
+    make_tree(tmp_path)
+    sessions = find_sessions(tmp_path)
+    assert [session["type"] for session in sessions] == ["ced", "syntalos"]
+    assert sessions[0]["nwbfile_path"] == str(tmp_path / "ced" / "m365.nwb")
+    assert sessions[1]["path"] == str(tmp_path / "syntalos" / "session1")
+    assert sessions[1]["nwbfile_path"] == str(
+        tmp_path / "syntalos" / "session1" / "session1.nwb"
+    )
+
+
+def test_read_manifest(tmp_path):
+    make_tree(tmp_path)
+    (tmp_path / "manifest.csv").write_text(
+        "type,path,nwbfile_path,session_start\n"
+        "CED,ced/m365.smrx,out/m365.nwb,2020-07-30T12:00:00\n"
+        "syntalos,syntalos/session1,,\n"
+    )
+    (tmp_path / "manifest.toml").write_text(
+        "[[session]]\n"
+        'type = "ced"\n'
+        'path = "ced/m365.smrx"\n'
+        'nwbfile_path = "out/m365.nwb"\n'
+        'session_start = "2020-07-30T12:00:00"\n'
+        "[[session]]\n"
+        'type = "syntalos"\n'
+        'path = "syntalos/session1"\n'
+    )
+    csv_sessions = read_manifest(tmp_path / "manifest.csv")
+    toml_sessions = read_manifest(tmp_path / "manifest.toml")
+    assert csv_sessions == toml_sessions
+    assert csv_sessions[0]["nwbfile_path"] == str(tmp_path / "out" / "m365.nwb")
+    assert csv_sessions[0]["session_start"] == "2020-07-30T12:00:00"
+    assert csv_sessions[1] == find_sessions(tmp_path)[1]
+
+
+def test_is_up_to_date(tmp_path):
+    make_tree(tmp_path)
+    session = find_sessions(tmp_path)[1]
+    assert not is_up_to_date(session)
+
+    rhd_file_path = (
+        tmp_path / "syntalos" / "session1" / "intan-signals" / "intan_200730_120000.rhd"
+    )
+    nwbfile_path = tmp_path / "syntalos" / "session1" / "session1.nwb"
+    nwbfile_path.write_bytes(b"")
+    rhd_mtime = rhd_file_path.stat().st_mtime
+    os.utime(nwbfile_path, (rhd_mtime + 10, rhd_mtime + 10))
+    # Without the status of a successful conversion, e.g. left by a failed conversion
+    assert not is_up_to_date(session)
+    write_status(nwbfile_path, status="converted")
+    assert is_up_to_date(session)
+    os.utime(rhd_file_path, (rhd_mtime + 20, rhd_mtime + 20))
+    assert not is_up_to_date(session)
+
+    # The status does not apply to another NWBFile written later
+    os.utime(rhd_file_path, (rhd_mtime, rhd_mtime))
+    nwbfile_path.write_bytes(b"\x00")
+    os.utime(nwbfile_path, (rhd_mtime + 10, rhd_mtime + 10))
+    assert not is_up_to_date(session)
+
+
+class FailingConverter:
+    """Converter that writes part of the NWBFile and then fails."""
+
+    def __init__(self, source_data):
+        pass
+
+    def get_metadata(self):
+        return dict(NWBFile=dict())
+
+    def run_conversion(self, nwbfile_path, **kwargs):
+        with open(nwbfile_path, "wb") as f:
+            f.write(b"\x00" * 10)
+        raise RuntimeError("Interrupted conversion")
+
+
+def test_failed_conversion_leaves_no_file(tmp_path, monkeypatch):
+    import mease_lab_to_nwb
+
+    monkeypatch.setattr(mease_lab_to_nwb, "CEDNWBConverter", FailingConverter)
+    make_tree(tmp_path)
+    session = find_sessions(tmp_path)[0]
+    row = convert_session(session)
+    assert row["status"] == "failed"
+    assert row["error"] == "RuntimeError: Interrupted conversion"
+    assert not (tmp_path / "ced" / "m365.nwb").exists()
+    assert not get_partial_path(session["nwbfile_path"]).exists()
+    assert not get_status_path(session["nwbfile_path"]).exists()
+    assert not is_up_to_date(session)
+
+
+def test_get_num_workers():
+    assert get_num_workers(num_workers=8) == 8
+    assert (
+        get_num_workers(num_workers=8, memory_budget_gb=6, memory_per_session_gb=2) == 3
+    )
+    assert (
+        get_num_workers(num_workers=8, memory_budget_gb=1, memory_per_session_gb=2) == 1
+    )
@@ -0,0 +1,34 @@
+from mease_lab_to_nwb.convert_ced.cedchannelrules import CHANNEL_RULES, route_channels
+
+
+def make_channels_info(titles, unit="V", rate=30030.03):
+    return {
+        ch: dict(title=title, unit=unit, rate=rate) for ch, title in enumerate(titles)
+    }
+
+
+def test_default_channel_rules():
+    channels_info = make_channels_info(
+        ["Rhd1", "Laser", "Rhd2", "MechTTL", "CED_Mech", "LFP1", "Keyboard"]
+    )
+    routes = route_channels(channels_info)
+    assert routes["CEDRecording"]["smrx_channel_ids"] == [0, 2]
+    assert routes["CEDStimulus"]["smrx_channel_ids"] == [1, 3, 4]
+    assert routes["CEDStimulus"]["roles"] == [
+        "laser",
+        "mechanical_ttl",
+        "mechanical_pressure",
+    ]
+    assert routes["CEDLFP"]["smrx_channel_ids"] == [5]
+    assert sum(len(route["smrx_channel_ids"]) for route in routes.values()) == 6
+
+
+def test_custom_channel_rules():
+    channels_info = make_channels_info(["Rhd1", "Puff", "Puff"])
+    channels_info[2].update(rate=1000.0)
+    rules = CHANNEL_RULES + [
+        dict(target="CEDStimulus", title="^Puff$", rate=(5000, 50000), role="ttl")
+    ]
+    routes = route_channels(channels_info, rules=rules)
+    assert routes["CEDStimulus"] == dict(smrx_channel_ids=[1], roles=["ttl"])
+    assert "CEDLFP" not in routes
@@ -0,0 +1,54 @@
+import threading
+
+from mease_lab_to_nwb.utils import (
+    get_timing_report,
+    prepare_interfaces,
+    record_conversion_times,
+)
+
+
+class PreparedInterface:
+    def __init__(self):
+        self.prepared_with = None
+        self.converted = False
+
+    def prepare_conversion(self, chunk_size: int = 10):
+        self.prepared_with = dict(
+            chunk_size=chunk_size, thread=threading.current_thread().name
+        )
+
+    def run_conversion(self, nwbfile, metadata, stub_test=False, chunk_size=10):
+        self.converted = True
+        return stub_test
+
+
+class PlainInterface:
+    def run_conversion(self, nwbfile, metadata):
+        pass
+
+
+def test_prepare_interfaces():
+    data_interface_objects = dict(
+        First=PreparedInterface(), Second=PreparedInterface(), Plain=PlainInterface()
+    )
+    conversion_options = dict(First=dict(stub_test=True, chunk_size=5))
+    timings = prepare_interfaces(data_interface_objects, conversion_options)
+
+    # Only the options in the signature of prepare_conversion are passed
+    assert data_interface_objects["First"].prepared_with["chunk_size"] == 5
+    assert data_interface_objects["Second"].prepared_with["chunk_size"] == 10
+    for name in ["First", "Second"]:
+        assert data_interface_objects[name].prepared_with["thread"] != "MainThread"
+        assert timings[name]["prepare"] >= 0
+    assert timings["Plain"] == dict()
+
+    with record_conversion_times(data_interface_objects, timings):
+        for name, interface in data_interface_objects.items():
+            interface.run_conversion(None, None, **conversion_options.get(name, dict()))
+    for name, interface in data_interface_objects.items():
+        assert "add" in timings[name]
+        assert "run_conversion" not in vars(interface)
+    assert data_interface_objects["First"].converted
+
+    report = get_timing_report(timings, total_time=1.0)
+    assert len(report) == len(data_interface_objects) + 2
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import h5py
+import numpy as np
+import pytest
+import spikeextractors as se
+from pynwb import NWBFile, NWBHDF5IO
+
+from mease_lab_to_nwb.utils import add_electrical_series
+
+
+def make_recording():
+    traces = np.random.default_rng(0).integers(-100, 100, (8, 5000), dtype="int16")
+    recording = se.NumpyRecordingExtractor(timeseries=traces, sampling_frequency=30.0)
+    recording.set_channel_gains(0.195)
+    recording.has_unscaled = True
+    return recording
+
+
+def write_and_read(recording, nwbfile_path, **write_options):
+    nwbfile = NWBFile("description", "id", datetime(2020, 1, 1).astimezone())
+    se.NwbRecordingExtractor.add_devices(recording=recording, nwbfile=nwbfile)
+    se.NwbRecordingExtractor.add_electrode_groups(recording=recording, nwbfile=nwbfile)
+    se.NwbRecordingExtractor.add_electrodes(recording=recording, nwbfile=nwbfile)
+    add_electrical_series(recording=recording, nwbfile=nwbfile, **write_options)
+    with NWBHDF5IO(str(nwbfile_path), mode="w") as io:
+        io.write(nwbfile)
+    with h5py.File(nwbfile_path, mode="r") as file:
+        dataset = file["acquisition/ElectricalSeries_raw/data"]
+        return dataset[:], dataset.chunks, dataset.compression, dataset.shuffle
+
+
+@pytest.mark.parametrize(
+    "write_options, chunks, compression, shuffle",
+    [
+        (dict(chunk_frames=1000), (1000, 8), "gzip", False),
+        (
+            dict(chunk_frames=1000, chunk_channels=1, shuffle=True),
+            (1000, 1),
+            "gzip",
+            True,
+        ),
+        (
+            dict(chunk_frames=500, chunk_channels=4, compression="lzf"),
+            (500, 4),
+            "lzf",
+            False,
+        ),
+        (
+            dict(compression="gzip", compression_opts=9, buffer_mb=0.01),
+            None,
+            "gzip",
+            False,
+        ),
+    ],
+)
+def test_electrical_series_layout(
+    tmp_path, write_options, chunks, compression, shuffle
+):
+    recording = make_recording()
+    data, data_chunks, data_compression, data_shuffle = write_and_read(
+        recording, tmp_path / "test.nwb", **write_options
+    )
+    np.testing.assert_array_equal(data, recording.get_traces(return_scaled=False).T)
+    if chunks is not None:
+        assert data_chunks == chunks
+    assert data_compression == compression
+    assert data_shuffle == shuffle
+
+
+def test_electrical_series_layout_errors(tmp_path):
+    recording = make_recording()
+    with pytest.raises(ValueError):
+        write_and_read(recording, tmp_path / "test.nwb", compression="blosc")
+    with pytest.raises(ValueError):
+        write_and_read(recording, tmp_path / "test.nwb", chunk_channels=4)
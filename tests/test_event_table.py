@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from mease_lab_to_nwb.convert_syntalos.syntaloseventinterface import (
+    EventTableChunkIterator,
+    read_event_labels,
+)
+
+
+def write_event_table(file_path, num_events=1000):
+    rng = np.random.default_rng(0)
+    tags = rng.choice(["lick", "reward", "tone", "123"], num_events)
+    times = np.sort(rng.integers(0, 10000000, num_events))
+    pd.DataFrame(dict(Time=times, Tag=tags, Data=np.arange(num_events))).to_csv(
+        file_path, sep=";", index=False
+    )
+    return times, tags
+
+
+def read_all(iterator):
+    data = np.zeros(iterator.maxshape, dtype=iterator.dtype)
+    for chunk in iterator:
+        data[chunk.selection] = chunk.data
+    return data
+
+
+def test_event_table_chunks_match_full_read(tmp_path):
+    file_path = tmp_path / "table.csv"
+    times, tags = write_event_table(file_path)
+
+    labels, num_events = read_event_labels(file_path, chunk_size=64)
+    assert list(labels) == ["123", "lick", "reward", "tone"]
+    assert num_events == len(tags)
+
+    timestamps = EventTableChunkIterator(file_path, num_events, chunk_size=64)
+    np.testing.assert_array_equal(read_all(timestamps), times / 1e3)
+    data = EventTableChunkIterator(file_path, num_events, labels=labels, chunk_size=64)
+    assert data.dtype == np.dtype("uint8")
+    np.testing.assert_array_equal(labels[read_all(data)], tags)
+
+
+def test_event_table_iterator_seek(tmp_path):
+    file_path = tmp_path / "table.csv"
+    times, tags = write_event_table(file_path)
+    labels, num_events = read_event_labels(file_path)
+
+    iterator = EventTableChunkIterator(file_path, num_events, chunk_size=100)
+    iterator.seek(250)
+    chunk = next(iterator)
+    assert chunk.selection == np.s_[250:350]
+    np.testing.assert_array_equal(chunk.data, times[250:350] / 1e3)
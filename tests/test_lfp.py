@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile, NWBHDF5IO
+from scipy.signal import sosfiltfilt
+
+from mease_lab_to_nwb.lfp import add_lfp_electrical_series, compute_lfp, get_lfp_filter
+
+
+def make_recording(folder_path, num_channels=3, num_frames=30000, fs=30000.0):
+    rng = np.random.default_rng(0)
+    times = np.arange(num_frames) / fs
+    traces = rng.normal(0, 10, (num_channels, num_frames))
+    traces += 100 * np.sin(2 * np.pi * 7 * times)
+    file_path = folder_path / "traces.npy"
+    np.save(file_path, traces.astype("float32"))
+    return se.NumpyRecordingExtractor(timeseries=str(file_path), sampling_frequency=fs)
+
+
+def test_chunked_lfp_matches_full_filtering(tmp_path):
+    recording = make_recording(tmp_path)
+    sos = get_lfp_filter(30000.0, freq_min=1.0, freq_max=300.0)
+    traces = recording.get_traces(return_scaled=True).astype(np.float64)
+    expected = sosfiltfilt(sos, traces, axis=1)[:, ::30].T
+
+    for num_workers in [1, 2]:
+        lfp, rate = compute_lfp(
+            recording, lfp_rate=1000.0, chunk_frames=128, num_workers=num_workers
+        )
+        assert rate == 1000.0
+        assert lfp.shape == expected.shape
+        np.testing.assert_allclose(lfp, expected, atol=1e-3 * np.abs(expected).max())
+
+
+def test_add_lfp_electrical_series(tmp_path):
+    recording = make_recording(tmp_path, num_frames=3001)
+    nwbfile = NWBFile("description", "id", datetime.now().astimezone())
+    device = nwbfile.create_device(name="Device")
+    group = nwbfile.create_electrode_group(
+        name="Group", description="", location="unknown", device=device
+    )
+    for channel_id in recording.get_channel_ids():
+        nwbfile.add_electrode(
+            id=channel_id,
+            x=0.0,
+            y=0.0,
+            z=0.0,
+            imp=0.0,
+            location="unknown",
+            filtering="none",
+            group=group,
+        )
+    add_lfp_electrical_series(recording, nwbfile, num_workers=1)
+
+    with NWBHDF5IO(str(tmp_path / "test.nwb"), mode="w") as io:
+        io.write(nwbfile)
+
+    expected, _ = compute_lfp(recording, num_workers=1)
+    with NWBHDF5IO(str(tmp_path / "test.nwb"), mode="r") as io:
+        nwbfile = io.read()
+        electrical_series = nwbfile.processing["ecephys"]["LFP"]["ElectricalSeries_lfp"]
+        assert electrical_series.rate == 1000.0
+        assert electrical_series.data.shape == (101, 3)
+        np.testing.assert_array_equal(electrical_series.data[:], expected)
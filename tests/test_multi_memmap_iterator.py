@@ -0,0 +1,62 @@
+import numpy as np
+
+from mease_lab_to_nwb.utils import MultiMemmapChunkIterator
+
+
+def read_all(iterator):
+    data = np.zeros(iterator.maxshape, dtype=iterator.dtype)
+    for chunk in iterator:
+        data[chunk.selection] = chunk.data
+    return data
+
+
+def make_memmaps(folder_path, num_files=3, num_channels=3, num_blocks=7):
+    rng = np.random.default_rng(0)
+    all_memmaps = []
+    for i in range(num_files):
+        file_memmaps = []
+        for j in range(num_channels):
+            file_path = folder_path / f"file{i}_aux{j}.dat"
+            memmap = np.memmap(
+                file_path, dtype="uint16", mode="w+", shape=(num_blocks, 15)
+            )
+            memmap[:] = rng.integers(0, 2 ** 16, memmap.shape)
+            memmap.flush()
+            file_memmaps.append(
+                np.memmap(file_path, dtype="uint16", mode="r", shape=memmap.shape)
+            )
+        all_memmaps.append(file_memmaps)
+    return all_memmaps
+
+
+def test_multi_memmap_iterator_matches_concatenation(tmp_path):
+    all_memmaps = make_memmaps(tmp_path)
+    # Original in-memory construction of write_accelerometer_data
+    flat_memmaps = [[x.flatten() for x in file_memmaps] for file_memmaps in all_memmaps]
+    expected = np.concatenate(np.moveaxis(np.array(flat_memmaps), 2, 1))
+
+    for buffer_frames in [1, 7, 15, 16, 105, 1000]:
+        iterator = MultiMemmapChunkIterator(
+            memmaps=all_memmaps, buffer_frames=buffer_frames
+        )
+        assert iterator.maxshape == expected.shape
+        assert np.array_equal(read_all(iterator), expected)
+
+    stub_iterator = MultiMemmapChunkIterator(
+        memmaps=all_memmaps, num_frames=100, buffer_frames=40
+    )
+    assert np.array_equal(read_all(stub_iterator), expected[:100])
+
+
+def test_multi_memmap_iterator_unequal_files():
+    rng = np.random.default_rng(1)
+    sizes = [10, 0, 35, 1]
+    all_memmaps = [[rng.normal(size=size) for _ in range(2)] for size in sizes]
+    expected = np.concatenate(
+        [np.stack(file_memmaps, axis=1) for file_memmaps in all_memmaps]
+    )
+    for buffer_frames in [1, 3, 10, 11, 100]:
+        iterator = MultiMemmapChunkIterator(
+            memmaps=all_memmaps, buffer_frames=buffer_frames
+        )
+        assert np.array_equal(read_all(iterator), expected)
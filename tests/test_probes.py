@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile, NWBHDF5IO
+
+from mease_lab_to_nwb.probes import (
+    add_group_electrical_series,
+    apply_probe_file,
+    get_channel_groups,
+    get_probe_file_path,
+    update_electrode_group_metadata,
+)
+from mease_lab_to_nwb.utils import RecordingTracesChunkIterator
+
+
+def make_recording(file_path=None):
+    traces = np.random.default_rng(0).integers(-100, 100, (8, 5000), dtype="int16")
+    if file_path is not None:
+        # Dumpable, to be cached
+        np.save(file_path, traces)
+        traces = str(file_path)
+    recording = se.NumpyRecordingExtractor(timeseries=traces, sampling_frequency=30.0)
+    recording.set_channel_gains(0.195)
+    recording.has_unscaled = True
+    return recording
+
+
+def write_probe_file(file_path):
+    # Two tetrodes, listed out of channel order
+    file_path.write_text(
+        "channel_groups = {\n"
+        "    0: {'channels': [4, 5, 6, 7], 'geometry': [[0, 0], [1, 0], [2, 0], [3, 0]]},\n"
+        "    1: {'channels': [0, 1, 2, 3], 'geometry': [[6, 0], [7, 0], [8, 0], [9, 0]]},\n"
+        "}\n"
+    )
+    return file_path
+
+
+def test_shipped_probe_files():
+    for name in ["cambridge_neurotech_H3", "tetrode_32", "tetrode_64"]:
+        assert get_probe_file_path(name).is_file()
+
+
+def test_apply_probe_file(tmp_path):
+    recording = apply_probe_file(make_recording(), write_probe_file(tmp_path / "a.prb"))
+    assert recording.get_channel_ids() == [4, 5, 6, 7, 0, 1, 2, 3]
+    assert get_channel_groups(recording) == {0: [4, 5, 6, 7], 1: [0, 1, 2, 3]}
+    np.testing.assert_array_equal(recording.get_channel_locations([0])[0], [6, 0])
+
+    metadata = dict(Ecephys=dict(ElectrodeGroup=[dict(name="A", device="Intan")]))
+    update_electrode_group_metadata(metadata, recording, tmp_path / "a.prb")
+    assert [group["name"] for group in metadata["Ecephys"]["ElectrodeGroup"]] == [
+        "0",
+        "1",
+    ]
+    assert metadata["Ecephys"]["ElectrodeGroup"][1]["device"] == "Intan"
+
+
+def test_read_ahead_matches_serial_reads():
+    recording = make_recording()
+    for num_workers in [None, 1, 3]:
+        iterator = RecordingTracesChunkIterator(
+            recording=recording, buffer_frames=700, num_workers=num_workers
+        )
+        data = np.zeros(iterator.maxshape, dtype=iterator.dtype)
+        for chunk in iterator:
+            data[chunk.selection] = chunk.data
+        np.testing.assert_array_equal(data, recording.get_traces().T)
+
+
+def test_group_electrical_series(tmp_path):
+    raw_recording = make_recording(tmp_path / "traces.npy")
+    reads = []
+    get_traces = raw_recording.get_traces
+
+    def counting_get_traces(
+        channel_ids=None, start_frame=None, end_frame=None, **kwargs
+    ):
+        traces = get_traces(channel_ids, start_frame, end_frame, **kwargs)
+        reads.append(traces.shape)
+        return traces
+
+    raw_recording.get_traces = counting_get_traces
+    # The groups of the probe file, set on the recording itself so that it keeps its gains when cached
+    recording = raw_recording
+    recording.set_channel_groups([1, 1, 1, 1, 0, 0, 0, 0])
+    traces = get_traces(return_scaled=False)
+    for cache_folder in [None, tmp_path / "cache"]:
+        reads.clear()
+        nwbfile = NWBFile("description", "id", datetime(2020, 1, 1).astimezone())
+        se.NwbRecordingExtractor.add_devices(recording=recording, nwbfile=nwbfile)
+        se.NwbRecordingExtractor.add_electrode_groups(
+            recording=recording, nwbfile=nwbfile
+        )
+        se.NwbRecordingExtractor.add_electrodes(recording=recording, nwbfile=nwbfile)
+        add_group_electrical_series(
+            recording=recording,
+            nwbfile=nwbfile,
+            cache_folder=cache_folder,
+            buffer_frames=1000,
+            chunk_frames=500,
+        )
+        with NWBHDF5IO(str(tmp_path / "test.nwb"), mode="w") as io:
+            io.write(nwbfile)
+        # Leaving out the single frames read for the dtype of the traces
+        block_reads = [read for read in reads if read[1] > 1]
+        if cache_folder is None:
+            # Each group is read from the recording
+            assert {num_channels for num_channels, _ in block_reads} == {4}
+            assert sum(num_frames for _, num_frames in block_reads) == 2 * 5000
+        else:
+            # The recording is read once into the cache, for the channels of both groups at once, after its
+            # first 1000 frames are read scaled and unscaled (see tracecache.has_consistent_scaling)
+            assert {num_channels for num_channels, _ in block_reads} == {8}
+            assert sum(num_frames for _, num_frames in block_reads) == 5000 + 2 * 1000
+
+        with NWBHDF5IO(str(tmp_path / "test.nwb"), mode="r") as io:
+            nwbfile = io.read()
+            assert "ElectricalSeries_raw" not in nwbfile.acquisition
+            for group, channel_ids in [(0, [4, 5, 6, 7]), (1, [0, 1, 2, 3])]:
+                electrical_series = nwbfile.acquisition[
+                    f"ElectricalSeries_raw_group{group}"
+                ]
+                np.testing.assert_array_equal(
+                    electrical_series.data[:], traces[channel_ids].T
+                )
+                electrodes = electrical_series.electrodes
+                assert list(electrodes.table.id[electrodes.data[:]]) == channel_ids
+                assert {
+                    electrodes.table["group_name"][i] for i in electrodes.data[:]
+                } == {str(group)}
@@ -0,0 +1,147 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+import spikeextractors as se
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from pynwb import NWBFile, NWBHDF5IO, TimeSeries
+
+from mease_lab_to_nwb.resumablewrite import (
+    check_resumable_write,
+    get_conversion_fingerprint,
+    get_journal_path,
+    load_journal,
+    write_nwbfile_resumable,
+)
+from mease_lab_to_nwb.utils import (
+    FrameTimesChunkIterator,
+    ReadCountingRecordingExtractor,
+    RecordingTracesChunkIterator,
+)
+
+
+class FailingChunkIterator(RecordingTracesChunkIterator):
+    """Chunk iterator raising an error when reaching fail_frame, to simulate a conversion that dies mid-write."""
+
+    def __init__(self, fail_frame, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_frame = fail_frame
+
+    def __next__(self):
+        if self.fail_frame <= self._start_frame < self._num_frames:
+            raise MemoryError("Simulated failure")
+        return super().__next__()
+
+
+def make_nwbfile(recording, fail_frame=None):
+    nwbfile = NWBFile("description", "id", datetime(2020, 1, 1).astimezone())
+    iterator_kwargs = dict(
+        recording=recording, buffer_frames=1000, chunk_shape=(500, 4)
+    )
+    if fail_frame is None:
+        data_iterator = RecordingTracesChunkIterator(**iterator_kwargs)
+    else:
+        data_iterator = FailingChunkIterator(fail_frame=fail_frame, **iterator_kwargs)
+    nwbfile.add_acquisition(
+        TimeSeries(
+            name="Traces",
+            data=H5DataIO(data_iterator, compression="gzip"),
+            timestamps=H5DataIO(
+                FrameTimesChunkIterator(recording=recording, buffer_size=1000)
+            ),
+            unit="uV",
+        )
+    )
+    nwbfile.add_acquisition(
+        TimeSeries(name="Small", data=np.arange(10), unit="a.u.", rate=1.0)
+    )
+    return nwbfile
+
+
+def test_resumable_write_after_failure(tmp_path):
+    traces = np.random.default_rng(0).normal(size=(4, 10500)).astype("float32")
+    recording = ReadCountingRecordingExtractor(
+        se.NumpyRecordingExtractor(timeseries=traces, sampling_frequency=1000.0)
+    )
+    nwbfile_path = tmp_path / "resumable.nwb"
+
+    with pytest.raises(MemoryError):
+        write_nwbfile_resumable(make_nwbfile(recording, fail_frame=6000), nwbfile_path)
+    assert get_journal_path(nwbfile_path).is_file()
+    frames_read = recording.frames_read[0]
+
+    write_nwbfile_resumable(make_nwbfile(recording), nwbfile_path)
+    assert not get_journal_path(nwbfile_path).is_file()
+    # Only the frames after the last committed chunk are read again (plus the 1-frame dtype probe)
+    assert recording.frames_read[0] - frames_read == 10500 - 6000 + 1
+
+    with NWBHDF5IO(str(nwbfile_path), "r") as io:
+        nwbfile = io.read()
+        np.testing.assert_array_equal(nwbfile.acquisition["Traces"].data[:], traces.T)
+        np.testing.assert_array_equal(
+            nwbfile.acquisition["Traces"].timestamps[:], np.arange(10500) / 1000.0
+        )
+        np.testing.assert_array_equal(
+            nwbfile.acquisition["Small"].data[:], np.arange(10)
+        )
+
+
+def test_check_resumable_write(tmp_path):
+    nwbfile_path = tmp_path / "existing.nwb"
+    check_resumable_write(nwbfile_path)
+    nwbfile_path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        check_resumable_write(nwbfile_path)
+    check_resumable_write(nwbfile_path, overwrite=True)
+    get_journal_path(nwbfile_path).write_text("{}")
+    check_resumable_write(nwbfile_path)
+
+
+def test_resumable_write_with_other_fingerprint(tmp_path):
+    traces = np.random.default_rng(0).normal(size=(4, 10500)).astype("float32")
+    source_path = tmp_path / "traces.npy"
+    np.save(source_path, traces)
+    recording = ReadCountingRecordingExtractor(
+        se.NumpyRecordingExtractor(timeseries=traces, sampling_frequency=1000.0)
+    )
+    nwbfile_path = tmp_path / "resumable.nwb"
+    source_data = dict(Recording=dict(file_path=str(source_path)))
+    fingerprint = get_conversion_fingerprint(source_data, options=dict(gain=1.0))
+    assert fingerprint == get_conversion_fingerprint(
+        source_data, options=dict(gain=1.0)
+    )
+    assert fingerprint != get_conversion_fingerprint(
+        source_data, options=dict(gain=2.0)
+    )
+
+    with pytest.raises(MemoryError):
+        write_nwbfile_resumable(
+            make_nwbfile(recording, fail_frame=6000),
+            nwbfile_path,
+            fingerprint=fingerprint,
+        )
+    assert load_journal(nwbfile_path, fingerprint=fingerprint) is not None
+
+    # The source file changed since the interrupted write
+    np.save(source_path, -traces)
+    other_fingerprint = get_conversion_fingerprint(source_data, options=dict(gain=1.0))
+    assert other_fingerprint != fingerprint
+    assert load_journal(nwbfile_path, fingerprint=other_fingerprint) is None
+    with pytest.raises(ValueError):
+        write_nwbfile_resumable(
+            make_nwbfile(recording),
+            nwbfile_path,
+            fingerprint=other_fingerprint,
+            resume=True,
+        )
+
+    # The write starts from scratch, reading all the frames again
+    frames_read = recording.frames_read[0]
+    write_nwbfile_resumable(
+        make_nwbfile(recording), nwbfile_path, fingerprint=other_fingerprint
+    )
+    assert not get_journal_path(nwbfile_path).is_file()
+    assert recording.frames_read[0] - frames_read >= 10500
+    with NWBHDF5IO(str(nwbfile_path), "r") as io:
+        nwbfile = io.read()
+        np.testing.assert_array_equal(nwbfile.acquisition["Traces"].data[:], traces.T)
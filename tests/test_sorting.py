@@ -0,0 +1,127 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+import spikeextractors as se
+from pynwb import NWBHDF5IO
+
+ss = pytest.importorskip("spikesorters")
+pytest.importorskip("spiketoolkit")
+
+from mease_lab_to_nwb.convert_ced.cednwbconverter import quick_write
+from mease_lab_to_nwb.sorting import (
+    cache_preprocessed_shard,
+    make_shards,
+    merge_shard_sortings,
+    preprocess_recording,
+    sort_and_quick_write,
+)
+from mease_lab_to_nwb.tracecache import TraceCache
+
+
+def make_recording(folder_path):
+    recording, _ = se.example_datasets.toy_example(
+        duration=4, num_channels=8, seed=0, dumpable=True, dump_folder=folder_path
+    )
+    recording.set_channel_groups([0, 0, 0, 0, 1, 1, 1, 1])
+    recording.set_channel_locations(np.c_[np.zeros(8), 20.0 * np.arange(8)])
+    return recording
+
+
+def test_make_shards(tmp_path):
+    recording = make_recording(tmp_path / "toy")
+    shards = make_shards(recording)
+    assert [shard["name"] for shard in shards] == ["group0", "group1"]
+    assert shards[1]["channel_ids"] == [4, 5, 6, 7]
+
+    shards = make_shards(recording, by_group=False, shard_duration=1.5)
+    assert [(shard["start_frame"], shard["end_frame"]) for shard in shards] == [
+        (0, 45000),
+        (45000, 90000),
+        (90000, 120000),
+    ]
+    assert shards[0]["channel_ids"] == recording.get_channel_ids()
+
+
+def test_preprocessed_shard_is_cached(tmp_path):
+    recording = make_recording(tmp_path / "toy")
+    shard = make_shards(recording, shard_duration=1.0)[5]
+    cache = TraceCache(tmp_path / "cache")
+    cached_recording = cache_preprocessed_shard(recording, shard, cache)
+    # The shard is preprocessed with a margin, and referenced over all the channels, so that it matches the
+    # preprocessing (and CMR) of the whole recording
+    expected = preprocess_recording(recording).get_traces(
+        channel_ids=shard["channel_ids"],
+        start_frame=shard["start_frame"],
+        end_frame=shard["end_frame"],
+    )
+    np.testing.assert_allclose(cached_recording.get_traces(), expected, atol=1e-2)
+    assert cached_recording.get_channel_ids() == [4, 5, 6, 7]
+    assert list(cached_recording.get_channel_groups()) == [1, 1, 1, 1]
+    assert cached_recording.is_filtered
+
+    traces_path = tmp_path / "cache" / cached_recording.header["key"] / "traces.dat"
+    mtime = traces_path.stat().st_mtime_ns
+    assert (
+        cache_preprocessed_shard(recording, shard, cache).header["key"]
+        == cached_recording.header["key"]
+    )
+    assert traces_path.stat().st_mtime_ns == mtime
+    other_recording = cache_preprocessed_shard(recording, shard, cache, reference=None)
+    assert other_recording.header["key"] != cached_recording.header["key"]
+
+    # Referenced over the channels of the group only
+    group_recording = cache_preprocessed_shard(
+        recording, shard, cache, reference_by_group=True
+    )
+    assert group_recording.header["key"] != cached_recording.header["key"]
+    expected = preprocess_recording(
+        se.SubRecordingExtractor(recording, channel_ids=shard["channel_ids"])
+    ).get_traces(start_frame=shard["start_frame"], end_frame=shard["end_frame"])
+    np.testing.assert_allclose(group_recording.get_traces(), expected, atol=1e-2)
+    assert not np.allclose(group_recording.get_traces(), cached_recording.get_traces())
+
+
+def test_merge_shard_sortings(tmp_path):
+    recording = make_recording(tmp_path / "toy")
+    shards = make_shards(recording, shard_duration=2.0)
+    sortings = []
+    for i in range(len(shards)):
+        sorting = se.NumpySortingExtractor()
+        sorting.set_times_labels(np.array([10, 20, 30 + i]), np.array([0, 1, 0]))
+        sorting.set_sampling_frequency(recording.get_sampling_frequency())
+        sortings.append(sorting)
+    merged_sorting = merge_shard_sortings(sortings, shards, recording)
+    assert merged_sorting.get_unit_ids() == list(range(8))
+    np.testing.assert_array_equal(
+        merged_sorting.get_unit_spike_train(2), [60010, 60031]
+    )
+    assert merged_sorting.get_unit_property(6, "group") == 1
+    assert merged_sorting.get_unit_property(6, "shard") == "group1_frames60000-120000"
+
+
+@pytest.mark.skipif(
+    "herdingspikes" not in ss.installed_sorters(),
+    reason="herdingspikes is not installed",
+)
+def test_sort_and_quick_write(tmp_path):
+    recording = make_recording(tmp_path / "toy")
+    nwbfile_path = tmp_path / "session.nwb"
+    sortings = sort_and_quick_write(
+        quick_write,
+        recording,
+        ["herdingspikes"],
+        tmp_path / "sorting",
+        sorting_options=dict(num_workers=2),
+        ced_file_path=tmp_path / "session.smrx",
+        session_description="Sorted",
+        session_start=datetime(2020, 1, 1),
+        save_path=nwbfile_path,
+    )
+    sorting = sortings["herdingspikes"]
+    # The raw traces and the preprocessed traces of each group
+    assert len(TraceCache(tmp_path / "sorting" / "cache").list_entries()) == 3
+    with NWBHDF5IO(str(nwbfile_path), "r") as io:
+        nwbfile = io.read()
+        assert len(nwbfile.units) == len(sorting.get_unit_ids())
+        assert set(nwbfile.units["group"][:]) <= {0, 1}
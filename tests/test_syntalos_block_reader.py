@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+import spikeextractors as se
+from spikeextractors import IntanRecordingExtractor, MultiRecordingTimeExtractor
+
+from mease_lab_to_nwb.convert_syntalos.syntalosrecordingextractor import (
+    MultiFileBlockReader,
+    SyntalosRecordingExtractor,
+    copy_memmap_frames,
+)
+
+
+class FakeIntanRecordingExtractor(IntanRecordingExtractor):
+    """Intan recording over a structured memmap laid out as by pyintan, without an .rhd file."""
+
+    def __init__(self, file_path, traces, block_size=60):
+        se.RecordingExtractor.__init__(self)
+        num_channels, num_frames = traces.shape
+        dtype = [(f"A-{i:03d}", "uint16", (block_size,)) for i in range(num_channels)]
+        raw_data = np.memmap(
+            file_path, dtype=dtype, mode="w+", shape=num_frames // block_size
+        )
+        for i in range(num_channels):
+            raw_data[f"A-{i:03d}"] = traces[i].reshape(-1, block_size)
+        raw_data.flush()
+
+        class File:
+            _raw_data = np.memmap(file_path, dtype=dtype, mode="r")
+
+        self._recording = File()
+        self._analog_channels = [dict(name=f"A-{i:03d}") for i in range(num_channels)]
+        self._channel_ids = list(range(num_channels))
+        self._num_frames = num_frames
+        self._fs = 30000.0
+
+
+def make_traces(num_files=4, num_channels=3, blocks_per_file=(5, 1, 7, 3)):
+    rng = np.random.default_rng(0)
+    return [
+        rng.integers(0, 2 ** 16, (num_channels, 60 * num_blocks), dtype="uint16")
+        for num_blocks in blocks_per_file[:num_files]
+    ]
+
+
+def test_copy_memmap_frames():
+    memmap = np.arange(5 * 60, dtype="uint16").reshape(5, 60)
+    flat = memmap.flatten()
+    for start, end in [(0, 300), (0, 1), (59, 61), (13, 17), (30, 270), (60, 240)]:
+        out = np.zeros(end - start, dtype="uint16")
+        copy_memmap_frames(memmap, start, end, out)
+        np.testing.assert_array_equal(out, flat[start:end])
+
+
+@pytest.mark.parametrize("intan", [True, False])
+def test_block_reader_matches_concatenation(tmp_path, intan):
+    all_traces = make_traces()
+    if intan:
+        recordings = [
+            FakeIntanRecordingExtractor(tmp_path / f"file{i}.dat", traces)
+            for i, traces in enumerate(all_traces)
+        ]
+    else:
+        recordings = [
+            se.NumpyRecordingExtractor(timeseries=traces, sampling_frequency=30000.0)
+            for traces in all_traces
+        ]
+    expected = np.concatenate(all_traces, axis=1)
+    reader = MultiFileBlockReader(recordings)
+
+    file_indices, frames = reader.locate([0, 299, 300, 359, 360, 959])
+    np.testing.assert_array_equal(file_indices, [0, 0, 1, 1, 2, 3])
+    np.testing.assert_array_equal(frames, [0, 299, 0, 59, 0, 179])
+    for start, end in [
+        (0, 960),
+        (10, 20),
+        (290, 370),
+        (299, 300),
+        (300, 360),
+        (5, 955),
+    ]:
+        for channel_ids in [[0, 1, 2], [2, 0]]:
+            traces = reader.read(channel_ids, start, end)
+            assert traces.dtype == np.dtype("uint16")
+            np.testing.assert_array_equal(traces, expected[channel_ids, start:end])
+
+
+def test_syntalos_get_traces_matches_multi_recording():
+    recordings = [
+        se.NumpyRecordingExtractor(timeseries=traces, sampling_frequency=30000.0)
+        for traces in make_traces()
+    ]
+    for recording in recordings:
+        recording.set_channel_gains([0.195, 0.2, 0.3])
+        recording.set_channel_offsets([-6389.55, 0.0, 1.0])
+        recording.has_unscaled = True
+    # Syntalos recording over in-memory files, without a folder
+    recording = SyntalosRecordingExtractor.__new__(SyntalosRecordingExtractor)
+    MultiRecordingTimeExtractor.__init__(recording, recordings)
+    recording._block_reader = MultiFileBlockReader(recordings)
+    multi_recording = MultiRecordingTimeExtractor(recordings)
+
+    for start, end in [(0, 960), (290, 370), (310, 330)]:
+        for return_scaled in [True, False]:
+            traces = recording.get_traces(
+                start_frame=start, end_frame=end, return_scaled=return_scaled
+            )
+            expected = multi_recording.get_traces(
+                start_frame=start, end_frame=end, return_scaled=return_scaled
+            )
+            assert traces.dtype == expected.dtype
+            np.testing.assert_array_equal(traces, expected)
@@ -0,0 +1,64 @@
+import os
+
+from mease_lab_to_nwb.convert_syntalos.syntalosfolderindex import (
+    INDEX_FILE_NAME,
+    file_signature,
+    get_session_id,
+    list_syntalos_folder,
+    load_folder_index,
+    save_folder_index,
+    sort_rhd_files,
+)
+
+
+def make_folder(folder_path):
+    for date in ["200730_120500", "200730_120000", "200730_121000"]:
+        (folder_path / f"intan_{date}.rhd").write_bytes(b"\x00" * 64)
+    (folder_path / "intan-signals.tsync").write_bytes(b"\x00" * 16)
+
+
+def make_index(folder_path):
+    file_paths, tsync_file = list_syntalos_folder(folder_path)
+    return dict(
+        rhd_files=[
+            dict(file_signature(file_path), num_frames=100)
+            for file_path in sort_rhd_files(file_paths)
+        ],
+        tsync_file=dict(file_signature(tsync_file), times=[[0, 0], [10, 12]]),
+    )
+
+
+def test_folder_index_round_trip(tmp_path):
+    make_folder(tmp_path)
+    assert load_folder_index(tmp_path) is None
+    assert get_session_id(tmp_path) == "intan_200730_120000"
+
+    index = make_index(tmp_path)
+    save_folder_index(tmp_path, index)
+    assert (tmp_path / INDEX_FILE_NAME).is_file()
+    loaded_index = load_folder_index(tmp_path)
+    assert loaded_index["rhd_files"] == index["rhd_files"]
+    assert loaded_index["tsync_file"] == index["tsync_file"]
+    assert get_session_id(tmp_path) == "intan_200730_120000"
+
+
+def test_folder_index_invalidation(tmp_path):
+    make_folder(tmp_path)
+    save_folder_index(tmp_path, make_index(tmp_path))
+    assert load_folder_index(tmp_path) is not None
+
+    # Modified file
+    rhd_file = tmp_path / "intan_200730_120500.rhd"
+    stat = rhd_file.stat()
+    os.utime(rhd_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert load_folder_index(tmp_path) is None
+
+    # Added file
+    save_folder_index(tmp_path, make_index(tmp_path))
+    (tmp_path / "intan_200730_121500.rhd").write_bytes(b"\x00" * 64)
+    assert load_folder_index(tmp_path) is None
+
+    # Resized tsync file
+    save_folder_index(tmp_path, make_index(tmp_path))
+    (tmp_path / "intan-signals.tsync").write_bytes(b"\x00" * 32)
+    assert load_folder_index(tmp_path) is None
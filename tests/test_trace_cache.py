@@ -0,0 +1,127 @@
+import shutil
+
+import numpy as np
+import spikeextractors as se
+
+from mease_lab_to_nwb.lfp import compute_lfp
+from mease_lab_to_nwb.tracecache import CachedRecordingExtractor, TraceCache
+
+
+def make_recording(file_path, seed=0, num_frames=3000, save=True):
+    if save:
+        traces = np.random.default_rng(seed).integers(
+            -1000, 1000, (4, num_frames), dtype="int16"
+        )
+        np.save(file_path, traces)
+    recording = se.NumpyRecordingExtractor(
+        timeseries=str(file_path), sampling_frequency=1000.0
+    )
+    recording.set_channel_gains(0.195)
+    recording.set_channel_offsets(-10.0)
+    recording.has_unscaled = True
+    recording.set_channel_groups([0, 0, 1, 1])
+    recording.set_channel_locations([[0, 0], [0, 20], [0, 40], [0, 60]])
+    recording.set_times(np.arange(num_frames) / 1000.0 + 5.0)
+    return recording
+
+
+def test_cached_recording_matches_source(tmp_path):
+    recording = make_recording(tmp_path / "a.npy")
+    cache = TraceCache(tmp_path / "cache")
+    cached_recording = cache.cache_recording(recording)
+    assert isinstance(cached_recording, CachedRecordingExtractor)
+    assert cached_recording.header["dtype"] == "int16"
+    np.testing.assert_array_equal(
+        cached_recording.get_traces(return_scaled=False),
+        recording.get_traces(return_scaled=False),
+    )
+    np.testing.assert_allclose(
+        cached_recording.get_traces(channel_ids=[2, 3], start_frame=10, end_frame=20),
+        recording.get_traces(channel_ids=[2, 3], start_frame=10, end_frame=20),
+    )
+    np.testing.assert_allclose(
+        cached_recording.frame_to_time(np.array([0, 2999])), [5.0, 7.999]
+    )
+    assert list(cached_recording.get_channel_groups()) == [0, 0, 1, 1]
+    np.testing.assert_array_equal(cached_recording.get_channel_locations()[3], [0, 60])
+
+    # Rebuilt from its serialized dict, e.g. in a worker process
+    loaded_recording = se.load_extractor_from_dict(
+        cached_recording.make_serialized_dict()
+    )
+    np.testing.assert_array_equal(
+        loaded_recording.get_traces(), cached_recording.get_traces()
+    )
+
+
+def test_cache_is_content_addressed(tmp_path):
+    recording = make_recording(tmp_path / "a.npy")
+    cache = TraceCache(tmp_path / "cache")
+    key = cache.get_key(recording)
+    assert cache.get(key) is None
+    cache.cache_recording(recording)
+    traces_path = tmp_path / "cache" / key / "traces.dat"
+    mtime = traces_path.stat().st_mtime_ns
+    assert cache.cache_recording(recording).header["key"] == key
+    assert traces_path.stat().st_mtime_ns == mtime
+
+    # Same traces with another probe geometry or grouping
+    regrouped_recording = make_recording(tmp_path / "a.npy", save=False)
+    regrouped_recording.set_channel_groups([0, 1, 2, 3])
+    assert cache.get_key(regrouped_recording) != key
+    moved_recording = make_recording(tmp_path / "a.npy", save=False)
+    moved_recording.set_channel_locations([[0, 0], [0, 25], [0, 50], [0, 75]])
+    assert cache.get_key(moved_recording) != key
+
+    # Same file at another path, the file rewritten in its middle only, and different content at the same path
+    shutil.copy2(tmp_path / "a.npy", tmp_path / "b.npy")
+    assert cache.get_key(make_recording(tmp_path / "b.npy", save=False)) == key
+    with open(tmp_path / "b.npy", "r+b") as f:
+        f.seek(f.seek(0, 2) // 2)
+        f.write(b"\x00\x01")
+    assert cache.get_key(make_recording(tmp_path / "b.npy", save=False)) != key
+    assert cache.get_key(make_recording(tmp_path / "a.npy", seed=1)) != key
+    assert cache.get_key(recording, params=dict(freq_min=300.0)) != key
+
+
+def test_inconsistent_scaling_is_cached_scaled(tmp_path):
+    # Scales the traces of its recordings itself and clears its own gains, like SyntalosRecordingExtractor
+    recording = se.MultiRecordingTimeExtractor([make_recording(tmp_path / "a.npy")])
+    cached_recording = TraceCache(tmp_path / "cache").cache_recording(recording)
+    assert cached_recording.header["dtype"] == "float32"
+    assert not cached_recording.has_unscaled
+    np.testing.assert_allclose(
+        cached_recording.get_traces(), recording.get_traces(), rtol=1e-6
+    )
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    recordings = [make_recording(tmp_path / f"{i}.npy", seed=i) for i in range(3)]
+    cache = TraceCache(tmp_path / "cache")
+    keys = [cache.cache_recording(r).header["key"] for r in recordings[:2]]
+    entry_size = cache.get_size() / 2
+    cache.max_gb = 2.5 * entry_size / 1e9
+
+    cache.get(keys[0])
+    keys.append(cache.cache_recording(recordings[2]).header["key"])
+    assert cache.get(keys[1]) is None
+    assert [entry[0].name for entry in cache.list_entries()] == [keys[0], keys[2]]
+
+    cache.evict(max_gb=0)
+    assert cache.get_size() == 0
+
+
+def test_lfp_from_cache(tmp_path):
+    recording = make_recording(tmp_path / "a.npy")
+    cached_recording = TraceCache(tmp_path / "cache").cache_recording(recording)
+    # The cached recording is rebuilt in each worker process
+    lfp, rate = compute_lfp(
+        cached_recording, freq_max=100.0, lfp_rate=250.0, num_workers=2
+    )
+    # In memory, so that it is not rebuilt (without its instance attributes) in worker processes
+    scaled_recording = se.NumpyRecordingExtractor(
+        timeseries=recording.get_traces(), sampling_frequency=1000.0
+    )
+    expected_lfp, _ = compute_lfp(scaled_recording, freq_max=100.0, lfp_rate=250.0)
+    assert rate == 250.0
+    np.testing.assert_allclose(lfp, expected_lfp, rtol=1e-5, atol=1e-4)
@@ -0,0 +1,159 @@
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import spikeextractors as se
+from pynwb import NWBFile, NWBHDF5IO
+
+from mease_lab_to_nwb.convert_syntalos.syntalosfolderindex import (
+    file_signature,
+    list_syntalos_folder,
+    save_folder_index,
+    sort_rhd_files,
+)
+from mease_lab_to_nwb.convert_syntalos.syntalosnwbconverter import quick_write
+from mease_lab_to_nwb.convert_syntalos.syntalosrecordingextractor import (
+    SyntalosRecordingExtractor,
+    TSyncTimestamps,
+    tsync_timestamps,
+)
+from mease_lab_to_nwb.utils import ReadCountingRecordingExtractor, copy_frame_times
+
+
+def tsync_timestamps_loop(sync_map, num_frames, sampling_frequency):
+    """Per-sync-point reference implementation of the tsync timestamp correction."""
+    tv_usec = np.arange(num_frames, dtype=np.float64) / sampling_frequency * 1e6
+    tv_adj_usec = tv_usec.copy()
+    init_offset_usec = offset_usec = sync_map[0][0] - sync_map[0][1]
+    tv_adj_usec[tv_usec <= sync_map[0][0]] -= init_offset_usec
+    for s, sync in enumerate(sync_map):
+        if s < len(sync_map) - 1:
+            idx = np.where((tv_usec > sync[0]) & (tv_usec <= sync_map[s + 1][0]))[0]
+            offset_usec = sync_map[s + 1][0] - sync_map[s + 1][1]
+        else:
+            idx = np.where(tv_usec > sync[0])[0]
+        tv_adj_usec[idx] -= offset_usec
+    return tv_adj_usec / 1e6
+
+
+def test_tsync_timestamps_match_loop():
+    sampling_frequency = 20000.0
+    num_frames = 50000
+    # Sync points exactly on frame times, between frames, and past the last frame
+    master_times = np.array([0, 50, 51, 999975, 1000000, 1800000, 3000000])
+    sync_map = np.stack([master_times, master_times - [7, 9, 3, 12, 0, 5, 8]], axis=1)
+    for num_sync in [1, 2, len(sync_map)]:
+        assert np.array_equal(
+            tsync_timestamps(sync_map[:num_sync], num_frames, sampling_frequency),
+            tsync_timestamps_loop(sync_map[:num_sync], num_frames, sampling_frequency),
+        )
+
+
+def test_lazy_tsync_timestamps():
+    sampling_frequency = 30000.0
+    num_frames = 90000
+    master_times = np.array([100000, 1000000, 2500000])
+    sync_map = np.stack([master_times, master_times - [1000, 1000, 1200]], axis=1)
+    timestamps = TSyncTimestamps(sync_map, num_frames, sampling_frequency)
+    dense_times = tsync_timestamps_loop(sync_map, num_frames, sampling_frequency)
+
+    frames = np.array([0, 1, 2999, 3000, 3001, 29999, 30000, 30001, 89999])
+    assert np.array_equal(timestamps.frame_to_time(frames), dense_times[frames])
+    assert np.array_equal(timestamps.get_times(29990, 30010), dense_times[29990:30010])
+
+    times = np.array([-1.0, 0.0, 0.5, 0.1, 1.001, 1.0012, 2.9, 10.0])
+    assert np.array_equal(
+        timestamps.time_to_frame(times), np.searchsorted(dense_times, times)
+    )
+
+
+def make_syntalos_folder(folder_path, num_frames=30000):
+    for date in ["200730_120000", "200730_121000"]:
+        (folder_path / f"intan_{date}.rhd").write_bytes(b"\x00" * 64)
+    (folder_path / "intan-signals.tsync").write_bytes(b"\x00" * 16)
+    file_paths, tsync_file = list_syntalos_folder(folder_path)
+    sync_map = [[100000, 99000], [1000000, 998800]]
+    save_folder_index(
+        folder_path,
+        dict(
+            rhd_files=[
+                dict(file_signature(file_path), num_frames=num_frames)
+                for file_path in sort_rhd_files(file_paths)
+            ],
+            tsync_file=dict(file_signature(tsync_file), times=sync_map),
+            sampling_frequency=30000.0,
+            channel_gains=[0.195] * 4,
+            channel_offsets=[0.0] * 4,
+        ),
+    )
+    return np.array(sync_map)
+
+
+def test_syntalos_times_are_copied(tmp_path):
+    sync_map = make_syntalos_folder(tmp_path)
+    recording = SyntalosRecordingExtractor(tmp_path)
+    dense_times = tsync_timestamps(sync_map, 60000, 30000.0)
+
+    sorting = se.NumpySortingExtractor()
+    sorting.set_times_labels(np.array([10, 3000, 59999]), np.array([0, 1, 0]))
+    copy_frame_times(sorting, recording)
+    frames = np.array([0, 2999, 3000, 3001, 59999])
+    assert np.array_equal(sorting.frame_to_time(frames), dense_times[frames])
+
+    # Sortings of a probe file recording (a SubRecordingExtractor) keep the corrected times too
+    sorting = se.NumpySortingExtractor()
+    sorting.set_times_labels(np.array([10, 3000, 59999]), np.array([0, 1, 0]))
+    copy_frame_times(sorting, se.SubRecordingExtractor(recording, channel_ids=[2, 0]))
+    assert np.allclose(
+        sorting.frame_to_time(frames),
+        dense_times[frames] - dense_times[0],
+        atol=1e-6,
+    )
+
+    # Sortings without times are written with the times of the session
+    sorting = se.NumpySortingExtractor()
+    sorting.set_sampling_frequency(30000.0)
+    sorting.set_times_labels(np.array([10, 3000, 59999]), np.array([0, 0, 0]))
+    quick_write(
+        intan_folder_path=tmp_path,
+        session_description="test",
+        save_path=tmp_path / "test.nwb",
+        sorting=sorting,
+    )
+    with NWBHDF5IO(str(tmp_path / "test.nwb"), mode="r") as io:
+        spike_times = io.read().units["spike_times"][0]
+    np.testing.assert_allclose(spike_times, dense_times[[10, 3000, 59999]], atol=1e-6)
+
+
+def test_syntalos_times_are_not_dense(tmp_path):
+    num_frames = 5_000_000
+    make_syntalos_folder(tmp_path, num_frames=num_frames)
+    recording = SyntalosRecordingExtractor(tmp_path)
+    dense_bytes = 2 * num_frames * 8
+    spike_frames = np.arange(0, 2 * num_frames, 10_000)
+
+    tracemalloc.start()
+    try:
+        # Wrappers and preprocessors copy the times of their recording with copy_times
+        wrapped_recording = ReadCountingRecordingExtractor(
+            se.SubRecordingExtractor(recording, channel_ids=[0, 1])
+        )
+        sorting = se.NumpySortingExtractor()
+        sorting.set_sampling_frequency(30000.0)
+        sorting.set_times_labels(spike_frames, np.zeros(len(spike_frames), dtype=int))
+        copy_frame_times(sorting, recording)
+        nwbfile = NWBFile(
+            session_description="test",
+            identifier="test",
+            session_start_time=datetime.now().astimezone(),
+        )
+        se.NwbSortingExtractor.write_sorting(sorting, nwbfile=nwbfile, use_times=True)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert recording._times is None and wrapped_recording._times is None
+    assert sorting._times is None
+    assert peak_bytes < dense_bytes / 10
+    np.testing.assert_array_equal(
+        nwbfile.units["spike_times"][0], recording.frame_to_time(spike_frames)
+    )
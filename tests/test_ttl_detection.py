@@ -0,0 +1,106 @@
+import numpy as np
+import spikeextractors as se
+
+from mease_lab_to_nwb.convert_ced.cedstimulusinterface import (
+    detect_ttl_edges,
+    intervals_from_traces,
+)
+
+
+def intervals_from_traces_loop(recording, channel_id):
+    """Sample-by-sample reference implementation of the TTL interval detection."""
+    tr = recording.get_traces(channel_id)[0]
+    dt = 1.0 / recording.get_sampling_frequency()
+    min_value = np.amin(tr)
+    peak_to_peak = np.ptp(tr)
+    threshold = min_value + 0.5 * peak_to_peak
+    n_upper_quartile = np.sum(tr > min_value + 0.75 * peak_to_peak)
+    n_lower_quartile = np.sum(tr < min_value + 0.25 * peak_to_peak)
+    if (n_upper_quartile + n_lower_quartile) / len(tr) < 0.75:
+        return [], []
+    data = []
+    timestamps = []
+    i = 0
+    n = len(tr)
+    while i < n and tr[i] > threshold:
+        i = i + 1
+    try:
+        while i < n:
+            while tr[i] <= threshold:
+                i = i + 1
+            interval_start = i * dt
+            while tr[i] > threshold:
+                i = i + 1
+            data.extend([1, -1])
+            timestamps.extend([interval_start, i * dt])
+    except IndexError:
+        assert i == len(tr)
+    return data, timestamps
+
+
+def make_ttl_recording(num_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    levels = np.repeat(rng.random(num_frames // 50 + 1) < 0.3, 50)[:num_frames]
+    trace = 5.0 * levels + rng.normal(0, 0.1, num_frames)
+    return se.NumpyRecordingExtractor(
+        timeseries=trace[np.newaxis].astype("float32"), sampling_frequency=30030.03
+    )
+
+
+def test_intervals_match_loop():
+    for seed, num_frames in enumerate([10, 1001, 30000]):
+        recording = make_ttl_recording(num_frames=num_frames, seed=seed)
+        data, timestamps = intervals_from_traces_loop(recording, 0)
+        interval_series = intervals_from_traces("test", "test", recording, 0)
+        assert np.array_equal(interval_series.data, data)
+        assert np.array_equal(interval_series.timestamps, timestamps)
+
+
+def test_hysteresis_and_min_pulse_width():
+    trace = np.zeros(20)
+    trace[[4, 5, 7, 8, 13]] = 1.0
+    trace[6] = 0.6
+    trace[9] = 0.4
+    rising, falling, final_state = detect_ttl_edges(trace, threshold=0.5)
+    assert np.array_equal(rising, [4, 13])
+    assert np.array_equal(falling, [9, 14])
+    rising, falling, final_state = detect_ttl_edges(
+        trace, threshold=0.5, hysteresis=0.3
+    )
+    assert np.array_equal(rising, [4, 13])
+    assert np.array_equal(falling, [10, 14])
+    assert not final_state
+
+    recording = se.NumpyRecordingExtractor(
+        timeseries=trace[np.newaxis], sampling_frequency=1.0
+    )
+    interval_series = intervals_from_traces(
+        "test", "test", recording, 0, hysteresis=0.3, min_pulse_width=2.0
+    )
+    assert np.array_equal(interval_series.timestamps, [4.0, 10.0])
+
+
+def test_streaming_matches_full_trace():
+    recording = make_ttl_recording(num_frames=30000)
+    interval_series = intervals_from_traces("test", "test", recording, 0)
+    assert len(interval_series.timestamps) > 0
+    for chunk_size in [7, 1000, 50000]:
+        streamed_interval_series = intervals_from_traces(
+            "test", "test", recording, 0, chunk_size=chunk_size
+        )
+        assert np.array_equal(
+            streamed_interval_series.timestamps, interval_series.timestamps
+        )
+
+    # ADC-like trace with few distinct levels, counted exactly in a single pass
+    levels = np.round(recording.get_traces()[0] * 10) / 10
+    recording = se.NumpyRecordingExtractor(
+        timeseries=levels[np.newaxis], sampling_frequency=30030.03
+    )
+    interval_series = intervals_from_traces("test", "test", recording, 0)
+    streamed_interval_series = intervals_from_traces(
+        "test", "test", recording, 0, chunk_size=777
+    )
+    assert np.array_equal(
+        streamed_interval_series.timestamps, interval_series.timestamps
+    )
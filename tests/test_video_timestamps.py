@@ -0,0 +1,68 @@
+import numpy as np
+
+from mease_lab_to_nwb.convert_syntalos.syntalosimageinterface import (
+    concatenate_video_timestamps,
+    find_camera_folders,
+    list_video_files,
+    load_frame_index,
+    locate_frame,
+    make_frame_index,
+    save_frame_index,
+)
+
+
+def write_video_segments(folder_path, num_segments, frames_per_segment=5):
+    for i in range(num_segments):
+        (folder_path / f"TIS Camera_{i + 1}.mkv").touch()
+        frames = np.arange(i * frames_per_segment, (i + 1) * frames_per_segment)
+        with open(folder_path / f"TIS Camera_{i + 1}_timestamps.csv", "w") as f:
+            f.write("frame; timestamp\n")
+            f.writelines(f"{frame}; {frame * 40}\n" for frame in frames)
+
+
+def test_video_segments_are_sorted(tmp_path):
+    write_video_segments(tmp_path, 12)
+    video_file_paths = list_video_files(tmp_path)
+    assert [x.name for x in video_file_paths] == [
+        f"TIS Camera_{i + 1}.mkv" for i in range(12)
+    ]
+
+
+def test_concatenate_video_timestamps(tmp_path):
+    write_video_segments(tmp_path, 12)
+    timestamps, frame_counts = concatenate_video_timestamps(
+        list_video_files(tmp_path), num_workers=4
+    )
+    assert frame_counts == [5] * 12
+    np.testing.assert_array_equal(timestamps, np.arange(60) * 40 / 1e3)
+
+
+def test_frame_index(tmp_path):
+    for camera in ["Camera B", "Camera A"]:
+        (tmp_path / camera).mkdir()
+        write_video_segments(tmp_path / camera, 3)
+    (tmp_path / "Camera A" / "TIS Camera_2_timestamps.csv").write_text(
+        "frame; timestamp\n" + "".join(f"{i}; {i}\n" for i in range(8))
+    )
+    camera_folder_paths = find_camera_folders(tmp_path)
+    assert [x.name for x in camera_folder_paths] == ["Camera A", "Camera B"]
+    assert find_camera_folders(tmp_path / "Camera A") == [tmp_path / "Camera A"]
+
+    camera_folder_path = camera_folder_paths[0]
+    assert load_frame_index(camera_folder_path) is None
+    video_file_paths = list_video_files(camera_folder_path)
+    _, frame_counts = concatenate_video_timestamps(video_file_paths)
+    frame_index = make_frame_index(video_file_paths, frame_counts)
+    assert frame_index["starting_frame"] == [0, 5, 13]
+    save_frame_index(camera_folder_path, frame_index)
+
+    frame_index = load_frame_index(camera_folder_path)
+    assert frame_index["frame_counts"] == [5, 8, 5]
+    assert locate_frame(frame_index, 0) == ("TIS Camera_1.mkv", 0)
+    assert locate_frame(frame_index, 5) == ("TIS Camera_2.mkv", 0)
+    assert locate_frame(frame_index, 17) == ("TIS Camera_3.mkv", 4)
+
+    (camera_folder_path / "TIS Camera_3_timestamps.csv").write_text(
+        "frame; timestamp\n"
+    )
+    assert load_frame_index(camera_folder_path) is None